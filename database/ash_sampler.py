@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+# Active session history sampled by the collector.
+# v$session is polled every second or so and each sample is counted in a
+# fixed-size ring of array('H') rows, one row per sample and one column
+# per (wait class, event, sql id) key, so memory does not grow with the
+# number of samples or sessions. Only per-minute aggregates are written:
+#   oracle_ash,wait_class=..,event=..,sql_id=.. samples=..,aas=..,p50=..,p90=..,max=..
+#   oracle_ash_total samples=..,sessions=..,aas=..,p50=..,p90=..,max=..,keys=..,overflow=..
+# where samples are the session samples of a key, aas the average active
+# sessions and p50/p90/max the percentiles of the active sessions per
+# sample over the minute. Keys beyond max_keys in a minute, and those
+# outside the top keys when writing, are counted under wait_class=Other.
+import math
+from array import array
+
+# Sessions on CPU or waiting on a non-idle event, as ASH samples them
+ASH_QUERY = """
+select decode(state, 'WAITING', wait_class, 'CPU'),
+    decode(state, 'WAITING', event, 'ON CPU'),
+    sql_id
+from v$session
+where status = 'ACTIVE'
+and (state <> 'WAITING' or wait_class <> 'Idle')
+and sid <> sys_context('USERENV', 'SID')
+"""
+# key of the samples not counted under their own key
+OTHER = ('Other', 'other', '')
+
+
+# Nearest-rank percentile of sorted values
+def percentile(values, percent):
+    return values[max(0, int(math.ceil(percent * len(values) / 100.0)) - 1)]
+
+
+def distribution(values):
+    values = sorted(values)
+    return {'p50': percentile(values, 50), 'p90': percentile(values, 90),
+            'max': values[-1]}
+
+
+class ASHSampler():
+    def __init__(self, slots=61, max_keys=1000, top=50):
+        # samples kept, one minute of them; when a minute gets more the
+        # oldest are overwritten
+        self.slots = max(1, slots)
+        self.max_keys = max(2, max_keys)
+        # keys written per minute
+        self.top = top
+        self.zero_row = array('H', bytes(2 * self.max_keys))
+        self.reset()
+
+    def reset(self):
+        # active sessions of key column c in sample slot s at
+        # counts[s * max_keys + c]
+        self.counts = array('H', bytes(2 * self.slots * self.max_keys))
+        self.totals = array('H', bytes(2 * self.slots))
+        self.keys = {OTHER: 0}
+        self.samples = 0
+        # session samples counted under OTHER for lack of a column
+        self.overflow = 0
+        self.start = None
+
+    def column(self, key):
+        column = self.keys.get(key)
+        if column is None:
+            if len(self.keys) >= self.max_keys:
+                self.overflow += 1
+                return 0
+            column = self.keys[key] = len(self.keys)
+        return column
+
+    # Count one sample: rows of (wait class, event, sql id)
+    def add(self, rows, now):
+        if self.start is None:
+            self.start = now
+        slot = self.samples % self.slots
+        base = slot * self.max_keys
+        if self.samples >= self.slots:
+            self.counts[base:base + self.max_keys] = self.zero_row
+        counts = self.counts
+        for wait_class, event, sql_id in rows:
+            counts[base + self.column((wait_class, event, sql_id or ''))] += 1
+        self.totals[slot] = len(rows)
+        self.samples += 1
+
+    # True once now is in a later minute than the first sample
+    def due(self, now):
+        return self.start is not None and \
+            int(now // 60) != int(self.start // 60)
+
+    # Nanosecond time of the minute being sampled
+    def time(self):
+        return int(self.start // 60) * 60 * 1000000000
+
+    # Aggregates of the minute, as (measurement, tags, fields), and start
+    # the next minute
+    def aggregates(self):
+        count = min(self.samples, self.slots)
+        if not count:
+            self.reset()
+            return []
+        end = count * self.max_keys
+        series = []
+        for key, column in self.keys.items():
+            values = self.counts[column:end:self.max_keys]
+            samples = sum(values)
+            if samples and key != OTHER:
+                series.append((samples, key, values))
+        series.sort(key=lambda item: item[0], reverse=True)
+        other = array('H', self.counts[0:end:self.max_keys])
+        for samples, key, values in series[self.top:]:
+            for i, value in enumerate(values):
+                other[i] += value
+        series = series[:self.top]
+        if sum(other):
+            series.append((sum(other), OTHER, other))
+        aggregates = []
+        for samples, (wait_class, event, sql_id), values in series:
+            fields = {'samples': samples, 'aas': float(samples) / count}
+            fields.update(distribution(values))
+            aggregates.append(('oracle_ash', {
+                'wait_class': wait_class, 'event': event, 'sql_id': sql_id},
+                fields))
+        totals = self.totals[:count]
+        fields = {'samples': count, 'sessions': sum(totals),
+                  'aas': float(sum(totals)) / count,
+                  'keys': len(self.keys) - 1, 'overflow': self.overflow}
+        fields.update(distribution(totals))
+        aggregates.append(('oracle_ash_total', {}, fields))
+        self.reset()
+        return aggregates
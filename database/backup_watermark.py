@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+# Incremental MSSQL backup history.
+# Instead of grouping the whole msdb backup history every run, remember
+# the highest backup_set_id seen and the latest full backup of every
+# database in a small JSON state file per server:
+#   {"watermark": backup_set_id, "finish": "last finish date",
+#    "databases": {name: {"start": .., "finish": .., "size": ..,
+#                         "devices": [physical device name, ...]}}}
+# Each run only reads the backups newer than the watermark, and the
+# Backup age is computed from the server's current date, so it still
+# grows between backups. When the history goes backwards (msdb restored
+# or rebuilt) the state is dropped and the history is read again.
+import datetime
+import json
+import os
+
+
+def parse_date(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.fromisoformat(value)
+
+
+# DATEDIFF(day, start, end): day boundaries crossed
+def days_between(start, end):
+    return (end.date() - start.date()).days
+
+
+class BackupWatermark():
+    def __init__(self, path):
+        self.path = path
+        self.state = self.empty()
+        try:
+            with open(path) as f:
+                state = json.load(f)
+            if isinstance(state.get('databases'), dict):
+                self.state = state
+        except (OSError, ValueError, AttributeError):
+            pass
+
+    @staticmethod
+    def empty():
+        return {'watermark': 0, 'finish': None, 'databases': {}}
+
+    @property
+    def watermark(self):
+        return self.state['watermark']
+
+    # latest backup_set_id on the server. Returns True when the history
+    # was reset and has to be read again from the start.
+    def check(self, latest):
+        if latest is not None and latest < self.watermark:
+            self.state = self.empty()
+            return True
+        return False
+
+    # New full backups, as (backup_set_id, database_name, start, finish,
+    # size, physical_device_name) in backup_set_id order, read up to the
+    # latest backup_set_id
+    def update(self, rows, latest):
+        databases = self.state['databases']
+        for backup_set_id, database, start, finish, size, device in rows:
+            finish = parse_date(finish)
+            known = databases.get(database)
+            last = parse_date(known['finish']) if known else None
+            if last is None or finish > last:
+                databases[database] = {
+                    'start': format(start),
+                    'finish': format(finish),
+                    'size': int(size or 0),
+                    'devices': [device],
+                }
+            elif finish == last and device not in known['devices']:
+                # backup striped over several devices
+                known['devices'].append(device)
+            self.state['finish'] = format(finish)
+        # other backup types up to latest need not be read again either
+        self.state['watermark'] = max(self.state['watermark'], latest)
+
+    # Points of the latest full backup of every database, as of now
+    # (the server's date)
+    def points(self, now, measurement, base_tags):
+        points = []
+        for database in sorted(self.state['databases']):
+            backup = self.state['databases'][database]
+            start = parse_date(backup['start'])
+            finish = parse_date(backup['finish'])
+            for device in backup['devices']:
+                tags = dict(base_tags)
+                tags['Physical name'] = format(device)
+                points.append({
+                    "measurement": measurement,
+                    "tags": tags,
+                    "fields": {
+                        'Start time': backup['start'],
+                        'End time': backup['finish'],
+                        'Total time': days_between(finish, start),
+                        'Size': int(backup['size']),
+                        'Backup age': days_between(finish, now),
+                    }
+                })
+        return points
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f, separators=(',', ':'))
+        os.replace(tmp, self.path)
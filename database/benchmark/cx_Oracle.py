@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+# Stand-in for cx_Oracle used by benchmark_collectors.py.
+# Every query of the Oracle collectors gets a synthetic result set of
+# ROWS tablespaces, users, redo log members, ... built once per query
+# text, so the benchmark measures the plugin and not the fake.
+import datetime
+
+# rows of every multi-row result set, set by the benchmark
+ROWS = 100
+SPOOL_ATTRVAL_WAIT = 1
+SPOOL_ATTRVAL_TIMEDWAIT = 3
+
+
+class Error(Exception):
+    pass
+
+
+class DatabaseError(Error):
+    pass
+
+
+class InterfaceError(Error):
+    pass
+
+
+def result_set(sql):
+    s = sql.lower()
+    now = datetime.datetime(2024, 1, 1)
+    n = ROWS
+    if 'v_$instance' in s and 'sysdate' in s:
+        return [(86400.5,)]
+    if 'database_status' in s:
+        return [('ACTIVE',)]
+    if 'from v$database' in s:
+        return [(now, 'READ WRITE', 'ARCHIVELOG', 'PRIMARY', 'CURRENT',
+                 'NOT ALLOWED', 'MAXIMUM PERFORMANCE', 'NO', 'NONE', 'NO')]
+    if 'v$filestat' in s:
+        return [('TS%d' % (i), 1000 * i, 500 * i, 100 * i, 50 * i)
+                for i in range(n)]
+    if 'dba_free_space' in s or 'dba_tablespace_usage_metrics' in s:
+        return [('TS%d' % (i), 'PERMANENT', 'ONLINE', 1048576 * i,
+                 2097152, 256) for i in range(n)]
+    if 'dba_data_files' in s:
+        return [('TS%d' % (i), 4, 4194304 * i, 512 * i) for i in range(n)]
+    if 'v$logfile' in s:
+        return [(i // 2, 1, 1000 + i, 52428800, 2, 'YES', 'INACTIVE', now,
+                 '/u01/redo/redo%02d.log' % (i), None) for i in range(n)]
+    if 'dba_users' in s:
+        return [('USER%d' % (i), now, 180 - i % 180, 'OPEN', 'DEFAULT')
+                for i in range(n)]
+    if 'dba_db_links' in s:
+        return [('LINK%d' % (i), 'SYSTEM', 'REMOTE', 'db%d' % (i), now)
+                for i in range(n)]
+    return []
+
+
+class Cursor():
+    arraysize = 100
+    prefetchrows = 2
+    cache = {}
+
+    def __init__(self):
+        self.rows = []
+        self.position = 0
+
+    def execute(self, sql, *args, **kwargs):
+        key = (sql, ROWS)
+        rows = self.cache.get(key)
+        if rows is None:
+            rows = self.cache[key] = result_set(sql)
+        self.rows = rows
+        self.position = 0
+
+    def fetchmany(self, size=None):
+        size = size or self.arraysize
+        rows = self.rows[self.position:self.position + size]
+        self.position += len(rows)
+        return rows
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchall(self):
+        rows = self.rows[self.position:]
+        self.position = len(self.rows)
+        return rows
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def close(self):
+        pass
+
+
+class Connection():
+    def __init__(self):
+        self.callTimeout = 0
+
+    def cursor(self):
+        return Cursor()
+
+    def ping(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def connect(*args, **kwargs):
+    return Connection()
+
+
+class SessionPool():
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def acquire(self):
+        return Connection()
+
+    def release(self, connection):
+        pass
+
+    def close(self, force=False):
+        pass
@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+# Stand-in for pymssql used by benchmark_collectors.py.
+# Every query of the MSSQL collectors gets a synthetic result set of
+# ROWS databases, backups, performance counters, wait types, ...
+# Cumulative counters grow with every query so rates are not all zero.
+import datetime
+import decimal
+
+# rows of every multi-row result set, set by the benchmark
+ROWS = 100
+
+# cntr_type of sys.dm_os_performance_counters
+COUNTER_TYPES = (65792, 272696576, 537003264, 1073939712,
+                 1073874176, 1073939712)
+
+
+class Error(Exception):
+    pass
+
+
+class OperationalError(Error):
+    pass
+
+
+class Counters():
+    calls = 0
+
+
+def result_set(sql):
+    s = sql.lower()
+    now = datetime.datetime(2024, 1, 1)
+    n = ROWS
+    Counters.calls += 1
+    tick = Counters.calls * 1000
+    if 'master_files' in s:
+        return [('db%d' % (i), 0, 1024 * i) for i in range(n)]
+    if 'sqlperf' in s:
+        return [('db%d' % (i), 512.0, 12.5, 0) for i in range(n)]
+    if 'max(backup_set_id)' in s:
+        return [(now, n)]
+    if 'backup_set_id >' in s:
+        return [(i + 1, 'db%d' % (i), now, now, decimal.Decimal(1048576 * i),
+                 '/backup/db%d.bak' % (i)) for i in range(n)]
+    if 'backupset' in s:
+        return [(now, now, 0, decimal.Decimal(1048576 * i),
+                 '/backup/db%d.bak' % (i), 1, 'SQL01', None, None, None, None)
+                for i in range(n)]
+    if 'dm_os_sys_info' in s:
+        return [(now,)]
+    if 'performance_counters' in s:
+        rows = []
+        for i in range(n):
+            obj = 'SQLServer:Object%d' % (i // 6)
+            name = ('Raw', 'Bulk/sec', 'Ratio', 'Ratio base', 'Avg (ms)',
+                    'Avg Base')[i % 6]
+            kind = COUNTER_TYPES[i % 6]
+            value = 50 if kind == 537003264 else i + tick
+            rows.append((obj, name, 'instance', value, kind))
+        return rows
+    if 'wait_stats' in s:
+        return [('WAIT_%d' % (i), tick + i, (tick + i) * 3, tick)
+                for i in range(n)]
+    return []
+
+
+class Cursor():
+    arraysize = 1
+
+    def __init__(self):
+        self.rows = []
+        self.position = 0
+
+    def execute(self, sql, *args):
+        self.rows = result_set(sql)
+        self.position = 0
+
+    def fetchmany(self, size=None):
+        size = size or self.arraysize
+        rows = self.rows[self.position:self.position + size]
+        self.position += len(rows)
+        return rows
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchall(self):
+        rows = self.rows[self.position:]
+        self.position = len(self.rows)
+        return rows
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def close(self):
+        pass
+
+
+# the _mssql connection under a pymssql connection
+class MSSQLConnection():
+    query_timeout = 0
+
+
+class Connection():
+    def __init__(self):
+        self._conn = MSSQLConnection()
+
+    def cursor(self):
+        return Cursor()
+
+    def close(self):
+        pass
+
+
+def connect(*args, **kwargs):
+    return Connection()
@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+# Offline benchmark of the collectors' own overhead.
+# cx_Oracle and pymssql are replaced by the stand-ins in benchmark/,
+# returning synthetic result sets of -rows rows, and InfluxDB by a local
+# HTTP server recording the write requests. Each collector runs one full
+# plugin run (connect, collect, finish, stats, flush) -repeat times and
+# the report gives per run:
+#   wall time, points written, points/sec, HTTP requests, bytes and
+#   line protocol lines received, and the peak memory allocated (from a
+#   separate tracemalloc run)
+#   ./benchmark_collectors.py -rows 1000 -repeat 5
+# Arguments not known here are passed on to the collectors, e.g.
+#   ./benchmark_collectors.py -driver oracle -parallel 4 -batch_size 500
+import argparse
+import gzip
+import os
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# the stand-in drivers are imported instead of the real ones
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'benchmark'))
+
+import cx_Oracle  # noqa: E402
+import pymssql  # noqa: E402
+
+
+class InfluxRecorder(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        self.server.record(len(body), len(body.splitlines()))
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        body = b'{"results":[{"statement_id":0}]}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeInfluxDB(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', 0), InfluxRecorder)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def record(self, size, lines):
+        with self.lock:
+            self.requests += 1
+            self.bytes += size
+            self.lines += lines
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.bytes = 0
+            self.lines = 0
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.server_address[1]
+
+
+def collector_setup(driver, port, extra):
+    common = ['-influx_db', 'benchmark', '-influx_host', '127.0.0.1',
+              '-influx_port', str(port), '-timeout', '0']
+    if driver == 'oracle':
+        import check_oracle_metrics as module
+        argv = common + ['-oracle_user', 'benchmark', '-oracle_password',
+                         'benchmark', '-oracle_sid', 'benchmark']
+        collector_class = module.OracleMetrics
+    else:
+        import check_mssql_metrics as module
+        argv = common + ['-mssql_server', 'benchmark', '-mssql_user',
+                         'benchmark', '-mssql_password', 'benchmark']
+        collector_class = module.MSSQLMetrics
+    saved = sys.argv
+    sys.argv = [module.__file__] + argv + extra
+    try:
+        args = module.parse_args()
+    finally:
+        sys.argv = saved
+    return collector_class, args
+
+
+# One plugin run, as the collectors' __main__ does it
+def plugin_run(collector_class, args):
+    collector = collector_class(args)
+    try:
+        collector.collect(collector.collectors)
+        collector.finish()
+        collector.write_stats()
+        collector.flush()
+    finally:
+        collector.close()
+    return collector.point_buffer.points_written
+
+
+class Result():
+    def __init__(self, driver):
+        self.driver = driver
+        self.seconds = []
+        self.points = 0
+        self.requests = 0
+        self.bytes = 0
+        self.lines = 0
+        self.peak = 0
+
+    def report(self):
+        seconds = statistics.median(self.seconds)
+        return "%-7s wall=%.1fms points=%d points/s=%.0f http=%d " \
+            "http_bytes=%d http_lines=%d peak=%.0fKiB" % (
+                self.driver, seconds * 1000, self.points,
+                self.points / seconds if seconds else 0, self.requests,
+                self.bytes, self.lines, self.peak / 1024.0)
+
+
+def benchmark(driver, server, extra, repeat):
+    collector_class, args = collector_setup(
+        driver, server.server_address[1], extra)
+    result = Result(driver)
+    # warm up imports and the fake result sets
+    plugin_run(collector_class, args)
+    for i in range(repeat):
+        server.reset()
+        started = time.perf_counter()
+        result.points = plugin_run(collector_class, args)
+        result.seconds.append(time.perf_counter() - started)
+        result.requests = server.requests
+        result.bytes = server.bytes
+        result.lines = server.lines
+    # tracemalloc slows the run down, so memory is measured on its own
+    tracemalloc.start()
+    try:
+        plugin_run(collector_class, args)
+        result.peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result
+
+
+def parse_args():
+    """Parse the args."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark the collectors against fake databases and a fake InfluxDB")
+    parser.add_argument('-driver', required=False, default='all',
+                        choices=['oracle', 'mssql', 'all'],
+                        help='collector to benchmark. Default all')
+    parser.add_argument('-rows', type=int, required=False, default=100,
+                        help='rows of every multi-row result set: tablespaces, users, redo members... Default 100')
+    parser.add_argument('-repeat', type=int, required=False, default=5,
+                        help='runs of each collector, the median is reported. Default 5')
+    return parser.parse_known_args()
+
+
+if __name__ == "__main__":
+    args, extra = parse_args()
+    cx_Oracle.ROWS = pymssql.ROWS = args.rows
+    server = FakeInfluxDB()
+    server.start()
+    drivers = ['oracle', 'mssql'] if args.driver == 'all' else [args.driver]
+    print("rows=%d repeat=%d %s" % (args.rows, args.repeat, ' '.join(extra)))
+    for driver in drivers:
+        print(benchmark(driver, server, extra, max(1, args.repeat)).report())
+    server.shutdown()
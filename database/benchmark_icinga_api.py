@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+# Benchmark of the passive check result submission (icinga_api.py).
+# A local HTTP server stands in for the Icinga2 API: it answers
+# process-check-result like Icinga does (404 for unknown services) after
+# -delay milliseconds, and counts requests and connections. -services
+# results are submitted -rounds times, so all but the last round of a
+# service are coalesced while they wait, then the queue is sent.
+#   ./benchmark_icinga_api.py -services 500 -connections 4 -delay 5
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from icinga_api import CHECK_RESULT_PATH, IcingaSink
+
+
+class IcingaRecorder(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, do not wait for the ACK
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.record_connection()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(
+            int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        name = body.get('service') or body.get('host')
+        if self.path != CHECK_RESULT_PATH or name.endswith('!unknown'):
+            status = 404
+            response = {'error': 404, 'status': 'No objects found.'}
+        else:
+            status = 200
+            response = {'results': [{
+                'code': 200.0,
+                'status': "Successfully processed check result for object '%s'." % (name)}]}
+            self.server.record_result(name, body)
+        data = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeIcinga(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, delay=0):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', 0), IcingaRecorder)
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        # last result of each object
+        self.results = {}
+
+    def record_connection(self):
+        with self.lock:
+            self.connections += 1
+
+    def record_result(self, name, body):
+        with self.lock:
+            self.requests += 1
+            self.results[name] = body
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return 'http://127.0.0.1:%d' % (self.server_address[1])
+
+
+def parse_args():
+    """Parse the args."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Icinga2 API check result submission against a fake Icinga")
+    parser.add_argument('-services', type=int, required=False, default=500,
+                        help='services with a check result. Default 500')
+    parser.add_argument('-rounds', type=int, required=False, default=3,
+                        help='results submitted per service. Default 3')
+    parser.add_argument('-connections', type=int, required=False, default=4,
+                        help='keep-alive connections. Default 4')
+    parser.add_argument('-queue', type=int, required=False, default=1000,
+                        help='queued results before the oldest are dropped. Default 1000')
+    parser.add_argument('-delay', type=float, required=False, default=2,
+                        help='milliseconds the fake Icinga takes per result. Default 2')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = FakeIcinga(args.delay / 1000.0)
+    sink = IcingaSink(server.start(), 'benchmark', 'benchmark',
+                      connections=args.connections, max_queue=args.queue)
+    for cycle in range(max(1, args.rounds)):
+        for i in range(args.services):
+            sink.submit('db%d' % (i % 50), 'service%d' % (i), cycle % 3,
+                        'round %d' % (cycle), "'round'=%d 'label with space'=1s" % (cycle))
+    sink.submit('db0', 'unknown', 0, 'not configured in Icinga')
+    started = time.perf_counter()
+    sink.close()
+    seconds = time.perf_counter() - started
+    last = max(1, args.rounds) - 1
+    current = sum(1 for body in server.results.values()
+                  if body['plugin_output'] == 'round %d' % (last))
+    print("submitted=%d coalesced=%d dropped=%d sent=%d rejected=%d "
+          "requests=%d connections=%d latest=%d/%d time=%.1fms results/s=%.0f" % (
+              sink.submitted, sink.coalesced, sink.dropped, sink.sent,
+              sink.rejected, sink.requests, server.connections, current,
+              len(server.results), seconds * 1000,
+              sink.sent / seconds if seconds else 0))
+    server.shutdown()
@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+# Cold start benchmark of the check plugins.
+# Starts each plugin -repeat times in a fresh interpreter, as Icinga does,
+# and reports the median wall time of:
+#   usage  argument error (UNKNOWN) path
+#   run    a full run against the stand-in drivers in benchmark/ and a
+#          local fake InfluxDB
+# and the slowest imports of the usage path (python -X importtime).
+#   ./benchmark_startup.py -repeat 20
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmark_collectors import FakeInfluxDB
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PLUGINS = {
+    'oracle': ('check_oracle_metrics.py',
+               ['-oracle_user', 'benchmark', '-oracle_password', 'benchmark',
+                '-oracle_sid', 'benchmark']),
+    'mssql': ('check_mssql_metrics.py',
+              ['-mssql_server', 'benchmark', '-mssql_user', 'benchmark',
+               '-mssql_password', 'benchmark']),
+}
+
+
+def environment():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.join(DIRECTORY, 'benchmark')] +
+        [path for path in [env.get('PYTHONPATH')] if path])
+    return env
+
+
+def timed(command, env, repeat):
+    seconds = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        subprocess.run(command, env=env, cwd=DIRECTORY,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        seconds.append(time.perf_counter() - started)
+    return statistics.median(seconds)
+
+
+# (cumulative microseconds, module) of the slowest top-level imports
+def slowest_imports(command, env, count):
+    output = subprocess.run(
+        [command[0], '-X', 'importtime'] + command[1:], env=env,
+        cwd=DIRECTORY, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True).stderr
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative, name = line[len('import time:'):].split('|')
+        # top-level imports only
+        if not name.startswith('   '):
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def parse_args():
+    """Parse the args."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark the cold start of the check plugins")
+    parser.add_argument('-plugin', required=False, default='all',
+                        choices=['oracle', 'mssql', 'all'],
+                        help='plugin to benchmark. Default all')
+    parser.add_argument('-repeat', type=int, required=False, default=10,
+                        help='starts of each plugin, the median is reported. Default 10')
+    parser.add_argument('-imports', type=int, required=False, default=5,
+                        help='slowest imports listed per plugin. Default 5')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    env = environment()
+    server = FakeInfluxDB()
+    port = server.start()
+    repeat = max(1, args.repeat)
+    plugins = ['oracle', 'mssql'] if args.plugin == 'all' else [args.plugin]
+    for plugin in plugins:
+        script, credentials = PLUGINS[plugin]
+        command = [sys.executable, script]
+        usage = timed(command, env, repeat)
+        run = timed(command + credentials + [
+            '-influx_db', 'benchmark', '-influx_host', '127.0.0.1',
+            '-influx_port', str(port)], env, repeat)
+        print("%-7s usage=%.1fms run=%.1fms" % (
+            plugin, usage * 1000, run * 1000))
+        for cumulative, name in slowest_imports(command, env, args.imports):
+            print("        %8.1fms %s" % (cumulative / 1000.0, name))
+    server.shutdown()
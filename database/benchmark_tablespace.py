@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+# Compare the database cost of the full and fast tablespace_status_2
+# queries (-tablespace_mode of check_oracle_metrics.py) on one instance.
+# Each query is run -repeat times. The elapsed time and the change of the
+# session statistics in v$mystat are averaged per run, less the cost of
+# reading v$mystat itself:
+#   ./benchmark_tablespace.py -oracle_user u -oracle_password p -oracle_sid db
+import argparse
+import time
+
+import cx_Oracle
+
+from metric_catalog import DEFAULT_CATALOG, load_catalog
+
+STATISTICS = (
+    'CPU used by this session',
+    'session logical reads',
+    'consistent gets',
+    'physical reads',
+    'recursive calls',
+    'sorts (memory)',
+)
+
+
+class TablespaceBenchmark():
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = connection.cursor()
+
+    def statistics(self):
+        self.cursor.execute("""
+        SELECT n.name, s.value
+            FROM v$mystat s, v$statname n
+            WHERE s.statistic# = n.statistic#
+            AND n.name IN (%s)
+        """ % (', '.join("'%s'" % (name) for name in STATISTICS)))
+        return dict(self.cursor.fetchall())
+
+    # Average elapsed seconds and statistics deltas of one run of sql
+    def measure(self, sql, repeat):
+        totals = dict((name, 0) for name in STATISTICS)
+        elapsed = 0.0
+        rows = 0
+        for i in range(repeat):
+            before = self.statistics()
+            started = time.monotonic()
+            if sql:
+                cursor = self.connection.cursor()
+                cursor.execute(sql)
+                rows = len(cursor.fetchall())
+                cursor.close()
+            elapsed += time.monotonic() - started
+            after = self.statistics()
+            for name in STATISTICS:
+                totals[name] += after.get(name, 0) - before.get(name, 0)
+        averages = dict((name, float(value) / repeat)
+                        for name, value in totals.items())
+        return elapsed / repeat, averages, rows
+
+    def run(self, queries, repeat):
+        # cost of reading v$mystat, taken off every query
+        overhead_elapsed, overhead, rows = self.measure(None, repeat)
+        results = []
+        for mode, sql in queries:
+            # first run parses and warms the cache
+            self.measure(sql, 1)
+            elapsed, averages, rows = self.measure(sql, repeat)
+            for name in STATISTICS:
+                averages[name] = max(0.0, averages[name] - overhead[name])
+            results.append((mode, max(0.0, elapsed - overhead_elapsed),
+                            averages, rows))
+        return results
+
+
+def report(results, repeat):
+    lines = ["tablespace_status_2 cost per run, average of %d runs" % (repeat)]
+    width = max(len(name) for name in STATISTICS + ('elapsed ms', 'rows'))
+    lines.append('%-*s %s' % (width, '', ' '.join(
+        '%12s' % (mode) for mode, elapsed, averages, rows in results)))
+    lines.append('%-*s %s' % (width, 'elapsed ms', ' '.join(
+        '%12.1f' % (elapsed * 1000) for mode, elapsed, averages, rows
+        in results)))
+    lines.append('%-*s %s' % (width, 'rows', ' '.join(
+        '%12d' % (rows) for mode, elapsed, averages, rows in results)))
+    for name in STATISTICS:
+        lines.append('%-*s %s' % (width, name, ' '.join(
+            '%12.1f' % (averages[name]) for mode, elapsed, averages, rows
+            in results)))
+    return '\n'.join(lines)
+
+
+def parse_args():
+    """Parse the args."""
+    parser = argparse.ArgumentParser(
+        description="Compare the cost of the full and fast tablespace_status_2 queries")
+    parser.add_argument(
+        '-oracle_user', help="Oracle username with sys views grant", required=True)
+    parser.add_argument('-oracle_password', required=True)
+    parser.add_argument(
+        '-oracle_sid', help="tnsnames SID to connect", required=True)
+    parser.add_argument('-catalog', type=str, required=False,
+                        default=DEFAULT_CATALOG,
+                        help='JSON metric catalog. Default metric_catalog.json next to this script')
+    parser.add_argument('-repeat', type=int, required=False, default=5,
+                        help='runs of each query. Default 5')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    queries = []
+    for mode in ('full', 'fast'):
+        variants = {} if mode == 'full' else {'tablespace_status_2': mode}
+        for metric in load_catalog(args.catalog, 'oracle', variants):
+            if metric.name == 'tablespace_status_2':
+                queries.append((mode, metric.sql))
+    connection = cx_Oracle.connect(
+        args.oracle_user, args.oracle_password, args.oracle_sid)
+    try:
+        results = TablespaceBenchmark(connection).run(
+            queries, max(1, args.repeat))
+    finally:
+        connection.close()
+    print(report(results, max(1, args.repeat)))
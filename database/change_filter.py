@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+# Change-only emission for series whose values rarely change.
+# For every series (measurement + tag set) of the selected measurements the
+# filter keeps a fingerprint of the last written field values. A point
+# whose values did not change is dropped, unless the series was last
+# written more than heartbeat seconds ago.
+# State is a binary file of fixed-size records:
+#   series hash (8 bytes), fields hash (8 bytes), last write epoch (4 bytes)
+import hashlib
+import os
+import struct
+import threading
+import time
+
+RECORD = struct.Struct('<QQI')
+
+
+def digest(value):
+    return int.from_bytes(
+        hashlib.blake2b(repr(value).encode(), digest_size=8).digest(),
+        'little')
+
+
+class ChangeFilter():
+    def __init__(self, path, measurements, heartbeat=3600):
+        self.path = path
+        self.measurements = set(measurements)
+        self.heartbeat = heartbeat
+        self.lock = threading.Lock()
+        # series hash -> (fields hash, last write epoch)
+        self.series = {}
+        # updates not yet known to be written
+        self.pending = {}
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            data = b''
+        for offset in range(0, len(data) - RECORD.size + 1, RECORD.size):
+            series, fields, written = RECORD.unpack_from(data, offset)
+            self.series[series] = (fields, written)
+
+    # True when the point has to be written
+    def changed(self, point):
+        if point['measurement'] not in self.measurements:
+            return True
+        series = digest((point['measurement'],
+                         sorted(point['tags'].items())))
+        fields = digest(sorted(point['fields'].items()))
+        now = int(time.time())
+        with self.lock:
+            last = self.pending.get(series) or self.series.get(series)
+            if last and last[0] == fields and now - last[1] < self.heartbeat:
+                return False
+            self.pending[series] = (fields, now)
+        return True
+
+    # Called once the points let through were written
+    def commit(self):
+        with self.lock:
+            if not self.pending:
+                return
+            self.series.update(self.pending)
+            self.pending = {}
+            data = b''.join(RECORD.pack(series, fields, written)
+                            for series, (fields, written)
+                            in self.series.items())
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+
+    # Called when a write failed so those points are sent again next time
+    def rollback(self):
+        with self.lock:
+            self.pending = {}
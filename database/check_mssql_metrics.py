@@ -2,13 +2,45 @@
 # Check MSSQL metrics and export to InfluxDB
 # Author: Le Anh Tuan (tuan.le@netnam.vn/latuannetnam@gmail.com)
 import sys
-import argparse
-from influxdb import InfluxDBClient
-import pymssql
+import functools
+import math
+import time
+from point import Point, Series
+from spool import spool_status
+from result_cache import ResultCache, cache_path
+from change_filter import ChangeFilter
+from metric_catalog import load_catalog
+from run_stats import RunStats
+from deadline import Deadline
+from mssql_counters import MSSQLCounters, Snapshot
+from backup_watermark import BackupWatermark
+from thresholds import ThresholdEngine
+from collector_plugin import (ArgumentParser, catalog_args, check_args,
+                              common_args, flush_points, make_point_buffer,
+                              run)
+
+
+# The driver is imported by the first collector, so argument errors and
+# -h do not pay for loading it
+pymssql = None
+
+
+def load_driver():
+    global pymssql
+    if pymssql is None:
+        import pymssql as driver
+        pymssql = driver
+    return pymssql
 
 
 class MSSQLMetrics():
-    def __init__(self, args):
+    # Collector methods written in code. The methods declared in the
+    # metric catalog are added to these.
+    collectors = ['database_details']
+    # added with -perf_mode run|persist
+    perf_collectors = ['performance_counters', 'wait_stats']
+
+    def __init__(self, args, point_buffer=None):
         self.hostname = args.hostname
         self.host_group = args.host_group
         self.influx_host = args.influx_host
@@ -21,12 +53,149 @@ class MSSQLMetrics():
         self.mssql_user = args.mssql_user
         self.mssql_password = args.mssql_password
         self.mssql_database = args.mssql_database
+        # no run budget in daemon mode, only query timeouts
+        self.deadline = None if args.daemon else Deadline(
+            args.timeout, args.query_timeout)
+        self.query_timeout = args.query_timeout
+        self.arraysize = args.arraysize
+        # methods not run or cut short, as "method (reason)"
+        self.skipped = []
+        self.db_connection = None
+        self.run_stats = RunStats()
+        self.db_errors = (load_driver().Error,)
+        self.connect()
+        self.base_tags = {
+            "hostname": format(self.hostname),
+            "host_group": format(self.host_group),
+        }
+        # Series by (measurement, tag key), escaped once per run
+        self.series = {}
+        self.collectors = list(self.collectors)
+        for metric in args.catalog_metrics:
+            setattr(self, metric.name, functools.partial(metric.run, self))
+            self.collectors.append(metric.name)
+        self.result_cache = None
+        if args.cache_dir:
+            self.result_cache = ResultCache(
+                cache_path(args.cache_dir, self.host_group, self.hostname,
+                           self.mssql_server, self.mssql_port),
+                args.cache_ttls, args.cache_reemit)
+        if point_buffer is None:
+            point_buffer = make_point_buffer(args)
+        self.point_buffer = point_buffer
+        if self.result_cache is not None:
+            self.point_buffer.committers.append(self.result_cache)
+        self.thresholds = None
+        if args.thresholds:
+            self.thresholds = ThresholdEngine(args.thresholds)
+            self.point_buffer.observers.append(self.thresholds.observe)
+        if args.change_dir:
+            self.point_buffer.point_filter = ChangeFilter(
+                cache_path(args.change_dir, self.host_group, self.hostname,
+                           self.mssql_server, self.mssql_port, suffix='.state'),
+                args.change_measurements,
+                args.change_heartbeat)
+        self.perf_mode = args.perf_mode
+        self.perf_sample = args.perf_sample
+        self.counters = None
+        if self.perf_mode != 'none':
+            self.collectors += self.perf_collectors
+            state_path = None
+            if self.perf_mode == 'persist' and args.rate_dir:
+                state_path = cache_path(
+                    args.rate_dir, self.host_group, self.hostname,
+                    self.mssql_server, self.mssql_port, suffix='.counters')
+            self.counters = MSSQLCounters(state_path)
+        self.backup_watermark = None
+        if args.backup_state_dir:
+            self.backup_watermark = BackupWatermark(
+                cache_path(args.backup_state_dir, self.host_group,
+                           self.hostname, self.mssql_server, self.mssql_port,
+                           suffix='.backups'))
+            # replaces the full history query of the catalog
+            self.backup_details = self.incremental_backup_details
 
+    def connect(self):
+        self.close()
+        started = time.monotonic()
+        login_timeout = 60
+        if self.deadline is not None and self.deadline.next_timeout():
+            login_timeout = max(1, math.ceil(self.deadline.next_timeout()))
+        elif self.query_timeout:
+            login_timeout = max(1, math.ceil(self.query_timeout))
         self.db_connection = pymssql.connect(server=self.mssql_server, user=self.mssql_user,
-                                             password=self.mssql_password, database=self.mssql_database, charset='UTF-8', port=self.mssql_port)
-        self.influx_client = InfluxDBClient(
-            self.influx_host, self.influx_port, self.influx_user,
-            self.influx_password, self.influx_db)
+                                             password=self.mssql_password, database=self.mssql_database, charset='UTF-8', port=self.mssql_port,
+                                             login_timeout=login_timeout, timeout=math.ceil(self.query_timeout))
+        self.run_stats.connect_seconds += time.monotonic() - started
+
+    def close(self):
+        if self.db_connection is not None:
+            try:
+                self.db_connection.close()
+            except pymssql.Error:
+                pass
+            self.db_connection = None
+
+    # True while the database still answers, so an error of one query
+    # (missing table, query timeout...) does not force a reconnect
+    def ping(self):
+        if self.db_connection is None:
+            return False
+        try:
+            cursor = self.db_connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+        except pymssql.Error:
+            return False
+        return True
+
+    def run_method(self, method):
+        started = time.monotonic()
+        points = self.point_buffer.added()
+        if self.result_cache is None:
+            rows = getattr(self, method)()
+        else:
+            rows = self.result_cache.run(method, getattr(self, method),
+                                         self.point_buffer)
+        self.run_stats.record(method, time.monotonic() - started, rows,
+                              self.point_buffer.added() - points)
+
+    def cursor(self):
+        return self.db_connection.cursor()
+
+    # Limit the next queries to the query timeout and what is left of the
+    # run budget. pymssql takes its timeout at connect time, the _mssql
+    # connection under it can change it.
+    def set_query_timeout(self):
+        if self.deadline is not None:
+            timeout = self.deadline.next_timeout()
+        else:
+            timeout = self.query_timeout or None
+        self.db_connection._conn.query_timeout = \
+            0 if timeout is None else max(1, math.ceil(timeout))
+
+    # Run a method within the run budget. Database errors, query timeouts
+    # included, are recorded so the other methods still run and what was
+    # collected is still written.
+    def run_guarded(self, method):
+        if self.deadline is None:
+            self.set_query_timeout()
+            self.run_method(method)
+            return
+        if self.deadline.expired():
+            self.skipped.append('%s (deadline)' % (method))
+            return
+        try:
+            self.set_query_timeout()
+            self.run_method(method)
+        except self.db_errors as e:
+            self.skipped.append('%s (%s)' % (
+                method, format(e).strip().splitlines()[0]))
+
+    # Run collector methods one after another on the connection
+    def collect(self, methods):
+        for method in methods:
+            self.run_guarded(method)
 
     # data point will be:
     #   series1 = {
@@ -44,22 +213,9 @@ class MSSQLMetrics():
     #                   value: value2
     #               }
     def write_data_by_tags(self, measurement, db_detail):
+        series = self.series_of(measurement, 'metric')
         for key, value in db_detail.items():
-            json_body = [
-                {
-                    "measurement": measurement,
-                    "tags": {
-                        "hostname": format(self.hostname),
-                        "host_group": format(self.host_group),
-                        "metric": key
-                    },
-                    "fields": {
-                        "value": value,
-                    }
-                }
-            ]
-            # print("Write points: {0}".format(json_body))
-            self.influx_client.write_points(json_body)
+            self.point_buffer.add(Point(series, key, {"value": value}))
 
     # data point will be:
     #   series = {
@@ -71,23 +227,51 @@ class MSSQLMetrics():
     #                   key2: value2,
     #               }
     def write_data_by_fields(self, measurement, tag_key, db_detail):
-        json_body = []
-        json_detail = {
-            "measurement": measurement,
-            "tags": {
-                "hostname": format(self.hostname),
-                "host_group": format(self.host_group),
-                tag_key: format(db_detail[tag_key])
-            },
-        }
-        json_fields = {}
-        for key, value in db_detail.items():
-            if key != tag_key:
-                json_fields[key] = value
-        json_detail['fields'] = json_fields
-        json_body.append(json_detail)
-        # print("Write points: {0}".format(json_body))
-        self.influx_client.write_points(json_body)
+        fields = dict(db_detail)
+        tag_value = fields.pop(tag_key)
+        self.point_buffer.add(Point(self.series_of(measurement, tag_key),
+                                    format(tag_value), fields))
+
+    def series_of(self, measurement, tag_key):
+        series = self.series.get((measurement, tag_key))
+        if series is None:
+            series = self.series[(measurement, tag_key)] = Series(
+                measurement, self.base_tags, tag_key)
+        return series
+
+    # Write all points buffered during this run, then send the spooled
+    # points within what is left of the run budget
+    def flush(self):
+        flush_points(self.point_buffer, self.deadline)
+
+    # Add the points derived from the whole run
+    def finish(self):
+        pass
+
+    # Add the run statistics to the points to write
+    def write_stats(self):
+        self.point_buffer.extend(self.run_stats.points(
+            'mssql_collector_stats', self.base_tags, self.point_buffer))
+
+    # Icinga state, status text and perfdata of the run
+    def check_result(self):
+        perfdata = self.run_stats.perfdata(self.point_buffer)
+        state = 0
+        details = []
+        if self.thresholds is not None:
+            state = self.thresholds.state()
+            if self.thresholds.text():
+                details.append(self.thresholds.text())
+            perfdata += ' ' + self.thresholds.perfdata()
+        if self.skipped:
+            state = max(state, 1)
+            details.append("skipped: %s" % (', '.join(self.skipped)))
+        spool_state, spool_text = spool_status(self.point_buffer)
+        if spool_text:
+            state = max(state, spool_state)
+            details.append(spool_text)
+        return state, "MSSQL Metrics for %s%s" % (
+            self.mssql_server, ''.join(', ' + text for text in details)), perfdata
 
     def database_details(self):
         cursor = self.db_connection.cursor()
@@ -111,103 +295,98 @@ class MSSQLMetrics():
         cursor.execute("""
         DBCC SQLPERF(logspace)
         """)
-        detail2s = []
+        # log details by database name
+        detail2s = {}
+        log_rows = 0
         for detail in cursor:
+            log_rows += 1
             db_detail = {}
-            db_detail['Database name'] = detail[0]
             db_detail['Log size'] = detail[1]
             db_detail['Log space used'] = detail[2]
             db_detail['Log status'] = detail[3]
-            detail2s.append(db_detail)
+            detail2s[detail[0]] = db_detail
         # Aggregate result
         for detail in details:
-            for detail2 in detail2s:
-                if detail['Database name'] == detail2['Database name']:
-                    detail['Log size'] = detail2['Log size']
-                    detail['Log space used'] = detail2['Log space used']
-                    detail['Log status'] = detail2['Log status']
+            detail.update(detail2s.get(detail['Database name'], {}))
             # Export to InfluxDB
             self.write_data_by_fields(
                 'mssql_database_details', 'Database name', detail)
+        return len(details) + log_rows
 
-    def backup_details(self):
-        cursor = self.db_connection.cursor()
+    # backup_details reading only the backups newer than the last run
+    def incremental_backup_details(self):
+        cursor = self.cursor()
         cursor.execute("""
-        SELECT
-        B.backup_start_date,
-        A.last_db_backup_date,
-        DATEDIFF(day, A.last_db_backup_date, B.backup_start_date) AS total_time,
-        B.backup_size,
-        B.physical_device_name,
-        DATEDIFF(day, A.last_db_backup_date, GETDATE()) AS backup_age,
-        A.[Server],
-        B.expiration_date,
-        B.logical_device_name,
-        B.backupset_name,
-        B.description
-        FROM
-                (
-                        SELECT
-                                CONVERT(
-                                        CHAR(100),
-                                        SERVERPROPERTY('Servername')
-                                ) AS Server,
-                                msdb.dbo.backupset.database_name,
-                                MAX( msdb.dbo.backupset.backup_finish_date ) AS last_db_backup_date
-                        FROM
-                                msdb.dbo.backupmediafamily
-                        INNER JOIN msdb.dbo.backupset ON
-                                msdb.dbo.backupmediafamily.media_set_id = msdb.dbo.backupset.media_set_id
-                        WHERE
-                                msdb..backupset.type = 'D'
-                        GROUP BY
-                                msdb.dbo.backupset.database_name
-                ) AS A
-        LEFT JOIN(
-                        SELECT
-                                CONVERT(
-                                        CHAR(100),
-                                        SERVERPROPERTY('Servername')
-                                ) AS Server,
-                                msdb.dbo.backupset.database_name,
-                                msdb.dbo.backupset.backup_start_date,
-                                msdb.dbo.backupset.backup_finish_date,
-                                msdb.dbo.backupset.expiration_date,
-                                msdb.dbo.backupset.backup_size,
-                                msdb.dbo.backupmediafamily.logical_device_name,
-                                msdb.dbo.backupmediafamily.physical_device_name,
-                                msdb.dbo.backupset.name AS backupset_name,
-                                msdb.dbo.backupset.description
-                        FROM
-                                msdb.dbo.backupmediafamily
-                        INNER JOIN msdb.dbo.backupset ON
-                                msdb.dbo.backupmediafamily.media_set_id = msdb.dbo.backupset.media_set_id
-                        WHERE
-                                msdb..backupset.type = 'D'
-                ) AS B ON
-                A.[server] = B.[server]
-                AND A.[database_name] = B.[database_name]
-                AND A.[last_db_backup_date] = B.[backup_finish_date]
-        ORDER BY
-                A.database_name
+        SELECT GETDATE(), MAX(backup_set_id) FROM msdb.dbo.backupset
         """)
-        for detail in cursor:
-            db_detail = {}
-            db_detail['Start time'] = format(detail[0])
-            db_detail['End time'] = format(detail[1])
-            db_detail['Total time'] = detail[2]
-            db_detail['Size'] = int(detail[3])
-            db_detail['Physical name'] = detail[4]
-            db_detail['Backup age'] = detail[5]
-            self.write_data_by_fields(
-                'mssql_backup_details', 'Physical name', db_detail)
+        now, latest = cursor.fetchone()
+        watermark = self.backup_watermark
+        watermark.check(latest)
+        rows = []
+        if latest is not None and latest > watermark.watermark:
+            cursor.execute("""
+            SELECT S.backup_set_id, S.database_name, S.backup_start_date,
+                S.backup_finish_date, S.backup_size, M.physical_device_name
+                FROM msdb.dbo.backupset S
+                INNER JOIN msdb.dbo.backupmediafamily M
+                    ON M.media_set_id = S.media_set_id
+                WHERE S.type = 'D' AND S.backup_set_id > %d
+                    AND S.backup_set_id <= %d
+                ORDER BY S.backup_set_id
+            """, (watermark.watermark, latest))
+            rows = cursor.fetchall()
+            watermark.update(rows, latest)
+            watermark.save()
+        self.point_buffer.extend(watermark.points(
+            now, 'mssql_backup_details', self.base_tags))
+        return len(rows) + 1
+
+    def snapshot(self, sql, key_count, value_count):
+        cursor = self.cursor()
+        start = None
+        if self.perf_mode == 'persist':
+            cursor.execute("SELECT sqlserver_start_time FROM sys.dm_os_sys_info")
+            start = format(cursor.fetchone()[0])
+        cursor.execute(sql)
+        rows = cursor.fetchall()
+        return Snapshot.from_rows(rows, key_count, value_count, time.time(),
+                                  start)
+
+    # Snapshots to diff: a sample taken -perf_sample seconds ago in this
+    # run, or the one kept from the previous run
+    def snapshots(self, name, sql, key_count, value_count):
+        if self.perf_mode == 'persist':
+            current = self.snapshot(sql, key_count, value_count)
+            return self.counters.exchange(name, current), current
+        previous = self.snapshot(sql, key_count, value_count)
+        sample = self.perf_sample
+        if self.deadline is not None and self.deadline.remaining() is not None:
+            sample = min(sample, self.deadline.remaining())
+        time.sleep(sample)
+        return previous, self.snapshot(sql, key_count, value_count)
 
+    def performance_counters(self):
+        previous, current = self.snapshots('performance_counters', """
+        SELECT RTRIM(object_name), RTRIM(counter_name), RTRIM(instance_name),
+            cntr_value, cntr_type
+            FROM sys.dm_os_performance_counters
+        """, 3, 2)
+        if previous is not None:
+            self.point_buffer.extend(self.counters.counter_points(
+                previous, current, 'mssql_performance_counters',
+                self.base_tags))
+        return len(current.keys)
 
-class ArgumentParser(argparse.ArgumentParser):
-    def error(self, message):
-        # self.print_help(sys.stderr)
-        print("UKNOWN - %s." % (message))
-        self.exit(3)
+    def wait_stats(self):
+        previous, current = self.snapshots('wait_stats', """
+        SELECT wait_type, waiting_tasks_count, wait_time_ms,
+            signal_wait_time_ms
+            FROM sys.dm_os_wait_stats
+        """, 1, 3)
+        if previous is not None:
+            self.point_buffer.extend(self.counters.wait_points(
+                previous, current, 'mssql_wait_stats', self.base_tags))
+        return len(current.keys)
 
 
 def parse_args():
@@ -215,40 +394,41 @@ def parse_args():
     parser = ArgumentParser(
         description="Plugin for Icinga to check mssql's metrics and export to InfluxDB")
 
-    parser.add_argument('-hostname', type=str, required=False,
-                        default='localhost',
-                        help='hostname of Icinga client')
-    parser.add_argument('-host_group', type=str, required=False,
-                        default='mssql',
-                        help='host_group of Icinga client')
-    parser.add_argument('-influx_host', type=str, required=False,
-                        default='localhost',
-                        help='hostname of InfluxDB server')
-    parser.add_argument('-influx_port', type=int, required=False, default=8086,
-                        help='port of InfluxDB server')
-    parser.add_argument('-influx_user', type=str,
-                        required=False, help='InfluxDB user name')
-    parser.add_argument('-influx_password', type=str, required=False)
-    parser.add_argument('-influx_db', type=str, required=True,
-                        help='InfluxDB database name')
+    common_args(parser, 'mssql', 'mssql_metrics')
     parser.add_argument(
-        '-mssql_server', help="MSSQL server's hostname/IP", required=True)
+        '-mssql_server', help="MSSQL server's hostname/IP", required=False)
     parser.add_argument('-mssql_port', type=int, required=False, default=1433,
                         help='port of MSSQL server. Default 1433')
     parser.add_argument(
-        '-mssql_user', help="MSSQL username with VIEW SERVER STATE grant", required=True)
-    parser.add_argument('-mssql_password', required=True)
+        '-mssql_user', help="MSSQL username with VIEW SERVER STATE grant", required=False)
+    parser.add_argument('-mssql_password', required=False)
     parser.add_argument(
         '-mssql_database', required=False, default="master",
         help='Initial MSSQL database to connect')
+    parser.add_argument('-perf_mode', required=False, default='none',
+                        choices=['none', 'run', 'persist'],
+                        help='write performance counter and wait statistics rates: run = from two samples in this run, persist = since the previous run. Default none')
+    parser.add_argument('-perf_sample', type=float, required=False,
+                        default=1,
+                        help='seconds between the two samples with -perf_mode run')
+    parser.add_argument('-rate_dir', type=str, required=False,
+                        help='keep the counters of -perf_mode persist in this directory')
+    parser.add_argument('-backup_state_dir', type=str, required=False,
+                        help='read only the backup history newer than the last run, keeping the latest backups in this directory')
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    check_args(parser, args, ('mssql_server', 'mssql_user', 'mssql_password'))
+    if args.perf_mode == 'persist' and not args.rate_dir and not args.daemon:
+        parser.error("-perf_mode persist needs -rate_dir")
+    try:
+        args.catalog_metrics = load_catalog(args.catalog, 'mssql')
+    except (OSError, ValueError) as e:
+        parser.error(e)
+    catalog_args(parser, args, MSSQLMetrics.collectors +
+                 MSSQLMetrics.perf_collectors +
+                 [metric.name for metric in args.catalog_metrics])
+    return args
 
 
 if __name__ == "__main__":
-    args = parse_args()
-    object = MSSQLMetrics(args)
-    object.database_details()
-    object.backup_details()
-    print("OK - MSSQL Metrics for %s" % (args.mssql_server))
-    sys.exit(0)
+    sys.exit(run(MSSQLMetrics, parse_args(), 'MSSQL Metrics', 'mssql_server'))
@@ -6,13 +6,43 @@
 # -influx_user=user -influx_password=pass -influx_db=oracle_metrics
 # -oracle_user=user -oracle_password=pass -oracle_sid=ip/orcl
 import sys
-import argparse
-from influxdb import InfluxDBClient
-import cx_Oracle
+import functools
+import queue
+import time
+import threading
+from point import Point, Series
+from spool import spool_status
+from result_cache import ResultCache, cache_path
+from change_filter import ChangeFilter
+from metric_catalog import load_catalog
+from run_stats import RunStats
+from deadline import Deadline
+from io_rates import TablespaceIORates
+from thresholds import ThresholdEngine
+from collector_plugin import (ArgumentParser, catalog_args, check_args,
+                              common_args, flush_points, make_point_buffer,
+                              run)
+
+
+# The driver is imported by the first collector, so argument errors and
+# -h do not pay for loading it
+cx_Oracle = None
+
+
+def load_driver():
+    global cx_Oracle
+    if cx_Oracle is None:
+        import cx_Oracle as driver
+        cx_Oracle = driver
+    return cx_Oracle
 
 
 class OracleMetrics():
-    def __init__(self, args):
+    # Collector methods written in code. The methods declared in the
+    # metric catalog are added to these.
+    collectors = []
+
+    def __init__(self, args, point_buffer=None):
         self.hostname = args.hostname
         self.host_group = args.host_group
         self.influx_host = args.influx_host
@@ -23,11 +53,230 @@ class OracleMetrics():
         self.oracle_user = args.oracle_user
         self.oracle_password = args.oracle_password
         self.oracle_sid = args.oracle_sid
-        self.db_connection = cx_Oracle.connect(
-            self.oracle_user, self.oracle_password, self.oracle_sid)
-        self.influx_client = InfluxDBClient(
-            self.influx_host, self.influx_port, self.influx_user,
-            self.influx_password, self.influx_db)
+        self.parallel = args.parallel
+        # no run budget in daemon mode, only query timeouts
+        self.deadline = None if args.daemon else Deadline(
+            args.timeout, args.query_timeout)
+        self.query_timeout = args.query_timeout
+        self.arraysize = args.arraysize
+        # methods not run or cut short, as "method (reason)"
+        self.skipped = []
+        self.db_connection = None
+        self.session_pool = None
+        # connection of the pooled session used by the current thread
+        self.local = threading.local()
+        self.run_stats = RunStats()
+        self.db_errors = (load_driver().Error,)
+        self.connect()
+        self.base_tags = {
+            "hostname": format(self.hostname),
+            "host_group": format(self.host_group),
+        }
+        # Series by (measurement, tag key), escaped once per run
+        self.series = {}
+        self.collectors = list(self.collectors)
+        for metric in args.catalog_metrics:
+            setattr(self, metric.name, functools.partial(metric.run, self))
+            self.collectors.append(metric.name)
+        self.result_cache = None
+        if args.cache_dir:
+            self.result_cache = ResultCache(
+                cache_path(args.cache_dir, self.host_group, self.hostname,
+                           self.oracle_sid),
+                args.cache_ttls, args.cache_reemit)
+        if point_buffer is None:
+            point_buffer = make_point_buffer(args)
+        self.point_buffer = point_buffer
+        if self.result_cache is not None:
+            self.point_buffer.committers.append(self.result_cache)
+        self.thresholds = None
+        if args.thresholds:
+            self.thresholds = ThresholdEngine(args.thresholds)
+            self.point_buffer.observers.append(self.thresholds.observe)
+        if args.change_dir:
+            self.point_buffer.point_filter = ChangeFilter(
+                cache_path(args.change_dir, self.host_group, self.hostname,
+                           self.oracle_sid, suffix='.state'),
+                args.change_measurements,
+                args.change_heartbeat)
+        self.io_rates = None
+        if args.rate_dir:
+            self.io_rates = TablespaceIORates(
+                cache_path(args.rate_dir, self.host_group, self.hostname,
+                           self.oracle_sid, suffix='.rates'))
+            self.point_buffer.observers.append(self.io_rates.observe)
+
+    def connect(self):
+        self.close()
+        started = time.monotonic()
+        if self.parallel > 1:
+            # acquire() is bounded by the run budget when there is one
+            timed = self.deadline is not None and \
+                self.deadline.remaining() is not None
+            self.session_pool = cx_Oracle.SessionPool(
+                user=self.oracle_user, password=self.oracle_password,
+                dsn=self.oracle_sid, min=1, max=self.parallel, increment=1,
+                threaded=True, getmode=cx_Oracle.SPOOL_ATTRVAL_TIMEDWAIT
+                if timed else cx_Oracle.SPOOL_ATTRVAL_WAIT)
+        else:
+            self.db_connection = cx_Oracle.connect(
+                self.oracle_user, self.oracle_password, self.oracle_sid)
+        self.run_stats.connect_seconds += time.monotonic() - started
+
+    def close(self):
+        if self.session_pool is not None:
+            try:
+                self.session_pool.close(force=True)
+            except cx_Oracle.Error:
+                pass
+            self.session_pool = None
+        if self.db_connection is not None:
+            try:
+                self.db_connection.close()
+            except cx_Oracle.Error:
+                pass
+            self.db_connection = None
+
+    # True while the database still answers, so an error of one query
+    # (missing view, call timeout...) does not force a reconnect
+    def ping(self):
+        try:
+            if self.session_pool is not None:
+                connection = self.session_pool.acquire()
+                try:
+                    connection.ping()
+                finally:
+                    self.session_pool.release(connection)
+            elif self.db_connection is not None:
+                self.db_connection.ping()
+            else:
+                return False
+        except cx_Oracle.Error:
+            return False
+        return True
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.db_connection
+        return connection
+
+    def cursor(self):
+        return self.connection().cursor()
+
+    # Limit the next database calls to the query timeout and what is left
+    # of the run budget
+    def set_call_timeout(self):
+        if self.deadline is not None:
+            timeout = self.deadline.next_timeout()
+        else:
+            timeout = self.query_timeout or None
+        self.connection().callTimeout = \
+            0 if timeout is None else max(1, int(timeout * 1000))
+
+    # Run one collector method on a session acquired from the pool
+    def run_pooled(self, method):
+        if self.deadline is not None and self.deadline.expired():
+            self.skipped.append('%s (deadline)' % (method))
+            return
+        try:
+            if self.deadline is not None and \
+                    self.deadline.remaining() is not None:
+                # wait for a session no longer than the run budget
+                self.session_pool.wait_timeout = max(1, int(
+                    self.deadline.remaining() * 1000))
+            connection = self.session_pool.acquire()
+        except self.db_errors as e:
+            # the daemon decides whether to reconnect
+            if self.deadline is None:
+                raise
+            self.skipped.append('%s (%s)' % (
+                method, format(e).strip().splitlines()[0]))
+            return
+        self.local.connection = connection
+        try:
+            self.run_guarded(method)
+        finally:
+            self.local.connection = None
+            self.session_pool.release(connection)
+
+    # Run a method within the run budget. Database errors, call timeouts
+    # included, are recorded so the other methods still run and what was
+    # collected is still written.
+    def run_guarded(self, method):
+        if self.deadline is None:
+            self.set_call_timeout()
+            self.run_method(method)
+            return
+        if self.deadline.expired():
+            self.skipped.append('%s (deadline)' % (method))
+            return
+        try:
+            self.set_call_timeout()
+            self.run_method(method)
+        except self.db_errors as e:
+            self.skipped.append('%s (%s)' % (
+                method, format(e).strip().splitlines()[0]))
+
+    def run_method(self, method):
+        started = time.monotonic()
+        points = self.point_buffer.added()
+        if self.result_cache is None:
+            rows = getattr(self, method)()
+        else:
+            rows = self.result_cache.run(method, getattr(self, method),
+                                         self.point_buffer)
+        self.run_stats.record(method, time.monotonic() - started, rows,
+                              self.point_buffer.added() - points)
+
+    # Run collector methods, concurrently when a session pool is used
+    def collect(self, methods):
+        if self.session_pool is None:
+            for method in methods:
+                self.run_guarded(method)
+            return
+        pending = queue.Queue()
+        for method in methods:
+            pending.put(method)
+        finished = queue.Queue()
+
+        def worker():
+            while True:
+                try:
+                    method = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    self.run_pooled(method)
+                    finished.put((method, None))
+                except Exception as e:
+                    finished.put((method, e))
+
+        # daemon threads: a query still running past the deadline is
+        # abandoned and does not keep the process alive
+        for i in range(min(self.parallel, len(methods))):
+            threading.Thread(target=worker, daemon=True).start()
+        done = set()
+        error = None
+        while len(done) < len(methods):
+            timeout = self.deadline.remaining() if self.deadline else None
+            try:
+                method, e = finished.get(timeout=timeout)
+            except queue.Empty:
+                break
+            done.add(method)
+            error = error or e
+        # methods not started yet are not started any more
+        while True:
+            try:
+                pending.get_nowait()
+            except queue.Empty:
+                break
+        for method in methods:
+            if method not in done:
+                self.skipped.append('%s (deadline)' % (method))
+        if error is not None:
+            raise error
 
     # data point will be:
     #   series1 = {
@@ -45,22 +294,9 @@ class OracleMetrics():
     #                   value: value2
     #               }
     def write_data_by_tags(self, measurement, db_detail):
+        series = self.series_of(measurement, 'metric')
         for key, value in db_detail.items():
-            json_body = [
-                {
-                    "measurement": measurement,
-                    "tags": {
-                        "hostname": format(self.hostname),
-                        "host_group": format(self.host_group),
-                        "metric": key
-                    },
-                    "fields": {
-                        "value": value,
-                    }
-                }
-            ]
-            # print("Write points: {0}".format(json_body))
-            self.influx_client.write_points(json_body)
+            self.point_buffer.add(Point(series, key, {"value": value}))
 
     # data point will be:
     #   series = {
@@ -72,232 +308,52 @@ class OracleMetrics():
     #                   key2: value2,
     #               }
     def write_data_by_fields(self, measurement, tag_key, db_detail):
-        json_body = []
-        json_detail = {
-            "measurement": measurement,
-            "tags": {
-                "hostname": format(self.hostname),
-                "host_group": format(self.host_group),
-                tag_key: db_detail[tag_key]
-            },
-        }
-        json_fields = {}
-        for key, value in db_detail.items():
-            if key != tag_key:
-                json_fields[key] = value
-        json_detail['fields'] = json_fields
-        json_body.append(json_detail)
-        # print("Write points: {0}".format(json_body))
-        self.influx_client.write_points(json_body)
-
-    def database_availability(self):
-        cursor = self.db_connection.cursor()
-        cursor.execute("""
-        select database_status from sys.v_$instance
-        """)
-        for detail in cursor:
-            db_detail = {}
-            db_detail['Current Status'] = detail[0]
-            self.write_data_by_tags('oracle_availability', db_detail)
-
-    def database_uptime(self):
-        cursor = self.db_connection.cursor()
-        cursor.execute("""
-        select (SYSDATE - startup_time)*24*3600 up_time from sys.v_$instance
-        """)
-        for detail in cursor:
-            db_detail = {}
-            db_detail['Up Time'] = int(detail[0])
-            self.write_data_by_tags('oracle_uptime', db_detail)
-
-    def database_details(self):
-        cursor = self.db_connection.cursor()
-        cursor.execute("""
-        select created, open_mode, log_mode, database_role, controlfile_type,
-        switchover_status, protection_mode, open_resetlogs, guard_status,
-        force_logging from v$database
-        """)
-        for detail in cursor:
-            db_detail = {}
-            db_detail['Database Created Time'] = format(detail[0])
-            db_detail['Open Mode'] = detail[1]
-            db_detail['Log Mode'] = detail[2]
-            db_detail['DB Role'] = detail[3]
-            db_detail['Control File Type'] = detail[4]
-            db_detail['Switch Over Status'] = detail[5]
-            db_detail['Protection Mode'] = detail[6]
-            db_detail['Open Reset Logs'] = detail[7]
-            db_detail['Guard Status'] = detail[8]
-            db_detail['Force Logging'] = detail[9]
-            self.write_data_by_tags('oracle_database_details', db_detail)
-
-    def tablespace_details(self):
-        cursor = self.db_connection.cursor()
-        cursor.execute("""
-        SELECT d.tablespace_name,
-               COUNT(d.file_name) num_datafiles,
-               NVL(SUM(decode(sign(d.maxbytes-d.bytes),1,d.maxbytes,d.bytes)),0) allocated_bytes,
-               SUM(d.blocks) allocated_blocks
-        FROM sys.dba_data_files d
-        GROUP BY d.tablespace_name
-                 union
-                 SELECT d.tablespace_name,
-                        COUNT(d.file_name) num_datafiles,
-                        NVL(SUM(d.bytes),0) allocated_bytes,
-                        SUM(d.blocks) allocated_blocks
-                 FROM sys.dba_temp_files d
-                 GROUP BY d.tablespace_name order by tablespace_name
-        """)
-        for detail in cursor:
-            db_detail = {}
-            db_detail['Tablespace'] = detail[0]
-            db_detail['Datafiles'] = detail[1]
-            db_detail['AllocatedBytes'] = detail[2]
-            db_detail['allocatedBlocks'] = detail[3]
-            self.write_data_by_fields(
-                'oracle_tablespace_details', 'Tablespace', db_detail)
-
-    def tablespace_status_1(self):
-        cursor = self.db_connection.cursor()
-        cursor.execute("""
-        SELECT d.tablespace_name,
-               SUM(f.phyrds) phyrds,
-               SUM(f.phywrts) phywrts,
-               SUM(f.readtim) readtim,
-               SUM(f.writetim) writetim
-        FROM sys.dba_data_files d,
-                    V$filestat f
-        WHERE d.file_id = f.file#
-        GROUP BY d.tablespace_name
-        ORDER by d.tablespace_name
-        """)
-        for detail in cursor:
-            db_detail = {}
-            db_detail['Tablespace'] = detail[0]
-            db_detail['Reads'] = detail[1]
-            db_detail['Writes'] = detail[2]
-            db_detail['Readtime'] = detail[3]
-            db_detail['Writetime'] = detail[4]
-            self.write_data_by_fields(
-                'oracle_tablespace_status_1', 'Tablespace', db_detail)
-
-    def tablespace_status_2(self):
-        cursor = self.db_connection.cursor()
-        cursor.execute("""
-        SELECT t.tablespace_name,
-               t.contents,
-               t.status,
-               NVL(df.allocated_bytes,0)-NVL((NVL(f.free_bytes,0)+df.max_free_bytes),0) usedBytes,
-               NVL((NVL(f.free_bytes,0)+df.max_free_bytes),0) freeBytes,
-               NVL(f.free_blocks,0) freeBlocks
-        FROM sys.dba_tablespaces t,
-             (select ff.tablespace_name,sum(ff.free_bytes) free_bytes,
-                     sum(ff.free_blocks) free_blocks
-              from
-                (SELECT fs.tablespace_name,
-                        SUM(fs.bytes) free_bytes,
-                        SUM(fs.blocks) free_blocks
-                 FROM sys.dba_free_space fs,
-                      sys.dba_data_files dfs
-                 WHERE fs.file_id=dfs.file_id
-                 GROUP BY fs.tablespace_name,
-                          dfs.autoextensible
-                ) ff
-              group by tablespace_name
-             ) f,
-             (select dff.tablespace_name,
-                     sum(dff.allocated_bytes) allocated_bytes,
-                     sum(dff.max_free_bytes) max_free_bytes
-              from
-                (select tablespace_name,
-                        autoextensible,
-                        sum(decode(sign(maxbytes-bytes),
-                        1,
-                        maxbytes,
-                        bytes
-                )
-              ) allocated_bytes,
-              sum(decode(sign(maxbytes-bytes),
-              1,
-              abs(maxbytes-bytes),0)) max_free_bytes
-        from dba_data_files
-        group by tablespace_name,autoextensible) dff
-        group by tablespace_name) df
-        WHERE t.tablespace_name = f.tablespace_name(+)
-              and t.tablespace_name=df.tablespace_name(+) order by tablespace_name
-        """)
-        for detail in cursor:
-            db_detail = {}
-            db_detail['Tablespace'] = detail[0]
-            db_detail['Contents'] = detail[1]
-            db_detail['Status'] = detail[2]
-            db_detail['Usedbytes'] = detail[3]
-            db_detail['Freebytes'] = detail[4]
-            db_detail['Freeblocks'] = detail[5]
-            self.write_data_by_fields(
-                'oracle_tablespace_status_2', 'Tablespace', db_detail)
-
-    def redo_logs(self):
-        cursor = self.db_connection.cursor()
-        cursor.execute("""
-        select r.group#, r.thread#,
-               r.sequence#, r.bytes,
-               r.members, r.archived,
-               r.status, r.first_time,
-               m.member, m.status mstatus
-               from v$log r, v$logfile m where r.group# = m.group#
-        """)
-        for detail in cursor:
-            db_detail = {}
-            db_detail['Group Name'] = detail[0]
-            db_detail['Thread'] = detail[1]
-            db_detail['Sequence'] = detail[2]
-            db_detail['Bytes'] = detail[3]
-            db_detail['Members'] = detail[4]
-            db_detail['Archive'] = detail[5]
-            db_detail['Status'] = detail[6]
-            db_detail['First Time'] = format(detail[7])
-            db_detail['Member'] = detail[8]
-            db_detail['Mstatus'] = detail[9]
-            self.write_data_by_fields(
-                'oracle_redo_logs', 'Group Name', db_detail)
-
-    def oracle_users(self):
-        cursor = self.db_connection.cursor()
-        cursor.execute("""
-        select username, expiry_date, 
-               round(expiry_date - current_date) days_to_expiry, 
-               account_status, profile from dba_users
-        """)
-        for detail in cursor:
-            db_detail = {}
-            db_detail['Username'] = detail[0]
-            db_detail['Expiry Date'] = format(detail[1])
-            db_detail['Days To Expiry'] = detail[2]
-            db_detail['Account Status'] = detail[3]
-            db_detail['Profile'] = detail[4]
-            self.write_data_by_fields('oracle_users', 'Username',  db_detail)
-
-    def oracle_dblinks(self):
-        cursor = self.db_connection.cursor()
-        cursor.execute("""
-        select db_link, owner, username, host, created from dba_db_links
-        """)
-        for detail in cursor:
-            db_detail = {}
-            db_detail['Db Link'] = detail[0]
-            db_detail['Owner'] = detail[1]
-            db_detail['Username'] = detail[2]
-            db_detail['Host'] = detail[3]
-            db_detail['Created'] = format(detail[4])
-            self.write_data_by_fields('oracle_dblinks', 'Db Link', db_detail)
-
-
-class ArgumentParser(argparse.ArgumentParser):
-    def error(self, message):
-        # self.print_help(sys.stderr)
-        print("UKNOWN - %s." % (message))
-        self.exit(3)
+        fields = dict(db_detail)
+        tag_value = fields.pop(tag_key)
+        self.point_buffer.add(Point(self.series_of(measurement, tag_key),
+                                    tag_value, fields))
+
+    def series_of(self, measurement, tag_key):
+        series = self.series.get((measurement, tag_key))
+        if series is None:
+            series = self.series[(measurement, tag_key)] = Series(
+                measurement, self.base_tags, tag_key)
+        return series
+
+    # Write all points buffered during this run, then send the spooled
+    # points within what is left of the run budget
+    def flush(self):
+        flush_points(self.point_buffer, self.deadline)
+
+    # Add the points derived from the whole run
+    def finish(self):
+        if self.io_rates is not None:
+            self.point_buffer.extend(self.io_rates.points(self.base_tags))
+
+    # Add the run statistics to the points to write
+    def write_stats(self):
+        self.point_buffer.extend(self.run_stats.points(
+            'oracle_collector_stats', self.base_tags, self.point_buffer))
+
+    # Icinga state, status text and perfdata of the run
+    def check_result(self):
+        perfdata = self.run_stats.perfdata(self.point_buffer)
+        state = 0
+        details = []
+        if self.thresholds is not None:
+            state = self.thresholds.state()
+            if self.thresholds.text():
+                details.append(self.thresholds.text())
+            perfdata += ' ' + self.thresholds.perfdata()
+        if self.skipped:
+            state = max(state, 1)
+            details.append("skipped: %s" % (', '.join(self.skipped)))
+        spool_state, spool_text = spool_status(self.point_buffer)
+        if spool_text:
+            state = max(state, spool_state)
+            details.append(spool_text)
+        return state, "Oracle Metrics for %s%s" % (
+            self.oracle_sid, ''.join(', ' + text for text in details)), perfdata
 
 
 def parse_args():
@@ -305,42 +361,33 @@ def parse_args():
     parser = ArgumentParser(
         description="Plugin for Icinga to check oracle's metrics and export to InfluxDB")
 
-    parser.add_argument('-hostname', type=str, required=False,
-                        default='localhost',
-                        help='hostname of Icinga client')
-    parser.add_argument('-host_group', type=str, required=False,
-                        default='oracle',
-                        help='host_group of Icinga client')
-    parser.add_argument('-influx_host', type=str, required=False,
-                        default='localhost',
-                        help='hostname of InfluxDB server')
-    parser.add_argument('-influx_port', type=int, required=False, default=8086,
-                        help='port of InfluxDB server')
-    parser.add_argument('-influx_user', type=str,
-                        required=False, help='InfluxDB user name')
-    parser.add_argument('-influx_password', type=str, required=False)
-    parser.add_argument('-influx_db', type=str, required=True,
-                        help='InfluxDB database name')
+    common_args(parser, 'oracle', 'oracle_metrics')
     parser.add_argument(
-        '-oracle_user', help="Oracle username with sys views grant", required=True)
-    parser.add_argument('-oracle_password', required=True)
+        '-oracle_user', help="Oracle username with sys views grant", required=False)
+    parser.add_argument('-oracle_password', required=False)
     parser.add_argument(
-        '-oracle_sid', help="tnsnames SID to connect", required=True)
+        '-oracle_sid', help="tnsnames SID to connect", required=False)
+    parser.add_argument('-parallel', type=int, required=False, default=0,
+                        help='run collector methods concurrently on up to N pooled sessions. 0 = sequential')
+    parser.add_argument('-tablespace_mode', required=False, default='full',
+                        choices=['full', 'fast'],
+                        help='tablespace_status_2 from dba_free_space (full) or the cheaper dba_tablespace_usage_metrics (fast). Default full')
+    parser.add_argument('-rate_dir', type=str, required=False,
+                        help='write tablespace I/O rates, keeping the previous counters in this directory')
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    check_args(parser, args, ('oracle_user', 'oracle_password', 'oracle_sid'))
+    try:
+        variants = {}
+        if args.tablespace_mode != 'full':
+            variants['tablespace_status_2'] = args.tablespace_mode
+        args.catalog_metrics = load_catalog(args.catalog, 'oracle', variants)
+    except (OSError, ValueError) as e:
+        parser.error(e)
+    catalog_args(parser, args, OracleMetrics.collectors + [
+        metric.name for metric in args.catalog_metrics])
+    return args
 
 
 if __name__ == "__main__":
-    args = parse_args()
-    object = OracleMetrics(args)
-    object.database_uptime()
-    object.database_availability()
-    object.database_details()
-    object.tablespace_details()
-    object.tablespace_status_1()
-    object.tablespace_status_2()
-    object.redo_logs()
-    object.oracle_users()
-    object.oracle_dblinks()
-    print("OK - Oracle Metrics for %s" % (args.oracle_sid))
-    sys.exit(0)
+    sys.exit(run(OracleMetrics, parse_args(), 'Oracle Metrics', 'oracle_sid'))
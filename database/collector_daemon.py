@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+# Long-running mode for the metrics collectors.
+# The collector object (OracleMetrics, MSSQLMetrics) is built once and its
+# methods are run on an internal schedule, each with its own interval.
+# The database connection is reused between runs and only re-opened once
+# it is lost. Other database errors (missing view, query timeout...) only
+# fail the method.
+import heapq
+import logging
+import signal
+import threading
+import time
+
+logger = logging.getLogger('collector_daemon')
+
+
+# Parse "method=seconds" items given by -method_interval
+def parse_intervals(values, methods):
+    intervals = {}
+    for value in values or []:
+        method, sep, seconds = value.partition('=')
+        if not sep or method not in methods:
+            raise ValueError("invalid method interval '%s'" % (value))
+        try:
+            intervals[method] = float(seconds)
+        except ValueError:
+            raise ValueError("invalid method interval '%s'" % (value))
+        if intervals[method] <= 0:
+            raise ValueError("invalid method interval '%s'" % (value))
+    return intervals
+
+
+class CollectorDaemon():
+    def __init__(self, collector, methods, interval=60, intervals=None,
+                 reconnect_delay=5, max_reconnect_delay=300, report=None):
+        self.collector = collector
+        # called with the collector after each run, e.g. to submit its
+        # check result to Icinga
+        self.report = report
+        self.interval = interval
+        self.intervals = intervals or {}
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.connected = True
+        self.next_connect = 0
+        self.connect_delay = reconnect_delay
+        self.stop_event = threading.Event()
+        now = time.monotonic()
+        # (next run time, order, method)
+        self.schedule = [(now, i, method) for i, method in enumerate(methods)]
+        heapq.heapify(self.schedule)
+
+    def stop(self, *args):
+        self.stop_event.set()
+
+    def method_interval(self, method):
+        return self.intervals.get(method, self.interval)
+
+    # Re-open the database connection, backing off while it keeps failing
+    def reconnect(self):
+        now = time.monotonic()
+        if now < self.next_connect:
+            return False
+        try:
+            self.collector.connect()
+        except self.collector.db_errors as e:
+            logger.error("Reconnect failed: %s", e)
+            self.next_connect = now + self.connect_delay
+            self.connect_delay = min(self.connect_delay * 2,
+                                     self.max_reconnect_delay)
+            return False
+        logger.info("Reconnected to database")
+        self.connected = True
+        self.connect_delay = self.reconnect_delay
+        return True
+
+    def run_method(self, method):
+        if not self.connected and not self.reconnect():
+            return
+        try:
+            self.collector.collect([method])
+        except self.collector.db_errors as e:
+            logger.error("%s failed: %s", method, e)
+            self.collector.skipped.append('%s (%s)' % (
+                method, format(e).strip().splitlines()[0]))
+            if not self.collector.ping():
+                logger.error("Database connection lost")
+                self.connected = False
+        except Exception:
+            logger.exception("%s failed", method)
+
+    def run_due(self):
+        now = time.monotonic()
+        while self.schedule and self.schedule[0][0] <= now:
+            due, order, method = heapq.heappop(self.schedule)
+            self.run_method(method)
+            # Skip runs missed while a slow method was blocking
+            next_run = due + self.method_interval(method)
+            if next_run <= now:
+                next_run = now + self.method_interval(method)
+            heapq.heappush(self.schedule, (next_run, order, method))
+        self.collector.finish()
+        self.collector.write_stats()
+        try:
+            self.collector.flush()
+        except Exception:
+            logger.exception("Write to InfluxDB failed")
+        if self.report is not None:
+            try:
+                self.report(self.collector)
+            except Exception:
+                logger.exception("Check result report failed")
+        self.collector.run_stats.reset()
+        self.collector.skipped = []
+
+    def run_forever(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        while not self.stop_event.is_set():
+            self.run_due()
+            delay = self.schedule[0][0] - time.monotonic()
+            if delay > 0:
+                self.stop_event.wait(delay)
+        try:
+            self.collector.flush()
+        except Exception:
+            logger.exception("Write to InfluxDB failed")
+        self.collector.close()
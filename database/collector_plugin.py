@@ -0,0 +1,267 @@
+#!/usr/bin/python3
+# Command line and main loop shared by the check plugins
+# (check_oracle_metrics.py, check_mssql_metrics.py).
+# common_args() adds the options every collector has: output sink, spool,
+# result cache, change filter, run budget, thresholds, fan-out, daemon and
+# Icinga API. The plugins add their database options, check the parsed
+# arguments with check_args() and catalog_args(), and call run() with
+# their collector class.
+import argparse
+import logging
+import sys
+
+from sinks import SINKS, make_sink
+from point_buffer import PointBuffer
+from spool import Spool, drain_spool
+from metric_catalog import DEFAULT_CATALOG
+from collector_daemon import CollectorDaemon, parse_intervals
+from fanout import FanOut, load_targets, summary
+from thresholds import STATES, parse_thresholds
+
+
+class ArgumentParser(argparse.ArgumentParser):
+    def error(self, message):
+        # self.print_help(sys.stderr)
+        print("UKNOWN - %s." % (message))
+        self.exit(3)
+
+
+def make_point_buffer(args):
+    influx_client = make_sink(args)
+    if args.spool_dir:
+        influx_client = Spool(args.spool_dir, influx_client,
+                              args.spool_max_bytes,
+                              drain_timeout=args.spool_drain_timeout)
+    return PointBuffer(influx_client, args.batch_size, args.batch_bytes)
+
+
+# Write the buffered points, each request limited to what is left of the
+# run budget (but at least a second), then send the spooled points
+def flush_points(point_buffer, deadline=None):
+    set_timeout = getattr(point_buffer.influx_client, 'set_timeout', None)
+    if set_timeout is not None and deadline is not None and \
+            deadline.remaining() is not None:
+        set_timeout(max(1, deadline.remaining()))
+    point_buffer.flush()
+    drain_spool(point_buffer, deadline)
+
+
+# First line of an error, for the status line
+def error_text(error):
+    text = format(error).strip()
+    return text.splitlines()[0] if text else type(error).__name__
+
+
+# Options of every collector. host_group and service are the defaults of
+# -host_group and -icinga_service.
+def common_args(parser, host_group, service):
+    parser.add_argument('-hostname', type=str, required=False,
+                        default='localhost',
+                        help='hostname of Icinga client')
+    parser.add_argument('-host_group', type=str, required=False,
+                        default=host_group,
+                        help='host_group of Icinga client')
+    parser.add_argument('-influx_host', type=str, required=False,
+                        default='localhost',
+                        help='hostname of InfluxDB server')
+    parser.add_argument('-influx_port', type=int, required=False, default=8086,
+                        help='port of InfluxDB server')
+    parser.add_argument('-influx_user', type=str,
+                        required=False, help='InfluxDB user name')
+    parser.add_argument('-influx_password', type=str, required=False)
+    parser.add_argument('-influx_db', type=str, required=False,
+                        help='InfluxDB database name, required with -sink http')
+    parser.add_argument('-influx_timeout', type=float, required=False,
+                        default=10,
+                        help='seconds to wait for an InfluxDB request')
+    parser.add_argument('-sink', required=False, default='http',
+                        choices=SINKS,
+                        help='write points to the InfluxDB HTTP API (http), as line protocol on stdout for Telegraf (stdout) or in UDP datagrams (udp). Default http')
+    parser.add_argument('-udp_host', type=str, required=False,
+                        default='localhost',
+                        help='host of the InfluxDB/Telegraf UDP listener with -sink udp')
+    parser.add_argument('-udp_port', type=int, required=False, default=8089,
+                        help='port of the InfluxDB/Telegraf UDP listener with -sink udp')
+    parser.add_argument('-spool_dir', type=str, required=False,
+                        help='spool points in this directory before sending them to InfluxDB')
+    parser.add_argument('-spool_max_bytes', type=int, required=False,
+                        default=104857600,
+                        help='max size of the spool. Oldest points are dropped first')
+    parser.add_argument('-spool_drain_timeout', type=float, required=False,
+                        default=10,
+                        help='max seconds spent sending spooled points at the end of a run')
+    parser.add_argument('-batch_size', type=int, required=False, default=5000,
+                        help='max points per InfluxDB write. 0 = unlimited')
+    parser.add_argument('-batch_bytes', type=int, required=False,
+                        default=1048576,
+                        help='max approximate bytes per InfluxDB write. 0 = unlimited')
+    parser.add_argument('-catalog', type=str, required=False,
+                        default=DEFAULT_CATALOG,
+                        help='JSON metric catalog. Default metric_catalog.json next to this plugin')
+    parser.add_argument('-targets_file', type=str, required=False,
+                        help='JSON file of instances to collect in one run')
+    parser.add_argument('-max_workers', type=int, required=False, default=10,
+                        help='targets collected concurrently with -targets_file')
+    parser.add_argument('-target_timeout', type=float, required=False,
+                        default=60,
+                        help='seconds before a target is given up with -targets_file. 0 = the -timeout of the run')
+    parser.add_argument('-cache_dir', type=str, required=False,
+                        help='cache results of slow-changing methods in this directory')
+    parser.add_argument('-cache_ttl', action='append', required=False,
+                        metavar='METHOD=SECONDS',
+                        help='cache TTL of one collector method. Can be repeated. Default: ttl of the catalog entry')
+    parser.add_argument('-cache_reemit', action='store_true',
+                        help='write cached results again while they are fresh')
+    parser.add_argument('-change_dir', type=str, required=False,
+                        help='write string/status measurements only when they change, keeping state in this directory')
+    parser.add_argument('-change_heartbeat', type=float, required=False,
+                        default=3600,
+                        help='seconds after which unchanged series are written again')
+    parser.add_argument('-change_measurement', action='append',
+                        required=False,
+                        help='measurement written only on change. Can be repeated. Default: change_only catalog entries')
+    parser.add_argument('-timeout', type=float, required=False, default=50,
+                        help='seconds budget of the whole run, keep it under the Icinga check timeout. 0 = no limit')
+    parser.add_argument('-query_timeout', type=float, required=False,
+                        default=30,
+                        help='max seconds of one query. 0 = no limit')
+    parser.add_argument('-arraysize', type=int, required=False, default=500,
+                        help='rows fetched per round trip for catalog queries without their own arraysize')
+    parser.add_argument('-threshold', action='append', required=False,
+                        metavar='MEASUREMENT,FIELD,WARNING,CRITICAL[,TAG=GLOB...]',
+                        help='check a field of the collected points against Nagios ranges. Can be repeated')
+    parser.add_argument('-icinga_url', type=str, required=False,
+                        help='submit passive check results to this Icinga2 API in daemon and -targets_file mode, e.g. https://icinga:5665')
+    parser.add_argument('-icinga_user', type=str, required=False,
+                        help='Icinga2 API user')
+    parser.add_argument('-icinga_password', type=str, required=False,
+                        help='Icinga2 API password')
+    parser.add_argument('-icinga_ca', type=str, required=False,
+                        help='CA certificate of the Icinga2 API')
+    parser.add_argument('-icinga_insecure', action='store_true',
+                        help='do not verify the Icinga2 API certificate')
+    parser.add_argument('-icinga_service', type=str, required=False,
+                        default=service,
+                        help='service of the passive check results. Default %s' % (service))
+    parser.add_argument('-icinga_timeout', type=float, required=False,
+                        default=10, help='Icinga2 API timeout in seconds. Default 10')
+    parser.add_argument('-icinga_connections', type=int, required=False,
+                        default=4, help='keep-alive connections to the Icinga2 API. Default 4')
+    parser.add_argument('-icinga_queue', type=int, required=False,
+                        default=1000, help='check results waiting to be sent, the oldest are dropped beyond it. Default 1000')
+    parser.add_argument('-daemon', action='store_true',
+                        help='keep running and collect on an internal schedule')
+    parser.add_argument('-interval', type=float, required=False, default=60,
+                        help='default seconds between collections in daemon mode')
+    parser.add_argument('-method_interval', action='append', required=False,
+                        metavar='METHOD=SECONDS',
+                        help='interval of one collector method in daemon mode. Can be repeated')
+
+
+# Check the common arguments. required: database options needed unless
+# the targets come from -targets_file.
+def check_args(parser, args, required):
+    if args.sink == 'http' and not args.influx_db:
+        parser.error("the following arguments are required: -influx_db")
+    if not args.targets_file:
+        missing = [name for name in required if getattr(args, name) is None]
+        if missing:
+            parser.error("the following arguments are required: %s" % (
+                ', '.join('-' + name for name in missing)))
+    elif args.daemon:
+        parser.error("-daemon can not be used with -targets_file")
+    if args.icinga_url and not (args.daemon or args.targets_file):
+        parser.error("-icinga_url needs -daemon or -targets_file")
+
+
+# Settings derived from the metric catalog (args.catalog_metrics) and the
+# options naming collector methods
+def catalog_args(parser, args, methods):
+    try:
+        args.method_intervals = dict(
+            (metric.name, metric.interval)
+            for metric in args.catalog_metrics if metric.interval)
+        args.method_intervals.update(parse_intervals(
+            args.method_interval, methods))
+        args.cache_ttls = dict(
+            (metric.name, metric.ttl)
+            for metric in args.catalog_metrics if metric.ttl)
+        args.cache_ttls.update(parse_intervals(args.cache_ttl, methods))
+        args.thresholds = parse_thresholds(args.threshold)
+    except ValueError as e:
+        parser.error(e)
+    args.change_measurements = args.change_measurement or [
+        metric.measurement for metric in args.catalog_metrics
+        if metric.change_only]
+
+
+# Collect the -targets_file instances in one run
+def run_targets(collector_class, args, label, name_key, status):
+    try:
+        targets = load_targets(args.targets_file)
+    except (OSError, ValueError) as e:
+        print("UNKNOWN - %s" % (e), file=status)
+        return 3
+    point_buffer = make_point_buffer(args)
+    results = FanOut(collector_class, args, targets, point_buffer,
+                     args.max_workers, args.target_timeout, name_key).run()
+    write_error = None
+    try:
+        flush_points(point_buffer)
+    except Exception as e:
+        write_error = error_text(e)
+    if args.icinga_url:
+        # the Icinga API client is only imported when used
+        from icinga_api import make_icinga_sink, submit_targets
+        icinga = make_icinga_sink(args)
+        submit_targets(icinga, results, args.icinga_service)
+        icinga.close()
+    text, code = summary(results, point_buffer, label, write_error)
+    print(text, file=status)
+    return code
+
+
+# Keep collecting on the internal schedule until stopped
+def run_daemon(collector, args):
+    icinga = report = None
+    if args.icinga_url:
+        from icinga_api import make_icinga_sink
+        icinga = make_icinga_sink(args)
+        icinga.start()
+
+        def report(collector):
+            icinga.submit(args.hostname, args.icinga_service,
+                          *collector.check_result())
+    CollectorDaemon(collector, collector.collectors, args.interval,
+                    args.method_intervals, report=report).run_forever()
+    if icinga is not None:
+        icinga.close()
+    return 0
+
+
+# Run the plugin in the mode given by the arguments. Returns the exit code.
+def run(collector_class, args, label, name_key):
+    # stdout carries the points with -sink stdout
+    status = sys.stderr if args.sink == 'stdout' else sys.stdout
+    if args.daemon:
+        logging.basicConfig(
+            level=logging.INFO,
+            format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    if args.targets_file:
+        return run_targets(collector_class, args, label, name_key, status)
+    collector = collector_class(args)
+    if args.daemon:
+        return run_daemon(collector, args)
+    collector.collect(collector.collectors)
+    collector.finish()
+    collector.write_stats()
+    try:
+        collector.flush()
+    except Exception as e:
+        state, output, perfdata = collector.check_result()
+        print("CRITICAL - %s, write failed: %s | %s" % (
+            output, error_text(e), perfdata), file=status)
+        return 2
+    state, output, perfdata = collector.check_result()
+    print("%s - %s | %s" % (STATES[state], output, perfdata), file=status)
+    return state
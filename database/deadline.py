@@ -0,0 +1,30 @@
+#!/usr/bin/python3
+# Time budget of one collector run.
+# Collector methods are skipped once the budget is spent and every query
+# gets at most the smaller of the per-query timeout and what is left of
+# the budget, so a hung query can not use up the whole Icinga timeout.
+import time
+
+
+class Deadline():
+    def __init__(self, budget=0, query_timeout=0):
+        # 0 = no limit
+        self.expires = time.monotonic() + budget if budget else None
+        self.query_timeout = query_timeout
+
+    def remaining(self):
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self):
+        return self.expires is not None and time.monotonic() >= self.expires
+
+    # Seconds allowed for the next query, None when unlimited
+    def next_timeout(self):
+        remaining = self.remaining()
+        if not self.query_timeout:
+            return remaining
+        if remaining is None:
+            return self.query_timeout
+        return min(self.query_timeout, remaining)
@@ -0,0 +1,220 @@
+#!/usr/bin/python3
+# Collect metrics from many database instances in one process.
+# Targets are read from a JSON file, either a list or {"targets": [...]},
+# each entry overriding the command line arguments for that instance:
+#   [
+#       {"name": "db1", "hostname": "db1", "host_group": "oracle",
+#        "oracle_sid": "10.0.0.1/orcl", "oracle_user": "user",
+#        "oracle_password": "pass"},
+#       ...
+#   ]
+# Each target runs in its own thread, at most max_workers at a time. A
+# target that fails or runs past its timeout does not affect the others:
+# a timed out target frees its slot for the next one, and only points of
+# targets that completed are written to the shared point buffer.
+import argparse
+import collections
+import json
+import queue
+import threading
+import time
+
+from point_buffer import PointBuffer
+from run_stats import flush_perfdata
+from spool import spool_status
+from thresholds import STATES
+
+
+def load_targets(path):
+    with open(path) as f:
+        targets = json.load(f)
+    if isinstance(targets, dict):
+        targets = targets.get('targets', [])
+    if not isinstance(targets, list) or \
+            not all(isinstance(target, dict) for target in targets):
+        raise ValueError("%s: expected a list of targets" % (path))
+    return targets
+
+
+def target_name(target, key):
+    return format(target.get('name') or target.get('hostname') or
+                  target.get(key))
+
+
+# Command line arguments with the target's values applied
+def target_args(args, target):
+    values = dict(vars(args))
+    values.update(target)
+    return argparse.Namespace(**values)
+
+
+class TargetResult():
+    def __init__(self, name, host=None):
+        self.name = name
+        # Icinga host of the target
+        self.host = host
+        self.status = 'PENDING'
+        self.message = ''
+        self.started = None
+        self.elapsed = 0.0
+        # (state, output, perfdata) of a target that completed
+        self.check = None
+        # threshold alerts of a target that completed, as status text
+        self.alerts = ''
+
+
+class FanOut():
+    def __init__(self, collector_class, args, targets, point_buffer,
+                 max_workers=10, timeout=60, name_key='hostname'):
+        self.collector_class = collector_class
+        self.args = args
+        self.targets = targets
+        self.point_buffer = point_buffer
+        self.max_workers = max(1, max_workers)
+        # the connect of a target runs in its thread too, so this also
+        # bounds a connect that never returns. Without a target timeout a
+        # target gets the run budget of its collector.
+        self.timeout = timeout or args.timeout
+        self.results = [TargetResult(target_name(target, name_key),
+                                     target.get('hostname', args.hostname))
+                        for target in targets]
+        self.done = queue.Queue()
+        self.lock = threading.Lock()
+
+    def collect_target(self, index):
+        target = self.targets[index]
+        result = self.results[index]
+        # points stay with the target until it completes
+        target_buffer = PointBuffer(self.point_buffer, 0, 0)
+        collector = None
+        try:
+            collector = self.collector_class(
+                target_args(self.args, target), target_buffer)
+            collector.collect(collector.collectors)
+            collector.finish()
+            collector.write_stats()
+            with self.lock:
+                if result.status == 'RUNNING':
+                    target_buffer.flush()
+                    result.check = collector.check_result()
+                    if collector.thresholds is not None:
+                        result.alerts = collector.thresholds.text()
+            if collector.skipped:
+                return 'PARTIAL', 'skipped: %s' % (
+                    ', '.join(collector.skipped))
+            return 'OK', ''
+        except Exception as e:
+            return 'FAILED', format(e)
+        finally:
+            if collector is not None:
+                collector.close()
+
+    def worker(self, index):
+        status, message = self.collect_target(index)
+        self.done.put((index, status, message))
+
+    # Run a target in its own daemon thread, so a hung target (a connect
+    # or query that never returns) cannot keep the process alive
+    def start(self, index):
+        result = self.results[index]
+        with self.lock:
+            result.started = time.monotonic()
+            result.status = 'RUNNING'
+        threading.Thread(target=self.worker, args=(index,),
+                         daemon=True).start()
+
+    # Mark targets running longer than the timeout. Their threads are
+    # abandoned and whatever they collect is dropped.
+    def expire(self):
+        now = time.monotonic()
+        expired = 0
+        with self.lock:
+            for result in self.results:
+                if result.status == 'RUNNING' and self.timeout and \
+                        now - result.started >= self.timeout:
+                    result.status = 'TIMEOUT'
+                    result.message = 'timed out after %ss' % (self.timeout)
+                    result.elapsed = now - result.started
+                    expired += 1
+        return expired
+
+    def run(self):
+        pending = collections.deque(range(len(self.targets)))
+        # targets being collected; an expired target gives its slot to
+        # the next one even though its thread may still be blocked
+        running = 0
+        remaining = len(self.targets)
+        while remaining:
+            while pending and running < self.max_workers:
+                self.start(pending.popleft())
+                running += 1
+            try:
+                index, status, message = self.done.get(timeout=0.5)
+            except queue.Empty:
+                index = None
+            if index is not None:
+                result = self.results[index]
+                with self.lock:
+                    # a target already counted as timed out is ignored
+                    completed = result.status == 'RUNNING'
+                    if completed:
+                        result.status = status
+                        result.message = message
+                        result.elapsed = time.monotonic() - result.started
+                if completed:
+                    running -= 1
+                    remaining -= 1
+            # also while other targets keep completing
+            expired = self.expire()
+            running -= expired
+            remaining -= expired
+        return self.results
+
+
+# Icinga status line with perfdata, and per-target details. Targets that
+# could not be collected (FAILED, TIMEOUT) fail the run, those collected
+# with skipped methods (PARTIAL) make it WARNING at most. The state is
+# also the worse of the check results (thresholds) of collected targets.
+# write_error: why the points could not be written, the run is CRITICAL.
+def summary(results, point_buffer, label, write_error=None):
+    collected = [result for result in results
+                 if result.status in ('OK', 'PARTIAL')]
+    partial = [result for result in results if result.status == 'PARTIAL']
+    failed = [result for result in results if result not in collected]
+    if failed:
+        code = 1 if collected else 2
+    elif partial:
+        code = 1
+    else:
+        code = 0
+    for result in results:
+        if result.check is not None:
+            code = max(code, result.check[0])
+    if write_error is not None:
+        code = 2
+    spool_state, spool_text = spool_status(point_buffer)
+    code = max(code, spool_state)
+    text = "%s - %s for %d/%d targets" % (
+        STATES[code], label, len(collected), len(results))
+    if partial:
+        text += ", partial: %s" % (', '.join(result.name for result in partial))
+    if failed:
+        text += ", failed: %s" % (', '.join(result.name for result in failed))
+    if write_error is not None:
+        text += ", write failed: %s" % (write_error)
+    if spool_text:
+        text += ", %s" % (spool_text)
+    alerts = ['%s (%s)' % (result.name, result.alerts)
+              for result in results if result.alerts]
+    if alerts:
+        text += ", alerts: %s" % ('; '.join(alerts))
+    perf = ["'%s_time'=%.3fs" % (result.name, result.elapsed)
+            for result in results]
+    perf.extend(flush_perfdata(point_buffer))
+    lines = [text + ' | ' + ' '.join(perf)]
+    for result in results:
+        line = "%s: %s (%.2fs)" % (result.name, result.status, result.elapsed)
+        if result.message:
+            line += " %s" % (result.message)
+        lines.append(line)
+    return '\n'.join(lines), code
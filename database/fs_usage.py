@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+# Filesystem usage with os.statvfs, as df -P reports it, plus inodes.
+import math
+import os
+
+
+def percent(used, total):
+    # rounded up, like df
+    return float(math.ceil(used * 100.0 / total)) if total else 0.0
+
+
+# oracle_fs_pctused fields of the filesystem holding path. Sizes in KiB.
+def fs_usage(path):
+    st = os.statvfs(path)
+    total = st.f_blocks * st.f_frsize // 1024
+    free = st.f_bfree * st.f_frsize // 1024
+    available = st.f_bavail * st.f_frsize // 1024
+    used = total - free
+    inodes_used = st.f_files - st.f_ffree
+    return {
+        'oraclefs_pctused': percent(used, used + available),
+        'oraclefs_alloc': float(total),
+        'oraclefs_used': float(used),
+        'oraclefs_inodes': float(st.f_files),
+        'oraclefs_inodes_used': float(inodes_used),
+        'oraclefs_inodes_pctused': percent(inodes_used, st.f_files),
+    }
+
+
+# Mount point of the filesystem holding path, None for paths not on a
+# local filesystem: ASM disk groups, and files of a remote database that
+# do not exist here, whose nearest existing parent (often /) would be a
+# filesystem of this host
+def mount_point(path):
+    if not path or not path.startswith('/'):
+        return None
+    path = os.path.realpath(path)
+    if not os.path.exists(path):
+        return None
+    path = os.path.dirname(path)
+    while not os.path.ismount(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def mount_points(paths):
+    mounts = []
+    for path in paths:
+        mount = mount_point(path)
+        if mount is not None and mount not in mounts:
+            mounts.append(mount)
+    return mounts
@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+# Reverse DNS lookups with a persisted TTL cache.
+# Resolves addresses in-process with the socket API and keeps the answers,
+# failed lookups included, in a small JSON file:
+#   {address: [name or null, expires epoch]}
+# so a warm run needs neither a subprocess nor a DNS round trip.
+import json
+import os
+import socket
+import sys
+import tempfile
+import time
+
+# per-user cache file, not in the shared temp directory where another
+# user could plant a symlink in its place
+DEFAULT_PATH = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'oracle_metrics', 'dns.json')
+
+
+class CachedResolver():
+    def __init__(self, path=None, ttl=86400, negative_ttl=300):
+        self.path = path
+        self.ttl = ttl
+        # failed lookups are retried sooner
+        self.negative_ttl = negative_ttl
+        self.entries = {}
+        self.changed = False
+        if path:
+            try:
+                with open(path) as f:
+                    entries = json.load(f)
+                if isinstance(entries, dict):
+                    self.entries = entries
+            except (OSError, ValueError):
+                pass
+
+    # Host name of address, None when it does not resolve
+    def name(self, address):
+        now = time.time()
+        entry = self.entries.get(address)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        try:
+            name = socket.gethostbyaddr(address)[0]
+            expires = now + self.ttl
+        except (socket.herror, socket.gaierror, UnicodeError):
+            name = None
+            expires = now + self.negative_ttl
+        self.entries[address] = [name, expires]
+        self.changed = True
+        return name
+
+    # Best effort, a cache that can not be written does not fail the run
+    def save(self):
+        if not self.path or not self.changed:
+            return
+        now = time.time()
+        entries = dict((address, entry) for address, entry
+                       in self.entries.items() if entry[1] > now)
+        directory = os.path.dirname(self.path) or '.'
+        try:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            # a new file of our own, then renamed over the cache
+            fd, tmp = tempfile.mkstemp(prefix='.dns', suffix='.tmp',
+                                       dir=directory)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(entries, f, separators=(',', ':'))
+                os.replace(tmp, self.path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        except OSError as e:
+            # e.g. no writable home for a service user: the names are
+            # only cached for this process
+            print("DNS cache not saved: %s" % (e), file=sys.stderr)
+            return
+        self.changed = False
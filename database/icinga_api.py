@@ -0,0 +1,267 @@
+#!/usr/bin/python3
+# Passive check results submitted to the Icinga2 API.
+# Results are posted to /v1/actions/process-check-result, so one collector
+# process (-daemon, -targets_file) can feed many services without Icinga
+# scheduling an active check for each of them.
+# The API takes one check result per request. Pending results wait in a
+# bounded queue where a newer result of a service replaces the queued one,
+# and are sent in batches over a small pool of keep-alive connections,
+# one sender thread per connection. When the queue is full the oldest
+# result is dropped.
+import base64
+import collections
+import http.client
+import json
+import logging
+import re
+import ssl
+import threading
+import urllib.parse
+
+logger = logging.getLogger('icinga_api')
+
+CHECK_RESULT_PATH = '/v1/actions/process-check-result'
+# Icinga state of a target that did not complete (fanout TargetResult)
+TARGET_STATES = {'OK': 0, 'PARTIAL': 1, 'FAILED': 2, 'TIMEOUT': 2}
+
+
+class IcingaAPIError(Exception):
+    pass
+
+
+# Perfdata items of a plugin output, labels may be quoted and hold spaces
+def perfdata_items(perfdata):
+    return re.findall(r"(?:'[^']*'|[^\s'])+", perfdata or '')
+
+
+class IcingaSink():
+    def __init__(self, url='https://localhost:5665', username=None,
+                 password=None, ca_file=None, verify=True, timeout=10,
+                 connections=4, max_queue=1000, batch_size=200,
+                 retry_delay=10, check_source=None):
+        parts = urllib.parse.urlsplit(url)
+        self.ssl = parts.scheme == 'https'
+        self.host = parts.hostname or 'localhost'
+        self.port = parts.port or 5665
+        self.timeout = timeout
+        self.context = None
+        if self.ssl:
+            self.context = ssl.create_default_context(cafile=ca_file)
+            if not verify:
+                self.context.check_hostname = False
+                self.context.verify_mode = ssl.CERT_NONE
+        self.headers = {'Accept': 'application/json',
+                        'Content-Type': 'application/json'}
+        if username:
+            self.headers['Authorization'] = 'Basic ' + base64.b64encode(
+                ('%s:%s' % (username, password or '')).encode('utf-8')
+            ).decode('ascii')
+        self.connections = [None] * max(1, connections)
+        self.max_queue = max(1, max_queue)
+        self.batch_size = max(1, batch_size)
+        self.retry_delay = retry_delay
+        self.check_source = check_source
+        # (host, service): request body, in submission order
+        self.pending = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.thread = None
+        self.stopping = False
+        # set by close(), ends the wait between retries
+        self.stop_event = threading.Event()
+        # counters, for the logs and the benchmark
+        self.submitted = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.sent = 0
+        self.rejected = 0
+        self.requests = 0
+        self.last_error = None
+
+    # Queue the result of a service, or of the host when service is None
+    def submit(self, host, service, state, output, perfdata=None):
+        body = {
+            'exit_status': state,
+            'plugin_output': output,
+            'performance_data': perfdata_items(perfdata)
+            if isinstance(perfdata, str) else list(perfdata or []),
+        }
+        if service:
+            body['type'] = 'Service'
+            body['service'] = '%s!%s' % (host, service)
+        else:
+            body['type'] = 'Host'
+            body['host'] = host
+        if self.check_source:
+            body['check_source'] = self.check_source
+        key = (host, service or '')
+        with self.lock:
+            self.submitted += 1
+            if key in self.pending:
+                # only the latest result of a service matters, it keeps
+                # the place of the queued one
+                self.coalesced += 1
+            elif len(self.pending) >= self.max_queue:
+                self.pending.popitem(last=False)
+                self.dropped += 1
+            self.pending[key] = body
+            self.ready.notify()
+
+    def connect(self, index):
+        if self.ssl:
+            connection = http.client.HTTPSConnection(
+                self.host, self.port, timeout=self.timeout,
+                context=self.context)
+        else:
+            connection = http.client.HTTPConnection(
+                self.host, self.port, timeout=self.timeout)
+        self.connections[index] = connection
+        return connection
+
+    def close_connection(self, index):
+        if self.connections[index] is not None:
+            self.connections[index].close()
+            self.connections[index] = None
+
+    def post(self, index, data):
+        connection = self.connections[index] or self.connect(index)
+        connection.request('POST', CHECK_RESULT_PATH, data, self.headers)
+        response = connection.getresponse()
+        body = response.read()
+        with self.lock:
+            self.requests += 1
+        return response.status, body
+
+    def send(self, index, body):
+        data = json.dumps(body).encode('utf-8')
+        try:
+            status, response = self.post(index, data)
+        except (http.client.HTTPException, ConnectionError):
+            # keep-alive connection dropped by Icinga, retry once
+            self.close_connection(index)
+            status, response = self.post(index, data)
+        if status != 200:
+            raise IcingaAPIError('%s: %d %s' % (
+                body.get('service') or body.get('host'), status,
+                response.decode('utf-8', 'replace').strip()))
+
+    # Send results over one pooled connection. Returns those not sent
+    # because Icinga could not be reached.
+    def send_all(self, index, items):
+        for position, (key, body) in enumerate(items):
+            try:
+                self.send(index, body)
+            except IcingaAPIError as e:
+                # unknown object, missing permission...: not retried
+                with self.lock:
+                    self.rejected += 1
+                    self.last_error = format(e)
+                continue
+            except (OSError, http.client.HTTPException) as e:
+                self.close_connection(index)
+                with self.lock:
+                    self.last_error = format(e)
+                return items[position:]
+            with self.lock:
+                self.sent += 1
+        return []
+
+    def take(self):
+        with self.lock:
+            return [self.pending.popitem(last=False) for i in range(
+                min(self.batch_size, len(self.pending)))]
+
+    # Put results back at the head of the queue, unless a newer one came
+    def requeue(self, items):
+        with self.lock:
+            for key, body in reversed(items):
+                if key in self.pending:
+                    continue
+                if len(self.pending) >= self.max_queue:
+                    self.dropped += 1
+                    continue
+                self.pending[key] = body
+                self.pending.move_to_end(key, last=False)
+
+    def send_batch(self, items):
+        slices = [items[index::len(self.connections)]
+                  for index in range(len(self.connections))]
+        slices = [(index, part) for index, part in enumerate(slices) if part]
+        if len(slices) == 1:
+            return self.send_all(*slices[0])
+        unsent = [None] * len(slices)
+
+        def sender(position, index, part):
+            unsent[position] = self.send_all(index, part)
+
+        threads = [threading.Thread(target=sender,
+                                    args=(position, index, part))
+                   for position, (index, part) in enumerate(slices)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return [item for part in unsent for item in part]
+
+    # Send the queued results. Returns False when Icinga could not be
+    # reached, the results not sent are queued again.
+    def flush(self):
+        while True:
+            items = self.take()
+            if not items:
+                return True
+            unsent = self.send_batch(items)
+            if unsent:
+                self.requeue(unsent)
+                return False
+
+    def run(self):
+        while True:
+            with self.lock:
+                while not self.pending and not self.stopping:
+                    self.ready.wait()
+                if not self.pending:
+                    return
+            if not self.flush():
+                logger.error("Icinga API not reachable: %s", self.last_error)
+                if self.stop_event.wait(self.retry_delay):
+                    return
+
+    # Send the results in the background as they are submitted
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Send what is still queued and close the connections
+    def close(self, timeout=30):
+        if self.thread is not None:
+            with self.lock:
+                self.stopping = True
+                self.ready.notify()
+            self.stop_event.set()
+            self.thread.join(timeout)
+            self.thread = None
+        else:
+            self.flush()
+        for index in range(len(self.connections)):
+            self.close_connection(index)
+
+
+def make_icinga_sink(args):
+    return IcingaSink(
+        args.icinga_url, args.icinga_user, args.icinga_password,
+        ca_file=args.icinga_ca, verify=not args.icinga_insecure,
+        timeout=args.icinga_timeout, connections=args.icinga_connections,
+        max_queue=args.icinga_queue)
+
+
+# Submit the result of every fanout target
+def submit_targets(sink, results, service):
+    for result in results:
+        if result.check is not None:
+            state, output, perfdata = result.check
+        else:
+            state = TARGET_STATES.get(result.status, 3)
+            output = '%s: %s' % (result.status, result.message)
+            perfdata = "'time'=%.3fs" % (result.elapsed)
+        sink.submit(result.host, service, state, output, perfdata)
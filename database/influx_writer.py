@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+# Lightweight InfluxDB 1.x HTTP writer.
+# Posts line protocol to /write over one keep-alive connection with
+# http.client, gzip-compressing the body, in place of InfluxDBClient and
+# the requests stack it pulls in. A connection closed by the server
+# between writes is reopened and the write is sent again once.
+import gzip
+import http.client
+import urllib.parse
+
+from line_protocol import make_lines
+
+# bodies smaller than this are not worth compressing
+GZIP_MIN_BYTES = 1024
+
+
+class InfluxDBWriteError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, '%d: %s' % (status, message))
+        # HTTP status of the rejected write
+        self.status = status
+
+
+class InfluxWriter():
+    def __init__(self, host='localhost', port=8086, username=None,
+                 password=None, database=None, timeout=10, gzip=True,
+                 ssl=False):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        # timeout of the next requests, see set_timeout()
+        self.request_timeout = timeout
+        self.gzip = gzip
+        self.ssl = ssl
+        params = {'db': database}
+        if username:
+            params['u'] = username
+            params['p'] = password or ''
+        self.path = '/write?' + urllib.parse.urlencode(params)
+        self.connection = None
+        self.requests = 0
+
+    def connect(self):
+        if self.ssl:
+            self.connection = http.client.HTTPSConnection(
+                self.host, self.port, timeout=self.request_timeout)
+        else:
+            self.connection = http.client.HTTPConnection(
+                self.host, self.port, timeout=self.request_timeout)
+
+    # Limit the next requests to seconds, e.g. what is left of the run
+    # budget, never beyond the configured timeout
+    def set_timeout(self, seconds):
+        if self.timeout:
+            seconds = min(self.timeout, seconds)
+        self.request_timeout = seconds
+        if self.connection is not None and self.connection.sock is not None:
+            self.connection.sock.settimeout(seconds)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def post(self, body, headers):
+        if self.connection is None:
+            self.connect()
+        self.connection.request('POST', self.path, body, headers)
+        response = self.connection.getresponse()
+        data = response.read()
+        self.requests += 1
+        return response.status, data
+
+    def write_points(self, points):
+        body = make_lines(points).encode('utf-8')
+        if not body:
+            return True
+        headers = {'Content-Type': 'text/plain; charset=utf-8'}
+        if self.gzip and len(body) >= GZIP_MIN_BYTES:
+            body = gzip.compress(body, compresslevel=1)
+            headers['Content-Encoding'] = 'gzip'
+        try:
+            status, data = self.post(body, headers)
+        except (http.client.HTTPException, ConnectionError):
+            # keep-alive connection dropped by the server, retry once
+            self.close()
+            status, data = self.post(body, headers)
+        except OSError:
+            self.close()
+            raise
+        if status != 204:
+            raise InfluxDBWriteError(
+                status, data.decode('utf-8', 'replace').strip())
+        return True
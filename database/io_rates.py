@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+# Per-second I/O rates from the cumulative V$filestat counters.
+# Watches the oracle_tablespace_status_1 points (Reads, Writes, Readtime,
+# Writetime summed per tablespace) and the oracle_uptime point of a run,
+# and at the end of the run writes the change since the previous run as
+#   oracle_tablespace_io,Tablespace=.. Reads per sec=..,Writes per sec=..,
+#       Avg read ms=..,Avg write ms=..
+# The previous snapshot is kept in a small JSON state file per instance:
+#   {"startup": epoch, "time": epoch, "tablespaces": {name: [r, w, rt, wt]}}
+# After an instance restart (startup time from the uptime changed) or a
+# counter going backwards no rate is written and the snapshot restarts.
+import json
+import os
+import threading
+import time
+
+COUNTERS = ('Reads', 'Writes', 'Readtime', 'Writetime')
+# startup times closer than this are the same startup
+STARTUP_TOLERANCE = 10
+
+
+# Snapshot read from the state file, None when it is not one (another
+# file at that path, an older format...): the run then starts over
+def valid_snapshot(state):
+    if not isinstance(state, dict) or \
+            not isinstance(state.get('time'), (int, float)) or \
+            not isinstance(state.get('tablespaces'), dict):
+        return None
+    if not isinstance(state.get('startup'), (int, float)):
+        state['startup'] = None
+    state['tablespaces'] = dict(
+        (name, counters) for name, counters in state['tablespaces'].items()
+        if isinstance(counters, list) and len(counters) == len(COUNTERS) and
+        all(isinstance(value, (int, float)) for value in counters))
+    return state
+
+
+class TablespaceIORates():
+    def __init__(self, path, measurement='oracle_tablespace_io'):
+        self.path = path
+        self.measurement = measurement
+        self.lock = threading.Lock()
+        self.startup = None
+        self.snapshot = {}
+        self.snapshot_time = None
+        try:
+            with open(path) as f:
+                self.previous = valid_snapshot(json.load(f))
+        except (OSError, ValueError):
+            self.previous = None
+
+    # PointBuffer observer
+    def observe(self, point):
+        measurement = point['measurement']
+        if measurement == 'oracle_uptime':
+            with self.lock:
+                self.startup = time.time() - point['fields']['value']
+        elif measurement == 'oracle_tablespace_status_1':
+            fields = point['fields']
+            try:
+                counters = [int(fields[counter]) for counter in COUNTERS]
+            except (KeyError, TypeError, ValueError):
+                return
+            with self.lock:
+                self.snapshot[point['tags']['Tablespace']] = counters
+                self.snapshot_time = time.time()
+
+    def restarted(self):
+        if self.startup is None:
+            return False
+        startup = self.previous.get('startup')
+        return startup is not None and \
+            abs(startup - self.startup) > STARTUP_TOLERANCE
+
+    # Rate points since the previous run, then keep this run's snapshot
+    def points(self, base_tags):
+        with self.lock:
+            if not self.snapshot:
+                return []
+            points = []
+            previous = self.previous
+            if previous and not self.restarted():
+                elapsed = self.snapshot_time - previous['time']
+                tablespaces = previous['tablespaces']
+                for name, counters in self.snapshot.items():
+                    last = tablespaces.get(name)
+                    if elapsed <= 0 or last is None:
+                        continue
+                    reads, writes, readtime, writetime = [
+                        value - last_value
+                        for value, last_value in zip(counters, last)]
+                    if min(reads, writes, readtime, writetime) < 0:
+                        # counters were reset
+                        continue
+                    tags = dict(base_tags)
+                    tags['Tablespace'] = name
+                    # read/write times are in hundredths of a second
+                    points.append({
+                        "measurement": self.measurement,
+                        "tags": tags,
+                        "fields": {
+                            'Reads per sec': reads / elapsed,
+                            'Writes per sec': writes / elapsed,
+                            'Avg read ms':
+                                readtime * 10.0 / reads if reads else 0.0,
+                            'Avg write ms':
+                                writetime * 10.0 / writes if writes else 0.0,
+                        }
+                    })
+            startup = self.startup
+            if startup is None and previous:
+                startup = previous.get('startup')
+            self.previous = {
+                'startup': startup,
+                'time': self.snapshot_time,
+                'tablespaces': self.snapshot,
+            }
+            self.snapshot = {}
+            self.startup = None
+            self.save()
+        return points
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.previous, f, separators=(',', ':'))
+        os.replace(tmp, self.path)
@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+# Minimal InfluxDB line protocol encoder.
+# Encodes points the way influxdb.line_protocol.make_lines does (sorted
+# tags and fields, empty tags and None fields left out, integers with an
+# "i" suffix, measurements escaped as tags), without importing the
+# influxdb package and its dependencies on every plugin start. Points
+# without any field are skipped, as InfluxDB would reject the whole write
+# for them. Points can be dicts or Point objects (point.py).
+
+TAG_ESCAPES = str.maketrans({
+    '\\': '\\\\', ',': '\\,', ' ': '\\ ', '=': '\\=', '\n': '\\n'})
+STRING_ESCAPES = str.maketrans({
+    '\\': '\\\\', '"': '\\"', '\n': '\\n'})
+
+
+def text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return str(value)
+
+
+def escape_tag(value):
+    return text(value).translate(TAG_ESCAPES)
+
+
+def escape_value(value):
+    # exact types first, the common case
+    kind = type(value)
+    if kind is float:
+        return repr(value)
+    if kind is int:
+        return '%di' % (value)
+    if kind is str:
+        return '"%s"' % (value.translate(STRING_ESCAPES))
+    if isinstance(value, str):
+        return '"%s"' % (value.translate(STRING_ESCAPES))
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, int):
+        return '%di' % (value)
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, bytes):
+        return escape_value(value.decode('utf-8'))
+    try:
+        return repr(float(value))
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def make_line(point):
+    fields = point['fields']
+    field_set = ','.join(
+        '%s=%s' % (escape_tag(key), escape_value(fields[key]))
+        for key in sorted(fields) if fields[key] is not None)
+    if not field_set:
+        return None
+    line = escape_tag(point['measurement'])
+    tags = point.get('tags')
+    if tags:
+        for key in sorted(tags):
+            key_escaped = escape_tag(key)
+            value_escaped = escape_tag(tags[key])
+            if key_escaped and value_escaped:
+                line += ',%s=%s' % (key_escaped, value_escaped)
+    line += ' ' + field_set
+    timestamp = point.get('time')
+    if timestamp is not None:
+        # nanoseconds, as stamped by the spool
+        line += ' %d' % (int(timestamp))
+    return line
+
+
+def make_lines(points):
+    lines = []
+    for point in points:
+        # Point (point.py) encodes itself from its pre-escaped series
+        line = make_line(point) if isinstance(point, dict) else point.line()
+        if line is not None:
+            lines.append(line)
+    return '\n'.join(lines) + '\n' if lines else ''
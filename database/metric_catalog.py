@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+# Declarative metric catalog shared by the collectors.
+# Each catalog entry declares one collector method:
+#   name         method name, used by -method_interval, -cache_ttl...
+#   driver       "oracle" or "mssql"
+#   measurement  InfluxDB measurement
+#   write        "fields": one point per row, tagged with the "tag" column
+#                "tags": one point per column, tagged metric=<column name>
+#   tag          name of the tag column with write=fields
+#   interval     default seconds between runs in daemon mode
+#   ttl          default cache TTL in seconds with -cache_dir
+#   change_only  written only when it changes with -change_dir
+#   variant      alternative query of the entry with the same name, used
+#                instead of it when that variant is selected
+#   arraysize    rows fetched per round trip, default -arraysize
+#   prefetchrows rows the Oracle client prefetches with the execute
+#                call, default arraysize
+#   sql          query, as a string or a list of lines
+#   columns      one {"name": ..., "type": ...} per result column, in
+#                order. type is "raw" (default), "int", "float" or "str".
+#                Extra result columns are ignored.
+# Every entry is compiled once into a function turning a result row
+# straight into points (point.py). Rows are fetched arraysize at a time
+# and turned into points batch by batch, so the point buffer can flush
+# them while the rest of the result set is still being fetched.
+import json
+import os
+
+from point import Point, Series
+
+DEFAULT_CATALOG = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'metric_catalog.json')
+
+CONVERTERS = {
+    'raw': '{0}',
+    'int': 'int({0})',
+    'float': 'float({0})',
+    'str': 'format({0})',
+}
+
+
+class CatalogMetric():
+    def __init__(self, entry):
+        try:
+            self.name = entry['name']
+            self.driver = entry['driver']
+            self.measurement = entry['measurement']
+            self.write = entry.get('write', 'fields')
+            self.tag = entry.get('tag')
+            self.interval = entry.get('interval')
+            self.ttl = entry.get('ttl')
+            self.change_only = entry.get('change_only', False)
+            self.variant = entry.get('variant')
+            self.arraysize = entry.get('arraysize')
+            self.prefetchrows = entry.get('prefetchrows')
+            sql = entry['sql']
+            self.columns = entry['columns']
+        except (KeyError, TypeError) as e:
+            raise ValueError("invalid catalog entry %s: missing %s" % (
+                entry.get('name') if isinstance(entry, dict) else entry, e))
+        self.sql = '\n'.join(sql) if isinstance(sql, list) else sql
+        self.convert = self.compile()
+
+    def compile(self):
+        fields = []
+        tag_index = None
+        for i, column in enumerate(self.columns):
+            name = column['name']
+            kind = column.get('type', 'raw')
+            if kind not in CONVERTERS:
+                raise ValueError("%s: unknown column type '%s'" % (
+                    self.name, kind))
+            if self.write == 'fields' and name == self.tag:
+                tag_index = i
+                continue
+            fields.append((name, CONVERTERS[kind].format('row[%d]' % (i))))
+        if self.write == 'fields':
+            if tag_index is None:
+                raise ValueError("%s: tag column '%s' not in columns" % (
+                    self.name, self.tag))
+            source = "def convert(row, series, add):\n" \
+                "    add(Point(series, format(row[%d]), {%s}))\n" % (
+                    tag_index,
+                    ', '.join('%r: %s' % field for field in fields))
+        elif self.write == 'tags':
+            source = "def convert(row, series, add):\n"
+            for name, value in fields:
+                source += "    add(Point(series, %r, {'value': %s}))\n" % (
+                    name, value)
+        else:
+            raise ValueError("%s: unknown write mode '%s'" % (
+                self.name, self.write))
+        namespace = {'Point': Point}
+        exec(compile(source, '<catalog %s>' % (self.name), 'exec'), namespace)
+        return namespace['convert']
+
+    # Run the query on the collector's connection and write its points.
+    # Returns the number of rows fetched.
+    def run(self, collector):
+        cursor = collector.cursor()
+        arraysize = self.arraysize or collector.arraysize or cursor.arraysize
+        cursor.arraysize = arraysize
+        # prefetchrows only exists with cx_Oracle 8 and later
+        if hasattr(cursor, 'prefetchrows'):
+            cursor.prefetchrows = self.prefetchrows or arraysize
+        cursor.execute(self.sql)
+        convert = self.convert
+        # tag set of the points escaped once for the whole result set
+        series = Series(self.measurement, collector.base_tags,
+                        self.tag if self.write == 'fields' else 'metric')
+        add = collector.point_buffer.add
+        rows = 0
+        while True:
+            batch = cursor.fetchmany(arraysize)
+            if not batch:
+                break
+            for row in batch:
+                convert(row, series, add)
+            rows += len(batch)
+        return rows
+
+
+# variants: {name: variant} selected instead of the default entries
+def load_catalog(path, driver, variants=None):
+    variants = variants or {}
+    with open(path) as f:
+        catalog = json.load(f)
+    if isinstance(catalog, dict):
+        catalog = catalog.get('metrics', [])
+    if not isinstance(catalog, list):
+        raise ValueError("%s: expected a list of metrics" % (path))
+    metrics = [CatalogMetric(entry) for entry in catalog]
+    metrics = [metric for metric in metrics if metric.driver == driver]
+    for name, variant in variants.items():
+        if not any(metric.name == name and metric.variant == variant
+                   for metric in metrics):
+            raise ValueError("%s: no '%s' variant of %s" % (
+                path, variant, name))
+    return [metric for metric in metrics
+            if metric.variant == variants.get(metric.name)]
@@ -0,0 +1,235 @@
+#!/usr/bin/python3
+# Snapshot diffing of the MSSQL cumulative counter views.
+# sys.dm_os_performance_counters and sys.dm_os_wait_stats return thousands
+# of rows of mostly cumulative counters. A snapshot keeps the keys of the
+# rows and their values as arrays. Two snapshots, taken in one run or
+# one kept from the previous run, are diffed column by column with
+# map()/itemgetter() over the whole counter set, and the row layout
+# (counter types, base counters, point grouping) is worked out once and
+# reused for as long as the set of counters does not change.
+import json
+import operator
+import os
+from array import array
+
+# cntr_type of sys.dm_os_performance_counters
+PERF_COUNTER_LARGE_RAWCOUNT = 65792     # current value
+PERF_COUNTER_BULK_COUNT = 272696576     # cumulative, reported per second
+PERF_LARGE_RAW_FRACTION = 537003264     # value / base, as a percentage
+PERF_AVERAGE_BULK = 1073874176          # delta(value) / delta(base)
+PERF_LARGE_RAW_BASE = 1073939712        # base of the two above
+
+
+class Snapshot():
+    def __init__(self, keys, columns, time, start=None):
+        self.keys = keys
+        # one array('d') per value column, aligned with keys
+        self.columns = columns
+        self.time = time
+        # server start time, to detect restarts between runs
+        self.start = start
+
+    @classmethod
+    def from_rows(cls, rows, key_count, value_count, time, start=None):
+        keys = [tuple(row[:key_count]) for row in rows]
+        columns = [array('d', map(float, map(operator.itemgetter(
+            key_count + i), rows))) for i in range(value_count)]
+        return cls(keys, columns, time, start)
+
+    def to_json(self):
+        return {'keys': self.keys, 'time': self.time, 'start': self.start,
+                'columns': [list(column) for column in self.columns]}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls([tuple(key) for key in data['keys']],
+                   [array('d', column) for column in data['columns']],
+                   data['time'], data.get('start'))
+
+
+# Columns of the previous snapshot lined up with the current keys.
+# Counters that are new in this snapshot get a delta of 0.
+def align(previous, current):
+    if previous.keys == current.keys:
+        return previous.columns
+    index = dict((key, i) for i, key in enumerate(previous.keys))
+    positions = [index.get(key, -1) for key in current.keys]
+    columns = []
+    for last, now in zip(previous.columns, current.columns):
+        columns.append(array('d', [
+            last[position] if position >= 0 else now[i]
+            for i, position in enumerate(positions)]))
+    return columns
+
+
+# Change of the first count value columns since the previous snapshot
+def deltas(previous, current, count=None):
+    return [list(map(operator.sub, now, last)) for now, last
+            in zip(current.columns[:count],
+                   align(previous, current)[:count])]
+
+
+# itemgetter that always returns a tuple
+def picker(indexes):
+    if len(indexes) == 1:
+        index = indexes[0]
+        return lambda values: (values[index],)
+    if not indexes:
+        return lambda values: ()
+    return operator.itemgetter(*indexes)
+
+
+def ratio(value, base):
+    return value * 100.0 / base if base > 0 else None
+
+
+def average(value, base):
+    return value / base if base > 0 and value >= 0 else None
+
+
+def base_name(counter):
+    name = counter.lower().replace(' (ms)', '').strip()
+    if name.endswith(' base'):
+        name = name[:-len(' base')]
+    return name
+
+
+class CounterLayout():
+    # How the rows of one set of performance counters become points:
+    # every non-base counter is a field of the point of its object and
+    # instance.
+    def __init__(self, keys, types):
+        self.keys = keys
+        bases = {}
+        for i, (obj, counter, instance) in enumerate(keys):
+            if types[i] == PERF_LARGE_RAW_BASE:
+                bases[(obj, instance, base_name(counter))] = i
+        raw, bulk, fraction, averages = [], [], [], []
+        groups = {}
+        for i, (obj, counter, instance) in enumerate(keys):
+            kind = types[i]
+            if kind == PERF_COUNTER_BULK_COUNT:
+                target = bulk
+                entry = i
+            elif kind in (PERF_LARGE_RAW_FRACTION, PERF_AVERAGE_BULK):
+                base = bases.get((obj, instance, base_name(counter)))
+                if base is None:
+                    continue
+                target = fraction if kind == PERF_LARGE_RAW_FRACTION \
+                    else averages
+                entry = (i, base)
+            elif kind == PERF_LARGE_RAW_BASE:
+                continue
+            else:
+                target = raw
+                entry = i
+            target.append(entry)
+            groups.setdefault((obj, instance), []).append(
+                (counter, target, len(target) - 1))
+        # results are computed as raw + bulk + fraction + averages
+        offsets = {id(raw): 0, id(bulk): len(raw),
+                   id(fraction): len(raw) + len(bulk),
+                   id(averages): len(raw) + len(bulk) + len(fraction)}
+        self.raw = picker(raw)
+        self.bulk = picker(bulk)
+        self.fraction_values = picker([i for i, base in fraction])
+        self.fraction_bases = picker([base for i, base in fraction])
+        self.average_values = picker([i for i, base in averages])
+        self.average_bases = picker([base for i, base in averages])
+        self.groups = []
+        for (obj, instance), entries in groups.items():
+            names = tuple(counter for counter, target, i in entries)
+            positions = [offsets[id(target)] + i
+                         for counter, target, i in entries]
+            self.groups.append((obj, instance, names, picker(positions)))
+
+    def results(self, current, delta, elapsed):
+        values = current.columns[0]
+        changes = delta[0]
+        per_second = 1.0 / elapsed
+        return list(self.raw(values)) + \
+            [change * per_second if change >= 0 else None
+             for change in self.bulk(changes)] + \
+            list(map(ratio, self.fraction_values(values),
+                     self.fraction_bases(values))) + \
+            list(map(average, self.average_values(changes),
+                     self.average_bases(changes)))
+
+
+class MSSQLCounters():
+    def __init__(self, state_path=None):
+        # state_path: keep snapshots across runs in this JSON file
+        self.state_path = state_path
+        self.layout = None
+        self.previous = {}
+        if state_path:
+            try:
+                with open(state_path) as f:
+                    state = json.load(f)
+                self.previous = dict(
+                    (name, Snapshot.from_json(data))
+                    for name, data in state.items())
+            except (OSError, ValueError, KeyError, TypeError):
+                self.previous = {}
+
+    # Snapshot of the previous run, and keep the current one for the next
+    def exchange(self, name, snapshot):
+        previous = self.previous.get(name)
+        self.previous[name] = snapshot
+        if self.state_path:
+            directory = os.path.dirname(self.state_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp = self.state_path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(dict((key, value.to_json())
+                               for key, value in self.previous.items()), f,
+                          separators=(',', ':'))
+            os.replace(tmp, self.state_path)
+        if previous is None or previous.start != snapshot.start or \
+                snapshot.time <= previous.time:
+            return None
+        return previous
+
+    # current.columns are cntr_value and cntr_type
+    def counter_points(self, previous, current, measurement, base_tags):
+        if self.layout is None or self.layout.keys != current.keys:
+            self.layout = CounterLayout(current.keys, current.columns[1])
+        results = self.layout.results(
+            current, deltas(previous, current, 1),
+            current.time - previous.time)
+        points = []
+        for obj, instance, names, positions in self.layout.groups:
+            fields = dict((name, value) for name, value
+                          in zip(names, positions(results))
+                          if value is not None)
+            if not fields:
+                continue
+            tags = dict(base_tags)
+            tags['Object'] = obj
+            # InfluxDB has no empty tag values
+            tags['Instance'] = instance or '-'
+            points.append({"measurement": measurement, "tags": tags,
+                           "fields": fields})
+        return points
+
+    def wait_points(self, previous, current, measurement, base_tags):
+        tasks, wait_ms, signal_ms = deltas(previous, current)
+        per_second = 1.0 / (current.time - previous.time)
+        # only the wait types that had waits
+        waited = [i for i, count in enumerate(tasks) if count > 0]
+        points = []
+        for i in waited:
+            tags = dict(base_tags)
+            tags['Wait type'] = current.keys[i][0]
+            points.append({
+                "measurement": measurement,
+                "tags": tags,
+                "fields": {
+                    'Waits per sec': tasks[i] * per_second,
+                    'Wait ms per sec': wait_ms[i] * per_second,
+                    'Signal wait ms per sec': signal_ms[i] * per_second,
+                    'Avg wait ms': wait_ms[i] / tasks[i],
+                }
+            })
+        return points
@@ -1,166 +1,349 @@
-import socket
-import argparse
-import subprocess
-import re
-import cx_Oracle
-
-fqdn = socket.getfqdn()
-
-class OraStats():
-
-    def __init__(self, user, passwd, sid):
-        self.user = user
-        self.passwd = passwd
-        self.sid = sid
-        self.delengine = "none"
-        self.connection = cx_Oracle.connect(self.user, self.passwd, self.sid)
-        cursor = self.connection.cursor()
-        cursor.execute("select distinct(SVRNAME)  from v$dnfs_servers")
-        rows = cursor.fetchall()
-
-        for i in range(0, cursor.rowcount):
-            self.dengine_ip = rows[i][0]
-            proc = subprocess.Popen(["nslookup", self.dengine_ip], stdout=subprocess.PIPE)
-            lookupresult = proc.communicate()[0].split('\n')
-
-            for line in lookupresult:
-                if 'name=' in re.sub(r'\s', '', line):
-                    self.delengine = re.sub('\..*$', '', re.sub(r'^.*name=', '', re.sub(r'\s', '', re.sub(r'.$', '', line))))
-
-    def waitclassstats(self, user, passwd, sid, format):
-        cursor = self.connection.cursor()
-        cursor.execute("""
-        select n.wait_class, round(m.time_waited/m.INTSIZE_CSEC,3) AAS
-        from   v$waitclassmetric  m, v$system_wait_class n
-        where m.wait_class_id=n.wait_class_id and n.wait_class != 'Idle'
-        union
-        select  'CPU', round(value/100,3) AAS
-        from v$sysmetric where metric_name='CPU Usage Per Sec' and group_id=2
-        union select 'CPU_OS', round((prcnt.busy*parameter.cpu_count)/100,3) - aas.cpu
-        from
-        ( select value busy
-        from v$sysmetric
-        where metric_name='Host CPU Utilization (%)'
-         and group_id=2 ) prcnt,
-        ( select value cpu_count from v$parameter where name='cpu_count' )  parameter,
-        ( select  'CPU', round(value/100,3) cpu from v$sysmetric where metric_name='CPU Usage Per Sec' and group_id=2) aas
-        """)
-        for wait in cursor:
-            wait_name = wait[0]
-            wait_value = wait[1]
-            print "oracle_wait_class,fqdn={0},delphix={1},db={2},wait_class={3} wait_value={4}".format(fqdn, self.delengine, sid, re.sub(' ', '_', wait_name), wait_value)
-
-
-    def sysmetrics(self, user, passwd, sid, format):
-        cursor = self.connection.cursor()
-        cursor.execute("""
-        select METRIC_NAME,VALUE,METRIC_UNIT from v$sysmetric where group_id=2
-        """)
-        for metric in cursor:
-            metric_name = metric[0]
-            metric_value = metric[1]
-            print "oracle_sysmetric,fqdn={0},delphix={1},db={2},metric_name={3} metric_value={4}".format(fqdn,self.delengine,sid,re.sub(' ', '_', metric_name),metric_value)
-
-    def fraused(self, user, passwd, sid, format):
-        cursor = self.connection.cursor()
-        cursor.execute("""
-        select round((SPACE_USED-SPACE_RECLAIMABLE)*100/SPACE_LIMIT,1) from  V$RECOVERY_FILE_DEST
-        """)
-        for frau in cursor:
-            fra_used = frau[0]
-            print "oracle_fra_pctused,fqdn={0},delphix={1},db={2} fra_pctused={3}".format(fqdn,self.delengine,sid,fra_used)
-
-    def fsused(self):
-     fss = ['/oracle', '/data']
-     for fs in fss:
-            df = subprocess.Popen(["df","-P",fs], stdout=subprocess.PIPE)
-            output = df.communicate()[0]
-            total=re.sub('%','',output.split("\n")[1].split()[1])
-            used=re.sub('%','',output.split("\n")[1].split()[2])
-            pctused=re.sub('%','',output.split("\n")[1].split()[4])
-            print "oracle_fs_pctused,fqdn={0},fs_name={1} oraclefs_pctused={2},oraclefs_alloc={3},oraclefs_used={4}".format(fqdn,fs,pctused,total,used)
-
-    def waitstats(self, user, passwd, sid, format):
-        cursor = self.connection.cursor()
-        cursor.execute("""
-        select /*+ ordered use_hash(n) */
-        n.wait_class wait_class,
-        n.name wait_name,
-        m.wait_count  cnt,
-        nvl(round(10*m.time_waited/nullif(m.wait_count,0),3) ,0) avg_ms
-        from v$eventmetric m,
-        v$event_name n
-        where m.event_id=n.event_id
-        and n.wait_class <> 'Idle' and m.wait_count > 0 order by 1""")
-        for wait in cursor:
-            wait_class = wait[0]
-            wait_name = wait[1]
-            wait_cnt = wait[2]
-            wait_avgms = wait[3]
-            print "oracle_wait_event,fqdn={0},delphix={1},db={2},wait_class={3},wait_event={4} count={5},latency={6}".format(fqdn, self.delengine,sid,re.sub(' ', '_', wait_class), re.sub(' ','_',wait_name),wait_cnt,wait_avgms)
-
-    def tbsstats(self, user, passwd, sid, format):
-        cursor = self.connection.cursor()
-        cursor.execute("""
-        select /*+ ordered */ tablespace_name,
-            round(used_space),
-            round(max_size-used_space) free_space,
-            round(max_size),
-            round(used_space*100/max_size,2) percent_used
-            from (
-                select m.tablespace_name,
-                m.used_space*t.block_size/1024/1024 used_space,
-                (case when t.bigfile='YES' then power(2,32)*t.block_size/1024/1024
-                        else tablespace_size*t.block_size/1024/1024 end) max_size
-            from dba_tablespace_usage_metrics m, dba_tablespaces t
-        where m.tablespace_name=t.tablespace_name)
-        """)
-        for tbs in cursor:
-            tbs_name = tbs[0]
-            used_space_mb = tbs[1]
-            free_space_mb = tbs[2]
-            max_size_mb = tbs[3]
-            percent_used = tbs[4]
-            print "oracle_tablespaces,fqdn={0},delphix={1},db={2},tbs_name={3} used_space_mb={4},free_space_mb={5},percent_used={6},max_size_mb={7}".format(fqdn, self.delengine, sid, re.sub(' ', '_', tbs_name), used_space_mb,free_space_mb,percent_used,max_size_mb)
-
-    def database_details(self, user, passwd, sid, format):
-        cursor = self.connection.cursor()
-        cursor.execute("""
-	select created, open_mode, log_mode, database_role, controlfile_type, switchover_status, protection_mode, open_resetlogs, guard_status,force_logging from v$database
-        """)
-        for detail in cursor:
-	    db_detail = {}
-            db_detail['created'] = detail[0]
-            db_detail['open_mode'] = detail[1]
-            db_detail['log_mode'] = detail[2]
-            db_detail['database_role'] = detail[3]
-            db_detail['controlfile_type'] = detail[4]
-            db_detail['switchover_status'] = detail[5]
-            db_detail['protection_mode'] = detail[6]
-            db_detail['open_resetlogs'] = detail[7]
-            db_detail['guard_status'] = detail[8]
-            db_detail['force_logging'] = detail[9]
-            for key, value in db_detail.iteritems():
-                print "oracle_database_details,fqdn={0},delphix={1},db={2},metric={3} value=\"{4}\"".format(fqdn,self.delengine,sid,key,value)
-
-
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-f', '--format', help="Output format, default influx", choices=['kafka', 'influx'], default='influx')
-    subparsers = parser.add_subparsers(dest='stat')
-    parser_all = subparsers.add_parser('ALL', help="Get all database stats")
-    parser_all.add_argument('-u', '--user', help="Username with sys views grant", required=True)
-    parser_all.add_argument('-p', '--passwd', required=True)
-    parser_all.add_argument('-s', '--sid', help="tnsnames SID to connect", required=True)
-
-    args = parser.parse_args()
-
-    if args.stat == "ALL":
-        stats = OraStats(args.user, args.passwd, args.sid)
-        stats.waitclassstats(args.user, args.passwd, args.sid, args.format)
-        stats.waitstats(args.user, args.passwd, args.sid, args.format)
-        stats.sysmetrics(args.user, args.passwd, args.sid, args.format)
-        stats.tbsstats(args.user, args.passwd, args.sid, args.format)
-        stats.fraused(args.user, args.passwd, args.sid, args.format)
-        stats.database_details(args.user, args.passwd, args.sid, args.format)
-        #stats.fsused()
+#!/usr/bin/python3
+# Oracle performance metrics for Telegraf, as line protocol (-f influx)
+# or JSON lines (-f kafka) on stdout, or in UDP datagrams (--sink udp)
+# Run: python3 oracle_metrics.py ALL -u user -p pass -s ip/orcl
+# Telegraf execd (signal = "STDIN"), keeping the connection open:
+#   python3 oracle_metrics.py --execd ALL -u user -p pass -s ip/orcl
+# Active session sampling, per-minute aggregates only (execd, signal = "none"):
+#   python3 oracle_metrics.py --ash ALL -u user -p pass -s ip/orcl
+import socket
+import argparse
+import re
+import signal
+import sys
+import threading
+import time
+import cx_Oracle
+from sinks import ENCODERS, StreamSink, UDPSink
+from ash_sampler import ASH_QUERY, ASHSampler
+from host_resolver import DEFAULT_PATH as DEFAULT_DNS_CACHE, CachedResolver
+from fs_usage import fs_usage, mount_points
+
+fqdn = socket.getfqdn()
+
+
+# Numeric values are written as floats, as the plain numbers printed before
+def number(value):
+    return None if value is None else float(value)
+
+
+class OraStats():
+
+    def __init__(self, user, passwd, sid, sink=None, resolver=None):
+        self.user = user
+        self.passwd = passwd
+        self.sid = sid
+        self.sink = sink if sink is not None else StreamSink()
+        self.points = []
+        self.delengine = "none"
+        self.connection = None
+        self.ash_cursor = None
+        self.connect()
+        cursor = self.connection.cursor()
+        cursor.execute("select distinct(SVRNAME)  from v$dnfs_servers")
+        rows = cursor.fetchall()
+
+        # delphix tag: short host name of the dNFS server, from the cache
+        # of reverse lookups
+        resolver = resolver if resolver is not None else CachedResolver()
+        for i in range(0, cursor.rowcount):
+            self.dengine_ip = rows[i][0]
+            name = resolver.name(self.dengine_ip)
+            if name:
+                self.delengine = re.sub(r'\..*$', '', name)
+        resolver.save()
+
+    def connect(self):
+        self.connection = cx_Oracle.connect(self.user, self.passwd, self.sid)
+
+    def close(self):
+        self.ash_cursor = None
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except cx_Oracle.Error:
+                pass
+            self.connection = None
+
+    def write(self, measurement, tags, fields, timestamp=None):
+        fields = dict((key, value) for key, value in fields.items() if value is not None)
+        if not fields:
+            return
+        point_tags = {'fqdn': fqdn, 'delphix': self.delengine, 'db': self.sid}
+        point_tags.update(tags)
+        point = {
+            "measurement": measurement,
+            "tags": point_tags,
+            "fields": fields,
+        }
+        if timestamp is not None:
+            point["time"] = timestamp
+        self.points.append(point)
+
+    # Write the points of all stats collected so far
+    def flush(self):
+        points, self.points = self.points, []
+        self.sink.write_points(points)
+
+    def waitclassstats(self, user, passwd, sid, format):
+        cursor = self.connection.cursor()
+        cursor.execute("""
+        select n.wait_class, round(m.time_waited/m.INTSIZE_CSEC,3) AAS
+        from   v$waitclassmetric  m, v$system_wait_class n
+        where m.wait_class_id=n.wait_class_id and n.wait_class != 'Idle'
+        union
+        select  'CPU', round(value/100,3) AAS
+        from v$sysmetric where metric_name='CPU Usage Per Sec' and group_id=2
+        union select 'CPU_OS', round((prcnt.busy*parameter.cpu_count)/100,3) - aas.cpu
+        from
+        ( select value busy
+        from v$sysmetric
+        where metric_name='Host CPU Utilization (%)'
+         and group_id=2 ) prcnt,
+        ( select value cpu_count from v$parameter where name='cpu_count' )  parameter,
+        ( select  'CPU', round(value/100,3) cpu from v$sysmetric where metric_name='CPU Usage Per Sec' and group_id=2) aas
+        """)
+        for wait in cursor:
+            wait_name = wait[0]
+            wait_value = wait[1]
+            self.write('oracle_wait_class', {'wait_class': re.sub(' ', '_', wait_name)},
+                       {'wait_value': number(wait_value)})
+
+
+    def sysmetrics(self, user, passwd, sid, format):
+        cursor = self.connection.cursor()
+        cursor.execute("""
+        select METRIC_NAME,VALUE,METRIC_UNIT from v$sysmetric where group_id=2
+        """)
+        for metric in cursor:
+            metric_name = metric[0]
+            metric_value = metric[1]
+            self.write('oracle_sysmetric', {'metric_name': re.sub(' ', '_', metric_name)},
+                       {'metric_value': number(metric_value)})
+
+    def fraused(self, user, passwd, sid, format):
+        cursor = self.connection.cursor()
+        cursor.execute("""
+        select round((SPACE_USED-SPACE_RECLAIMABLE)*100/SPACE_LIMIT,1) from  V$RECOVERY_FILE_DEST
+        """)
+        for frau in cursor:
+            fra_used = frau[0]
+            self.write('oracle_fra_pctused', {}, {'fra_pctused': number(fra_used)})
+
+    # Mount points of the datafiles, temp files, redo logs and control files
+    def database_mounts(self):
+        cursor = self.connection.cursor()
+        cursor.execute("""
+        select file_name from dba_data_files
+        union select file_name from dba_temp_files
+        union select member from v$logfile
+        union select name from v$controlfile
+        """)
+        return mount_points([row[0] for row in cursor])
+
+    def fsused(self, fss=None):
+     if not fss:
+         fss = self.database_mounts()
+     for fs in fss:
+            try:
+                fields = fs_usage(fs)
+            except OSError:
+                continue
+            self.points.append({
+                "measurement": 'oracle_fs_pctused',
+                "tags": {'fqdn': fqdn, 'fs_name': fs},
+                "fields": fields,
+            })
+
+    def waitstats(self, user, passwd, sid, format):
+        cursor = self.connection.cursor()
+        cursor.execute("""
+        select /*+ ordered use_hash(n) */
+        n.wait_class wait_class,
+        n.name wait_name,
+        m.wait_count  cnt,
+        nvl(round(10*m.time_waited/nullif(m.wait_count,0),3) ,0) avg_ms
+        from v$eventmetric m,
+        v$event_name n
+        where m.event_id=n.event_id
+        and n.wait_class <> 'Idle' and m.wait_count > 0 order by 1""")
+        for wait in cursor:
+            wait_class = wait[0]
+            wait_name = wait[1]
+            wait_cnt = wait[2]
+            wait_avgms = wait[3]
+            self.write('oracle_wait_event',
+                       {'wait_class': re.sub(' ', '_', wait_class), 'wait_event': re.sub(' ', '_', wait_name)},
+                       {'count': number(wait_cnt), 'latency': number(wait_avgms)})
+
+    def tbsstats(self, user, passwd, sid, format):
+        cursor = self.connection.cursor()
+        cursor.execute("""
+        select /*+ ordered */ tablespace_name,
+            round(used_space),
+            round(max_size-used_space) free_space,
+            round(max_size),
+            round(used_space*100/max_size,2) percent_used
+            from (
+                select m.tablespace_name,
+                m.used_space*t.block_size/1024/1024 used_space,
+                (case when t.bigfile='YES' then power(2,32)*t.block_size/1024/1024
+                        else tablespace_size*t.block_size/1024/1024 end) max_size
+            from dba_tablespace_usage_metrics m, dba_tablespaces t
+        where m.tablespace_name=t.tablespace_name)
+        """)
+        for tbs in cursor:
+            tbs_name = tbs[0]
+            used_space_mb = tbs[1]
+            free_space_mb = tbs[2]
+            max_size_mb = tbs[3]
+            percent_used = tbs[4]
+            self.write('oracle_tablespaces', {'tbs_name': re.sub(' ', '_', tbs_name)},
+                       {'used_space_mb': number(used_space_mb), 'free_space_mb': number(free_space_mb),
+                        'percent_used': number(percent_used), 'max_size_mb': number(max_size_mb)})
+
+    # Sessions active right now, as (wait class, event, sql id) rows.
+    # The cursor is kept so the statement is not parsed again every sample.
+    def active_sessions(self):
+        if self.ash_cursor is None:
+            self.ash_cursor = self.connection.cursor()
+            self.ash_cursor.arraysize = 500
+        self.ash_cursor.execute(ASH_QUERY)
+        return self.ash_cursor.fetchall()
+
+    def database_details(self, user, passwd, sid, format):
+        cursor = self.connection.cursor()
+        cursor.execute("""
+        select created, open_mode, log_mode, database_role, controlfile_type, switchover_status, protection_mode, open_resetlogs, guard_status,force_logging from v$database
+        """)
+        for detail in cursor:
+            db_detail = {}
+            db_detail['created'] = detail[0]
+            db_detail['open_mode'] = detail[1]
+            db_detail['log_mode'] = detail[2]
+            db_detail['database_role'] = detail[3]
+            db_detail['controlfile_type'] = detail[4]
+            db_detail['switchover_status'] = detail[5]
+            db_detail['protection_mode'] = detail[6]
+            db_detail['open_resetlogs'] = detail[7]
+            db_detail['guard_status'] = detail[8]
+            db_detail['force_logging'] = detail[9]
+            for key, value in db_detail.items():
+                self.write('oracle_database_details', {'metric': key}, {'value': str(value)})
+
+
+def collect_all(stats, args):
+    stats.waitclassstats(args.user, args.passwd, args.sid, args.format)
+    stats.waitstats(args.user, args.passwd, args.sid, args.format)
+    stats.sysmetrics(args.user, args.passwd, args.sid, args.format)
+    stats.tbsstats(args.user, args.passwd, args.sid, args.format)
+    stats.fraused(args.user, args.passwd, args.sid, args.format)
+    stats.database_details(args.user, args.passwd, args.sid, args.format)
+    if args.fsused:
+        stats.fsused(args.fs)
+
+
+# Telegraf execd: collect on the open connection every time Telegraf
+# writes a line to stdin, and write each batch at once. Stops when stdin
+# is closed. After a database error the next batch reconnects.
+def run_execd(stats, args):
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        try:
+            if stats.connection is None:
+                stats.connect()
+            collect_all(stats, args)
+        except cx_Oracle.Error as e:
+            sys.stderr.write("oracle_metrics: %s\n" % (e))
+            sys.stderr.flush()
+            stats.close()
+        stats.flush()
+    stats.close()
+
+
+def write_ash(stats, sampler):
+    minute = sampler.time()
+    for measurement, tags, fields in sampler.aggregates():
+        # spaces in tag values as in the other oracle_* measurements
+        tags = dict((key, re.sub(' ', '_', value)) for key, value in tags.items())
+        stats.write(measurement, tags, fields, minute)
+    stats.flush()
+
+
+# ASH sampling: v$session every --ash_interval seconds on the open
+# connection, written once a minute as aggregates. Runs until stopped,
+# after a database error the next sample reconnects.
+def run_ash(stats, args):
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *unused: stopped.set())
+    signal.signal(signal.SIGINT, lambda *unused: stopped.set())
+    # a minute of samples, and one for timer jitter
+    sampler = ASHSampler(int(60 / args.ash_interval) + 1, args.ash_keys,
+                         args.ash_top)
+    next_sample = time.monotonic()
+    while not stopped.is_set():
+        now = time.time()
+        if sampler.due(now):
+            write_ash(stats, sampler)
+        try:
+            if stats.connection is None:
+                stats.connect()
+            sampler.add(stats.active_sessions(), now)
+        except cx_Oracle.Error as e:
+            sys.stderr.write("oracle_metrics: %s\n" % (e))
+            sys.stderr.flush()
+            stats.close()
+        # samples missed while the database was slow are skipped
+        next_sample = max(next_sample + args.ash_interval, time.monotonic())
+        stopped.wait(next_sample - time.monotonic())
+    if sampler.samples:
+        write_ash(stats, sampler)
+    stats.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--format', help="Output format, line protocol (influx) or JSON lines (kafka). Default influx", choices=['kafka', 'influx'], default='influx')
+    parser.add_argument('--sink', help="Write to stdout or UDP, default stdout", choices=['stdout', 'udp'], default='stdout')
+    parser.add_argument('--udp_host', help="Host of the UDP listener with --sink udp", default='localhost')
+    parser.add_argument('--udp_port', help="Port of the UDP listener with --sink udp", type=int, default=8089)
+    parser.add_argument('--execd', help="Keep running, collecting on every line read from stdin (Telegraf execd)", action='store_true')
+    parser.add_argument('--ash', help="Keep running, sampling the active sessions and writing per-minute aggregates", action='store_true')
+    parser.add_argument('--ash_interval', help="Seconds between two active session samples with --ash, default 1", type=float, default=1)
+    parser.add_argument('--ash_keys', help="Wait class/event/SQL id keys counted per minute with --ash, the rest go to Other. Default 1000", type=int, default=1000)
+    parser.add_argument('--ash_top', help="Keys written per minute with --ash, the rest go to Other. Default 50", type=int, default=50)
+    parser.add_argument('--fsused', help="Get filesystem usage too", action='store_true')
+    parser.add_argument('--fs', help="Filesystem to get usage of with --fsused, can be repeated. Default: those of the database files",
+                        action='append')
+    parser.add_argument('--dns_cache', help="File caching the dNFS server names, default ~/.cache/oracle_metrics/dns.json",
+                        default=DEFAULT_DNS_CACHE)
+    parser.add_argument('--dns_ttl', help="Seconds a cached dNFS server name is used, default 86400", type=float, default=86400)
+    subparsers = parser.add_subparsers(dest='stat')
+    parser_all = subparsers.add_parser('ALL', help="Get all database stats")
+    parser_all.add_argument('-u', '--user', help="Username with sys views grant", required=True)
+    parser_all.add_argument('-p', '--passwd', required=True)
+    parser_all.add_argument('-s', '--sid', help="tnsnames SID to connect", required=True)
+
+    args = parser.parse_args()
+    if args.ash and args.execd:
+        parser.error("--ash can not be used with --execd")
+    if args.ash_interval <= 0 or args.ash_interval > 60:
+        parser.error("--ash_interval must be between 0 and 60 seconds")
+
+    if args.stat == "ALL":
+        encode = ENCODERS[args.format]
+        if args.sink == 'udp':
+            sink = UDPSink(args.udp_host, args.udp_port, encode)
+        else:
+            sink = StreamSink(sys.stdout.buffer, encode)
+        resolver = CachedResolver(args.dns_cache, args.dns_ttl)
+        stats = OraStats(args.user, args.passwd, args.sid, sink, resolver)
+        if args.ash:
+            run_ash(stats, args)
+        elif args.execd:
+            run_execd(stats, args)
+        else:
+            collect_all(stats, args)
+            stats.flush()
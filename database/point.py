@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+# Compact points of the collector methods.
+# A method writes many points with the same measurement and base tags
+# (hostname, host_group) and one tag of their own (Username, metric...).
+# A Series holds what they share, escaped for line protocol once per run,
+# and a Point only its own tag value and fields, so encoding a point is
+# two string concatenations and its fields. Points read like the point
+# dicts (point['tags'], dict(point)...), for the observers, the spool and
+# the result cache.
+from line_protocol import escape_tag, escape_value
+
+KEYS = ('measurement', 'tags', 'fields')
+
+
+class Series():
+    __slots__ = ('measurement', 'base', 'tag', 'head', 'tail', 'bare',
+                 'field_set')
+
+    def __init__(self, measurement, base, tag=None):
+        self.measurement = measurement
+        self.base = base
+        self.tag = tag
+        before = after = ''
+        # tags sorted by key as make_line does, around the point's own tag
+        for key in sorted(base):
+            key_escaped = escape_tag(key)
+            value_escaped = escape_tag(base[key])
+            if key == tag or not (key_escaped and value_escaped):
+                continue
+            if tag is not None and key > tag:
+                after += ',%s=%s' % (key_escaped, value_escaped)
+            else:
+                before += ',%s=%s' % (key_escaped, value_escaped)
+        prefix = escape_tag(measurement) + before
+        # line prefix of a point without its own tag
+        self.bare = prefix + after
+        self.head = prefix
+        self.tail = ''
+        if tag is not None:
+            self.head = '%s,%s=' % (prefix, escape_tag(tag))
+            self.tail = after
+        # (field keys of the last point, them sorted and escaped)
+        self.field_set = ((), [])
+
+    # (key, escaped key) sorted, for points with these field keys
+    def fields_of(self, keys):
+        field_set = self.field_set
+        if keys != field_set[0]:
+            field_set = self.field_set = (keys, [
+                (key, escape_tag(key)) for key in sorted(keys)])
+        return field_set[1]
+
+
+class Point():
+    __slots__ = ('series', 'value', 'fields', 'time')
+
+    def __init__(self, series, value, fields, time=None):
+        self.series = series
+        # value of the series' tag
+        self.value = value
+        self.fields = fields
+        self.time = time
+
+    @property
+    def measurement(self):
+        return self.series.measurement
+
+    @property
+    def tags(self):
+        tags = dict(self.series.base)
+        if self.series.tag is not None:
+            tags[self.series.tag] = self.value
+        return tags
+
+    # Read access of a point dict
+    def __getitem__(self, key):
+        if key == 'fields':
+            return self.fields
+        if key == 'measurement':
+            return self.series.measurement
+        if key == 'tags':
+            return self.tags
+        if key == 'time' and self.time is not None:
+            return self.time
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in KEYS or (key == 'time' and self.time is not None)
+
+    def keys(self):
+        return KEYS + ('time',) if self.time is not None else KEYS
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    # Rough encoded size, for the point buffer's byte limit
+    def size(self):
+        size = len(self.series.head) + len(self.series.tail) + 20
+        value = self.value
+        size += len(value) if type(value) is str else 16
+        for key, value in self.fields.items():
+            size += len(key) + (len(value) + 4 if type(value) is str else 16)
+        return size
+
+    # Line protocol, as make_line encodes the point's dict
+    def line(self):
+        series = self.series
+        fields = self.fields
+        field_set = []
+        for key, escaped in series.fields_of(tuple(fields)):
+            value = fields[key]
+            if value is not None:
+                field_set.append(escaped + '=' + escape_value(value))
+        if not field_set:
+            return None
+        line = series.head
+        if series.tag is not None:
+            value = escape_tag(self.value)
+            line = series.head + value + series.tail if value else series.bare
+        line += ' ' + ','.join(field_set)
+        if self.time is not None:
+            line += ' %d' % (int(self.time))
+        return line
@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+# Shared point buffer for the metrics collectors.
+# Collectors add points while they run and the buffer writes them to
+# InfluxDB in as few requests as possible: once at the end of the run, or
+# in chunks whenever max_points or max_bytes is reached.
+# The buffer is thread-safe so collector methods running in parallel can
+# share it.
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PointBuffer():
+    def __init__(self, influx_client, max_points=5000, max_bytes=1048576,
+                 point_filter=None):
+        # influx_client: any object with write_points(points)
+        self.influx_client = influx_client
+        # point_filter: optional ChangeFilter dropping unchanged points
+        self.point_filter = point_filter
+        # objects with commit() and rollback(), told after each flush
+        # whether its points were written (the result cache)
+        self.committers = []
+        # committers of inner buffers whose points were flushed into this
+        # one, told once this buffer's own write succeeded or failed
+        self.deferred = []
+        # functions called with every point added, before filtering
+        self.observers = []
+        self.max_points = max_points
+        self.max_bytes = max_bytes
+        self.points = []
+        self.size = 0
+        self.lock = threading.Lock()
+        # serializes writes so chunks reach InfluxDB in order
+        self.write_lock = threading.Lock()
+        # points added by the current thread are also kept here while a
+        # capture() block is active
+        self.local = threading.local()
+        # write cost, for the run statistics
+        self.flushes = 0
+        self.points_written = 0
+        self.bytes_written = 0
+        self.flush_seconds = 0.0
+
+    # Rough size of a point once encoded as line protocol, good enough to
+    # keep one request under the configured byte limit
+    @staticmethod
+    def point_size(point):
+        if not isinstance(point, dict):
+            return point.size()
+        size = len(point['measurement'])
+        for key, value in point['tags'].items():
+            size += len(key) + len(format(value)) + 2
+        for key, value in point['fields'].items():
+            size += len(key) + len(format(value)) + 4
+        return size + 20
+
+    # Number of points added by the current thread so far
+    def added(self):
+        return getattr(self.local, 'added', 0)
+
+    def add(self, point):
+        self.local.added = self.added() + 1
+        captured = getattr(self.local, 'captured', None)
+        if captured is not None:
+            captured.append(point)
+        for observer in self.observers:
+            observer(point)
+        if self.point_filter is not None and \
+                not self.point_filter.changed(point):
+            return
+        size = self.point_size(point)
+        with self.lock:
+            self.points.append(point)
+            self.size += size
+            full = (self.max_points and len(self.points) >= self.max_points) or \
+                (self.max_bytes and self.size >= self.max_bytes)
+        if full:
+            self.flush()
+
+    # Show points to the observers without writing them
+    def observe(self, points):
+        for point in points:
+            for observer in self.observers:
+                observer(point)
+
+    def extend(self, points):
+        for point in points:
+            self.add(point)
+
+    # Collect the points added by this thread inside the with block
+    @contextmanager
+    def capture(self):
+        captured = []
+        self.local.captured = captured
+        try:
+            yield captured
+        finally:
+            self.local.captured = None
+
+    # A buffer can itself be the target of another buffer's flush
+    def write_points(self, points):
+        self.extend(points)
+
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                points = self.points
+                size = self.size
+                self.points = []
+                self.size = 0
+            if not points:
+                self.commit()
+                return
+            # print("Write points: {0}".format(points))
+            started = time.monotonic()
+            try:
+                self.influx_client.write_points(points)
+            except Exception:
+                self.rollback()
+                raise
+            finally:
+                self.flush_seconds += time.monotonic() - started
+            self.flushes += 1
+            self.points_written += len(points)
+            self.bytes_written += size
+            self.commit()
+
+    # The change filter, the committers and the deferred ones, which are
+    # only told once
+    def transactions(self):
+        with self.lock:
+            deferred = self.deferred
+            self.deferred = []
+        if self.point_filter is None:
+            return self.committers + deferred
+        return [self.point_filter] + self.committers + deferred
+
+    # Called once the points taken by a flush were written. Points
+    # written to another buffer are not delivered yet: that buffer
+    # commits them after its own write.
+    def commit(self):
+        transactions = self.transactions()
+        if isinstance(self.influx_client, PointBuffer):
+            with self.influx_client.lock:
+                self.influx_client.deferred.extend(transactions)
+            return
+        for transaction in transactions:
+            transaction.commit()
+
+    # Called when a write failed so those points are sent again next time
+    def rollback(self):
+        for transaction in self.transactions():
+            transaction.rollback()
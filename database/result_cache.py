@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# TTL cache of collector method results.
+# Slow-changing data (users, db links, datafiles, backup history...) does
+# not need to be queried as often as uptime. A cached method is skipped
+# until its TTL expires; its last points can optionally be written again
+# so the series stay continuous. A result is only cached once the point
+# buffer has written its points, so a failed write does not hide them
+# for a whole TTL. The cache is kept in a JSON file per database instance:
+#   {method: {"expires": epoch, "points": [point, ...]}}
+import json
+import os
+import re
+import threading
+import time
+
+from spool import json_default
+
+
+# Cache file of one database instance
+def cache_path(directory, *names, suffix='.json'):
+    name = '_'.join(re.sub(r'[^A-Za-z0-9.-]+', '-', format(name))
+                    for name in names)
+    return os.path.join(directory, name + suffix)
+
+
+class ResultCache():
+    def __init__(self, path, ttls, reemit=False):
+        self.path = path
+        self.ttls = ttls
+        self.reemit = reemit
+        self.lock = threading.Lock()
+        # results of this run waiting for their points to be written
+        self.pending = {}
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, default=json_default)
+        os.replace(tmp, self.path)
+
+    # Run a collector method unless its cached result is still fresh.
+    # Returns what the method returned, None when it was skipped.
+    def run(self, method, function, point_buffer):
+        ttl = self.ttls.get(method)
+        if not ttl:
+            return function()
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(method)
+        if entry and entry['expires'] > now:
+            if self.reemit:
+                point_buffer.extend(dict(point) for point in entry['points'])
+            else:
+                # thresholds still see the cached values
+                point_buffer.observe(entry['points'])
+            return None
+        with point_buffer.capture() as points:
+            result = function()
+        with self.lock:
+            self.pending[method] = {'expires': now + ttl, 'points': points}
+        return result
+
+    # Called by the point buffer once the points were written
+    def commit(self):
+        with self.lock:
+            if not self.pending:
+                return
+            self.entries.update(self.pending)
+            self.pending = {}
+            self.save()
+
+    # Called when a write failed, the methods run again next time
+    def rollback(self):
+        with self.lock:
+            self.pending = {}
@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+# Self-instrumentation of the collectors.
+# Keeps the cost of one run: time, rows fetched and points produced per
+# collector method, database connect time and InfluxDB write cost. It is
+# reported as Icinga perfdata and written to a self-monitoring
+# measurement:
+#   <measurement>,hostname=..,host_group=..,method=<method> time=..,rows=..,points=..
+#   <measurement>,hostname=..,host_group=..,method=connect time=..
+#   <measurement>,hostname=..,host_group=..,method=flush time=..,points=..,bytes=..,requests=..
+import threading
+
+
+class MethodStats():
+    def __init__(self):
+        self.seconds = 0.0
+        self.rows = 0
+        self.points = 0
+        self.runs = 0
+
+
+class RunStats():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.methods = {}
+        self.connect_seconds = 0.0
+
+    def record(self, method, seconds, rows, points):
+        with self.lock:
+            stats = self.methods.get(method)
+            if stats is None:
+                stats = self.methods[method] = MethodStats()
+            stats.seconds += seconds
+            stats.rows += rows or 0
+            stats.points += points
+            stats.runs += 1
+
+    def reset(self):
+        with self.lock:
+            self.methods = {}
+            self.connect_seconds = 0.0
+
+    def perfdata(self, point_buffer=None):
+        perf = ["'connect_time'=%.3fs" % (self.connect_seconds)]
+        with self.lock:
+            for method, stats in self.methods.items():
+                perf.append("'%s_time'=%.3fs" % (method, stats.seconds))
+                perf.append("'%s_rows'=%d" % (method, stats.rows))
+        if point_buffer is not None:
+            perf.extend(flush_perfdata(point_buffer))
+        return ' '.join(perf)
+
+    def points(self, measurement, base_tags, point_buffer=None):
+        def point(method, fields):
+            tags = dict(base_tags)
+            tags['method'] = method
+            return {"measurement": measurement, "tags": tags,
+                    "fields": fields}
+
+        points = [point('connect', {'time': self.connect_seconds})]
+        with self.lock:
+            for method, stats in self.methods.items():
+                points.append(point(method, {
+                    'time': stats.seconds,
+                    'rows': stats.rows,
+                    'points': stats.points,
+                }))
+        if point_buffer is not None and point_buffer.flushes:
+            points.append(point('flush', {
+                'time': point_buffer.flush_seconds,
+                'points': point_buffer.points_written,
+                'bytes': point_buffer.bytes_written,
+                'requests': point_buffer.flushes,
+            }))
+        return points
+
+
+def flush_perfdata(point_buffer):
+    perf = ["'points'=%d" % (point_buffer.points_written),
+            "'bytes'=%dB" % (point_buffer.bytes_written),
+            "'writes'=%d" % (point_buffer.flushes),
+            "'write_time'=%.3fs" % (point_buffer.flush_seconds)]
+    # backlog of a spool (spool.Spool) under the buffer
+    backlog = getattr(point_buffer.influx_client, 'backlog', None)
+    if backlog is not None:
+        segments, size = backlog()
+        perf += ["'spool_segments'=%d" % (segments),
+                 "'spool_bytes'=%dB" % (size),
+                 "'spool_rejected'=%d" % (point_buffer.influx_client.rejected)]
+    return perf
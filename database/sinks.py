@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+# Output sinks shared by the collectors.
+# A sink takes points like InfluxDBClient.write_points does, so it can be
+# used under a PointBuffer or a Spool:
+#   http    batched writes to the InfluxDB HTTP API over a keep-alive
+#           connection (InfluxWriter)
+#   stdout  line protocol on stdout, for Telegraf exec/execd
+#   udp     fire-and-forget line protocol datagrams, for the InfluxDB or
+#           Telegraf UDP listeners
+# Points are encoded as line protocol, or as one JSON object per line
+# for consumers such as Kafka.
+import json
+import socket
+import sys
+
+from line_protocol import make_lines
+from spool import json_default
+
+SINKS = ('http', 'stdout', 'udp')
+# fits an Ethernet MTU without IP fragmentation
+UDP_PACKET_BYTES = 1400
+
+
+def line_protocol(points):
+    return make_lines(points).encode('utf-8')
+
+
+def json_lines(points):
+    return ''.join(json.dumps(point, default=json_default,
+                              separators=(',', ':')) + '\n'
+                   for point in points).encode('utf-8')
+
+
+ENCODERS = {
+    'influx': line_protocol,
+    'kafka': json_lines,
+}
+
+
+class StreamSink():
+    def __init__(self, stream=None, encode=line_protocol):
+        self.stream = stream if stream is not None else sys.stdout.buffer
+        self.encode = encode
+
+    def write_points(self, points):
+        if not points:
+            return True
+        self.stream.write(self.encode(points))
+        self.stream.flush()
+        return True
+
+
+class UDPSink():
+    def __init__(self, host, port, encode=line_protocol,
+                 packet_bytes=UDP_PACKET_BYTES):
+        self.address = (host, port)
+        self.encode = encode
+        self.packet_bytes = packet_bytes
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # datagrams not sent, nobody waits for an answer
+        self.errors = 0
+
+    # Whole lines packed into datagrams of up to packet_bytes
+    def packets(self, data):
+        start = 0
+        while start < len(data):
+            end = start + self.packet_bytes
+            if end < len(data):
+                cut = data.rfind(b'\n', start, end)
+                # a line longer than a packet is sent on its own
+                end = cut + 1 if cut >= start else data.find(b'\n', end) + 1
+                if end <= start:
+                    end = len(data)
+            yield data[start:end]
+            start = end
+
+    def write_points(self, points):
+        if not points:
+            return True
+        for packet in self.packets(self.encode(points)):
+            try:
+                self.socket.sendto(packet, self.address)
+            except OSError:
+                self.errors += 1
+        return True
+
+
+def make_sink(args):
+    if args.sink == 'stdout':
+        return StreamSink()
+    if args.sink == 'udp':
+        return UDPSink(args.udp_host, args.udp_port)
+    # http.client is only imported when writing over HTTP
+    from influx_writer import InfluxWriter
+    return InfluxWriter(
+        args.influx_host, args.influx_port, args.influx_user,
+        args.influx_password, args.influx_db, timeout=args.influx_timeout)
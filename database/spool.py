@@ -0,0 +1,263 @@
+#!/usr/bin/python3
+# Disk-backed write-ahead spool between the collectors and InfluxDB.
+# Points are stamped with their collection time and appended to segment
+# files in the spool directory while the collector runs. Once the run is
+# over, drain() replays the oldest segments to InfluxDB in large batches
+# with bounded retries, within what is left of the run budget. Whatever
+# can not be delivered stays on disk and is sent by a later run, so an
+# InfluxDB outage leaves no gap. Points InfluxDB rejects (bad line
+# protocol, field type conflicts) are moved aside so they do not block the
+# newer segments. The spool is capped in size by evicting the oldest
+# segments.
+# Spool files:
+#   <directory>/<ns>.open : segment being appended to
+#   <directory>/<ns>.seg  : sealed segment waiting to be drained
+#   <directory>/<ns>.bad  : points rejected by InfluxDB, kept to be looked at
+# One point per line, as JSON.
+import decimal
+import fcntl
+import json
+import os
+import time
+
+from point import Point
+
+
+def json_default(value):
+    # keep numeric fields numeric, everything else as its text
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, Point):
+        return dict(value)
+    return format(value)
+
+
+# Errors InfluxDB gives again for the same points: 4xx responses (bad
+# line protocol, field type conflict...) other than timeouts and rate
+# limits
+def rejected(error):
+    status = getattr(error, 'status', None)
+    return status is not None and 400 <= status < 500 and \
+        status not in (408, 429)
+
+
+class Spool():
+    def __init__(self, directory, influx_client, max_bytes=104857600,
+                 segment_bytes=4194304, batch_size=10000, retries=3,
+                 retry_delay=1, drain_timeout=10):
+        self.directory = directory
+        self.influx_client = influx_client
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.batch_size = batch_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.drain_timeout = drain_timeout
+        # last write error and points rejected by the last drain
+        self.last_error = None
+        self.rejected = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def lock(self, name, blocking=True):
+        fd = os.open(self.path(name), os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    def unlock(self, fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def segments(self, suffix):
+        return sorted(name for name in os.listdir(self.directory)
+                      if name.endswith(suffix))
+
+    # Same interface as InfluxDBClient so the spool can sit under a
+    # PointBuffer. Points are only appended, a slow InfluxDB does not
+    # hold up the collector methods.
+    def write_points(self, points):
+        self.append(points)
+
+    def append(self, points):
+        now = time.time_ns()
+        lines = []
+        for point in points:
+            if 'time' not in point:
+                point = dict(point, time=now)
+            lines.append(json.dumps(point, default=json_default))
+        data = ('\n'.join(lines) + '\n').encode()
+        fd = self.lock('.append.lock')
+        try:
+            active = self.segments('.open')
+            if active:
+                name = active[-1]
+                if os.path.getsize(self.path(name)) >= self.segment_bytes:
+                    self.seal(name)
+                    name = None
+            else:
+                name = None
+            if name is None:
+                name = '%020d.open' % (time.time_ns())
+            with open(self.path(name), 'ab') as f:
+                f.write(data)
+            self.evict()
+        finally:
+            self.unlock(fd)
+
+    def seal(self, name):
+        os.rename(self.path(name), self.path(name[:-len('.open')] + '.seg'))
+
+    # Drop the oldest sealed or rejected segments while the spool is over
+    # its cap. Called with the append lock held.
+    def evict(self):
+        names = self.segments('.seg') + self.segments('.bad') + \
+            self.segments('.open')
+        sizes = {}
+        for name in names:
+            try:
+                sizes[name] = os.path.getsize(self.path(name))
+            except FileNotFoundError:
+                sizes[name] = 0
+        total = sum(sizes.values())
+        for name in sorted(names):
+            if total <= self.max_bytes or name.endswith('.open'):
+                break
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+            total -= sizes[name]
+
+    # Send one batch, retrying until deadline. Each request is limited to
+    # the time left when the client allows it (InfluxWriter.set_timeout).
+    # Returns True once sent, False when it can be sent later and None
+    # when InfluxDB rejected it.
+    def write_batch(self, batch, deadline):
+        set_timeout = getattr(self.influx_client, 'set_timeout', None)
+        for attempt in range(self.retries):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if set_timeout is not None:
+                set_timeout(remaining)
+            try:
+                self.influx_client.write_points(batch)
+                return True
+            except Exception as e:
+                self.last_error = e
+                if rejected(e):
+                    return None
+                if attempt + 1 < self.retries:
+                    time.sleep(max(0, min(self.retry_delay,
+                                          deadline - time.monotonic())))
+        return False
+
+    # Send one segment. Returns False when InfluxDB did not accept it, in
+    # which case the unsent points are kept in the segment.
+    def drain_segment(self, name, deadline):
+        try:
+            with open(self.path(name), 'rb') as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return True
+        sent = 0
+        while sent < len(lines):
+            if time.monotonic() >= deadline:
+                break
+            batch = [json.loads(line)
+                     for line in lines[sent:sent + self.batch_size] if line]
+            written = self.write_batch(batch, deadline)
+            if written is None:
+                self.quarantine(name, lines[sent:sent + self.batch_size])
+                self.rejected += len(batch)
+            elif not written:
+                break
+            sent += self.batch_size
+        if sent >= len(lines):
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+            return True
+        if sent:
+            tmp = self.path(name + '.tmp')
+            with open(tmp, 'wb') as f:
+                f.write(b'\n'.join(lines[sent:]) + b'\n')
+            os.replace(tmp, self.path(name))
+        return False
+
+    # Keep rejected points aside, in the .bad file of the segment
+    def quarantine(self, name, lines):
+        with open(self.path(name[:-len('.seg')] + '.bad'), 'ab') as f:
+            f.write(b'\n'.join(lines) + b'\n')
+
+    # Replay spooled points, oldest first, until the spool is empty, a
+    # write keeps failing or timeout (at most drain_timeout) is spent.
+    # Only one process drains a spool at a time.
+    def drain(self, timeout=None):
+        fd = self.lock('.drain.lock', blocking=False)
+        if fd is None:
+            return
+        self.last_error = None
+        self.rejected = 0
+        try:
+            append_fd = self.lock('.append.lock')
+            try:
+                for name in self.segments('.open'):
+                    self.seal(name)
+            finally:
+                self.unlock(append_fd)
+            if timeout is None or timeout > self.drain_timeout:
+                timeout = self.drain_timeout
+            deadline = time.monotonic() + timeout
+            for name in self.segments('.seg'):
+                if not self.drain_segment(name, deadline):
+                    break
+        finally:
+            self.unlock(fd)
+
+    # (segments, bytes) still waiting to be delivered
+    def backlog(self):
+        segments = total = 0
+        for name in self.segments('.seg') + self.segments('.open'):
+            try:
+                total += os.path.getsize(self.path(name))
+                segments += 1
+            except FileNotFoundError:
+                pass
+        return segments, total
+
+
+# Send the points spooled under a point buffer, within what is left of
+# the run budget (deadline.Deadline, None = drain_timeout only)
+def drain_spool(point_buffer, deadline=None):
+    spool = point_buffer.influx_client
+    if isinstance(spool, Spool):
+        spool.drain(deadline.remaining() if deadline is not None else None)
+
+
+# Icinga state and status text of the spool under a point buffer, WARNING
+# while points wait to be delivered or when InfluxDB rejected some
+def spool_status(point_buffer):
+    spool = point_buffer.influx_client
+    if not isinstance(spool, Spool):
+        return 0, ''
+    segments, size = spool.backlog()
+    details = []
+    if segments:
+        details.append('%d segments (%dB) not delivered' % (segments, size))
+    if spool.rejected:
+        details.append('%d points rejected by InfluxDB' % (spool.rejected))
+    if not details:
+        return 0, ''
+    if spool.last_error is not None:
+        error = format(spool.last_error).strip()
+        details.append('last error: %s' % (
+            error.splitlines()[0] if error else type(spool.last_error).__name__))
+    return 1, 'spool: %s' % (', '.join(details))
@@ -0,0 +1,9 @@
+# The modules are imported as the plugins import them, from the database
+# directory, with the stand-in drivers of benchmark/ in place of cx_Oracle
+# and pymssql.
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'benchmark'))
+sys.path.insert(0, os.path.dirname(HERE))
@@ -0,0 +1,64 @@
+from change_filter import ChangeFilter
+
+
+class Clock():
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+def point(status, instance='db1'):
+    return {'measurement': 'oracle_availability',
+            'tags': {'hostname': instance, 'metric': 'Current Status'},
+            'fields': {'value': status}}
+
+
+def filter_at(monkeypatch, tmp_path, clock, heartbeat=3600):
+    monkeypatch.setattr('change_filter.time', clock)
+    return ChangeFilter(str(tmp_path / 'state' / 'db1.changes'),
+                        ['oracle_availability'], heartbeat)
+
+
+def test_unchanged_points_dropped_until_heartbeat(monkeypatch, tmp_path):
+    clock = Clock(1000000)
+    change_filter = filter_at(monkeypatch, tmp_path, clock)
+    assert change_filter.changed(point('OPEN'))
+    change_filter.commit()
+    clock.now += 60
+    assert not change_filter.changed(point('OPEN'))
+    assert change_filter.changed(point('OPEN', instance='db2'))
+    assert change_filter.changed(point('MOUNTED'))
+    change_filter.commit()
+    clock.now += 3599
+    assert not change_filter.changed(point('MOUNTED'))
+    # written again once the heartbeat is due
+    clock.now += 1
+    assert change_filter.changed(point('MOUNTED'))
+
+
+def test_other_measurements_pass(monkeypatch, tmp_path):
+    change_filter = filter_at(monkeypatch, tmp_path, Clock(1000000))
+    other = dict(point('OPEN'), measurement='oracle_uptime')
+    assert change_filter.changed(other)
+    change_filter.commit()
+    assert change_filter.changed(other)
+
+
+def test_state_kept_across_runs(monkeypatch, tmp_path):
+    clock = Clock(1000000)
+    change_filter = filter_at(monkeypatch, tmp_path, clock)
+    assert change_filter.changed(point('OPEN'))
+    change_filter.commit()
+    clock.now += 60
+    assert not filter_at(monkeypatch, tmp_path, clock).changed(point('OPEN'))
+
+
+def test_rollback_sends_again(monkeypatch, tmp_path):
+    clock = Clock(1000000)
+    change_filter = filter_at(monkeypatch, tmp_path, clock)
+    assert change_filter.changed(point('OPEN'))
+    change_filter.rollback()
+    assert change_filter.changed(point('OPEN'))
+    assert not (tmp_path / 'state' / 'db1.changes').exists()
@@ -0,0 +1,54 @@
+# Full collector runs against the stand-in drivers of benchmark/, with
+# the points recorded instead of written to InfluxDB.
+import sys
+
+import pytest
+
+from line_protocol import make_lines
+
+influxdb_line_protocol = pytest.importorskip('influxdb.line_protocol')
+
+
+class Recorder():
+    def __init__(self):
+        self.points = []
+
+    def write_points(self, points):
+        self.points.extend(points)
+
+
+def make_collector(monkeypatch, module_name, argv):
+    module = __import__(module_name)
+    monkeypatch.setattr(sys, 'argv', [module.__file__, '-influx_db', 'test',
+                                      '-timeout', '0'] + argv)
+    return module, module.parse_args()
+
+
+@pytest.mark.parametrize('module_name,collector_name,argv', [
+    ('check_oracle_metrics', 'OracleMetrics',
+     ['-oracle_user', 'test', '-oracle_password', 'test',
+      '-oracle_sid', 'test']),
+    ('check_mssql_metrics', 'MSSQLMetrics',
+     ['-mssql_server', 'test', '-mssql_user', 'test',
+      '-mssql_password', 'test']),
+])
+def test_plugin_output_as_influxdb(monkeypatch, module_name, collector_name,
+                                   argv):
+    module, args = make_collector(monkeypatch, module_name, argv)
+    collector = getattr(module, collector_name)(args)
+    recorder = Recorder()
+    collector.point_buffer.influx_client = recorder
+    try:
+        collector.collect(collector.collectors)
+        collector.finish()
+        collector.write_stats()
+        collector.flush()
+    finally:
+        collector.close()
+    assert recorder.points
+    points = [dict(point) for point in recorder.points]
+    assert make_lines(recorder.points) == influxdb_line_protocol.make_lines(
+        {'points': points})
+    state, output, perfdata = collector.check_result()
+    assert state == 0
+    assert "'points'=%d" % (len(points)) in perfdata
@@ -0,0 +1,81 @@
+# Line protocol of the encoders, checked against the influxdb package on
+# randomized points: special characters, every field type, empty tags and
+# None fields.
+import random
+
+import pytest
+
+from line_protocol import make_line, make_lines
+from point import Point, Series
+
+influxdb_line_protocol = pytest.importorskip('influxdb.line_protocol')
+
+CHARACTERS = 'ab Z9_,= "\\\n.-é'
+
+
+def random_text(rng, empty=False):
+    length = rng.randint(0 if empty else 1, 8)
+    return ''.join(rng.choice(CHARACTERS) for i in range(length))
+
+
+def random_value(rng):
+    kind = rng.randrange(6)
+    if kind == 0:
+        return rng.randint(-2 ** 40, 2 ** 40)
+    if kind == 1:
+        return rng.uniform(-1e6, 1e6)
+    if kind == 2:
+        return random_text(rng, empty=True)
+    if kind == 3:
+        return rng.random() < 0.5
+    if kind == 4:
+        return None
+    return float(rng.randint(0, 100))
+
+
+def random_fields(rng, keys):
+    fields = dict((key, random_value(rng)) for key in keys)
+    # at least one field InfluxDB accepts
+    fields[keys[0]] = rng.randint(0, 1000)
+    return fields
+
+
+def random_point(rng):
+    tags = dict((random_text(rng), random_text(rng, empty=True))
+                for i in range(rng.randint(0, 4)))
+    keys = [random_text(rng) for i in range(rng.randint(1, 5))]
+    point = {'measurement': random_text(rng), 'tags': tags,
+             'fields': random_fields(rng, keys)}
+    if rng.random() < 0.5:
+        point['time'] = rng.randint(0, 2 ** 62)
+    return point
+
+
+def test_make_lines_as_influxdb():
+    rng = random.Random(1)
+    points = [random_point(rng) for i in range(5000)]
+    assert make_lines(points) == influxdb_line_protocol.make_lines(
+        {'points': points})
+
+
+def test_points_without_fields_skipped():
+    points = [{'measurement': 'm', 'tags': {}, 'fields': {'value': None}},
+              {'measurement': 'm', 'tags': {}, 'fields': {'value': 1}}]
+    assert make_lines(points) == 'm value=1i\n'
+    assert make_lines(points[:1]) == ''
+
+
+def test_point_line_as_make_line():
+    rng = random.Random(2)
+    for i in range(500):
+        base = dict((random_text(rng), random_text(rng, empty=True))
+                    for j in range(rng.randint(0, 3)))
+        tag = random_text(rng) if rng.random() < 0.8 else None
+        series = Series(random_text(rng), base, tag)
+        keys = [random_text(rng) for j in range(rng.randint(1, 4))]
+        for j in range(10):
+            point = Point(series, random_text(rng, empty=True),
+                          random_fields(rng, keys),
+                          rng.randint(0, 2 ** 62) if j % 2 else None)
+            assert point.line() == make_line(dict(point))
+            assert make_lines([point]) == make_lines([dict(point)])
@@ -0,0 +1,117 @@
+import pytest
+
+from point_buffer import PointBuffer
+
+
+class Writer():
+    def __init__(self):
+        self.writes = []
+        self.error = None
+
+    def write_points(self, points):
+        if self.error is not None:
+            raise self.error
+        self.writes.append(list(points))
+
+
+class Committer():
+    def __init__(self):
+        self.calls = []
+
+    def commit(self):
+        self.calls.append('commit')
+
+    def rollback(self):
+        self.calls.append('rollback')
+
+
+class Filter(Committer):
+    def __init__(self, keep=True):
+        Committer.__init__(self)
+        self.keep = keep
+
+    def changed(self, point):
+        return self.keep
+
+
+def point(value):
+    return {'measurement': 'm', 'tags': {'hostname': 'db1'},
+            'fields': {'value': value}}
+
+
+def test_chunks_by_max_points():
+    writer = Writer()
+    point_buffer = PointBuffer(writer, max_points=2, max_bytes=0)
+    point_buffer.extend(point(value) for value in range(5))
+    point_buffer.flush()
+    assert [len(points) for points in writer.writes] == [2, 2, 1]
+    assert point_buffer.flushes == 3
+    assert point_buffer.points_written == 5
+
+
+def test_commit_after_write():
+    writer = Writer()
+    committer = Committer()
+    point_buffer = PointBuffer(writer)
+    point_buffer.committers.append(committer)
+    point_buffer.add(point(1))
+    point_buffer.flush()
+    assert committer.calls == ['commit']
+
+
+def test_rollback_on_failed_write():
+    writer = Writer()
+    writer.error = OSError('connection refused')
+    committer = Committer()
+    point_buffer = PointBuffer(writer, point_filter=Filter())
+    point_buffer.committers.append(committer)
+    point_buffer.add(point(1))
+    with pytest.raises(OSError):
+        point_buffer.flush()
+    assert committer.calls == ['rollback']
+    assert point_buffer.point_filter.calls == ['rollback']
+    assert point_buffer.points_written == 0
+
+
+def test_inner_buffer_commits_with_outer_write():
+    writer = Writer()
+    outer = PointBuffer(writer)
+    inner = PointBuffer(outer)
+    committer = Committer()
+    inner.committers.append(committer)
+    inner.add(point(1))
+    inner.flush()
+    # the points only reached the outer buffer
+    assert committer.calls == []
+    outer.flush()
+    assert committer.calls == ['commit']
+    assert writer.writes == [[point(1)]]
+    # told once
+    outer.flush()
+    assert committer.calls == ['commit']
+
+
+def test_inner_buffer_rolls_back_with_outer_write():
+    writer = Writer()
+    outer = PointBuffer(writer)
+    inner = PointBuffer(outer)
+    committer = Committer()
+    inner.committers.append(committer)
+    inner.add(point(1))
+    inner.flush()
+    writer.error = OSError('timed out')
+    with pytest.raises(OSError):
+        outer.flush()
+    assert committer.calls == ['rollback']
+
+
+def test_observers_see_filtered_points():
+    seen = []
+    writer = Writer()
+    point_buffer = PointBuffer(writer, point_filter=Filter(keep=False))
+    point_buffer.observers.append(seen.append)
+    point_buffer.add(point(1))
+    point_buffer.flush()
+    assert seen == [point(1)]
+    assert writer.writes == []
+    assert point_buffer.point_filter.calls == ['commit']
@@ -0,0 +1,119 @@
+import os
+
+from influx_writer import InfluxDBWriteError
+from point_buffer import PointBuffer
+from spool import Spool, spool_status
+
+
+class Writer():
+    def __init__(self):
+        self.writes = []
+        # outcome of the next writes: an error to raise, None to succeed
+        self.errors = []
+
+    def write_points(self, points):
+        error = self.errors.pop(0) if self.errors else None
+        if error is not None:
+            raise error
+        self.writes.append([point['fields']['value'] for point in points])
+
+
+def point(value):
+    return {'measurement': 'm', 'tags': {'hostname': 'db1'},
+            'fields': {'value': value}}
+
+
+def make_spool(tmp_path, writer, **kwargs):
+    kwargs.setdefault('retry_delay', 0)
+    return Spool(str(tmp_path), writer, **kwargs)
+
+
+def files(tmp_path, suffix):
+    return sorted(name for name in os.listdir(str(tmp_path))
+                  if name.endswith(suffix))
+
+
+def test_append_only_until_drained(tmp_path):
+    writer = Writer()
+    spool = make_spool(tmp_path, writer)
+    spool.write_points([point(1), point(2)])
+    assert writer.writes == []
+    assert spool.backlog()[0] == 1
+    spool.drain()
+    assert writer.writes == [[1, 2]]
+    assert spool.backlog() == (0, 0)
+    assert spool_status(PointBuffer(spool)) == (0, '')
+
+
+def test_segments_rotate_and_drain_oldest_first(tmp_path):
+    writer = Writer()
+    spool = make_spool(tmp_path, writer, segment_bytes=1)
+    for value in range(3):
+        spool.write_points([point(value)])
+    # a full segment is sealed on the next append
+    assert len(files(tmp_path, '.seg')) == 2
+    assert len(files(tmp_path, '.open')) == 1
+    spool.drain()
+    assert writer.writes == [[0], [1], [2]]
+    assert files(tmp_path, '.seg') == files(tmp_path, '.open') == []
+
+
+def test_batches_within_segment(tmp_path):
+    writer = Writer()
+    spool = make_spool(tmp_path, writer, batch_size=2)
+    spool.write_points([point(value) for value in range(5)])
+    spool.drain()
+    assert writer.writes == [[0, 1], [2, 3], [4]]
+
+
+def test_failed_write_kept_for_later(tmp_path):
+    writer = Writer()
+    spool = make_spool(tmp_path, writer, batch_size=2, retries=2)
+    spool.write_points([point(value) for value in range(4)])
+    # the first batch goes through, the second fails every retry
+    writer.errors = [None, OSError('refused'), OSError('refused')]
+    spool.drain()
+    assert writer.writes == [[0, 1]]
+    state, text = spool_status(PointBuffer(spool))
+    assert state == 1
+    assert 'last error: refused' in text
+    spool.drain()
+    assert writer.writes == [[0, 1], [2, 3]]
+    assert spool.backlog() == (0, 0)
+
+
+def test_rejected_points_set_aside(tmp_path):
+    writer = Writer()
+    spool = make_spool(tmp_path, writer, batch_size=1, segment_bytes=1)
+    for value in range(3):
+        spool.write_points([point(value)])
+    writer.errors = [InfluxDBWriteError(400, 'field type conflict')]
+    spool.drain()
+    # the rejected batch does not hold up the newer ones
+    assert writer.writes == [[1], [2]]
+    assert spool.rejected == 1
+    assert len(files(tmp_path, '.bad')) == 1
+    state, text = spool_status(PointBuffer(spool))
+    assert state == 1
+    assert '1 points rejected by InfluxDB' in text
+
+
+def test_retryable_status_not_rejected(tmp_path):
+    writer = Writer()
+    spool = make_spool(tmp_path, writer)
+    spool.write_points([point(1)])
+    writer.errors = [InfluxDBWriteError(429, 'too many requests')]
+    spool.drain()
+    assert writer.writes == [[1]]
+    assert files(tmp_path, '.bad') == []
+
+
+def test_oldest_segments_evicted(tmp_path):
+    writer = Writer()
+    spool = make_spool(tmp_path, writer, segment_bytes=1, max_bytes=200)
+    for value in range(10):
+        spool.write_points([point(value)])
+    spool.drain()
+    values = [value for batch in writer.writes for value in batch]
+    assert values == list(range(10 - len(values), 10))
+    assert len(values) < 10
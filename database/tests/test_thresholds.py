@@ -0,0 +1,86 @@
+import pytest
+
+from thresholds import CRITICAL, OK, WARNING, Range, Threshold, \
+    ThresholdEngine, parse_thresholds
+
+
+def alerts(text, values):
+    check = Range(text)
+    return [value for value in values if check.alert(value)]
+
+
+def test_range_upper_bound():
+    # 10 = alert outside 0..10
+    assert alerts('10', [-1, 0, 5, 10, 11]) == [-1, 11]
+
+
+def test_range_open_end():
+    # 10: = alert below 10
+    assert alerts('10:', [9, 10, 1000]) == [9]
+
+
+def test_range_negative_infinity():
+    # ~:10 = alert above 10
+    assert alerts('~:10', [-1000, 10, 11]) == [11]
+    assert alerts('~:', [-1000, 0, 1000]) == []
+
+
+def test_range_inside():
+    # @10:20 = alert inside 10..20
+    assert alerts('@10:20', [9, 10, 15, 20, 21]) == [10, 15, 20]
+
+
+def test_range_pattern():
+    assert alerts('=IN*', ['INVALID', 'VALID']) == ['INVALID']
+    assert alerts('!ACTIVE', ['ACTIVE', 'MOUNTED']) == ['MOUNTED']
+
+
+@pytest.mark.parametrize('text', ['abc', '20:10', '1:x'])
+def test_range_invalid(text):
+    with pytest.raises(ValueError):
+        Range(text)
+
+
+def test_threshold_parse_errors():
+    with pytest.raises(ValueError):
+        parse_thresholds(['oracle_users,Days To Expiry,14:'])
+    with pytest.raises(ValueError):
+        parse_thresholds(['oracle_users,Days To Expiry,,'])
+    with pytest.raises(ValueError):
+        parse_thresholds(['oracle_users,Days To Expiry,14:,7:,Username'])
+
+
+def test_threshold_state():
+    threshold = Threshold.parse('m,value,80,90')
+    assert threshold.state(50) == OK
+    assert threshold.state(85) == WARNING
+    assert threshold.state(95) == CRITICAL
+
+
+def test_threshold_percent():
+    threshold = Threshold.parse('m,Used%Free,85,95')
+    assert threshold.value({'Used': 90, 'Free': 10}) == 90.0
+    assert threshold.value({'Used': 0, 'Free': 0}) == 0.0
+    assert threshold.value({'Used': 90}) is None
+
+
+def point(measurement, tags, fields):
+    return {'measurement': measurement,
+            'tags': dict(tags, hostname='db1', host_group='oracle'),
+            'fields': fields}
+
+
+def test_engine_latest_value_and_tag_filter():
+    engine = ThresholdEngine(parse_thresholds([
+        'oracle_users,Days To Expiry,14:,7:,Username=APP_*']))
+    engine.observe(point('oracle_users', {'Username': 'APP_1'},
+                         {'Days To Expiry': 3}))
+    engine.observe(point('oracle_users', {'Username': 'SYS'},
+                         {'Days To Expiry': 1}))
+    assert engine.state() == CRITICAL
+    assert engine.text() == '1 critical: APP_1 Days To Expiry=3'
+    # the latest value of a series counts
+    engine.observe(point('oracle_users', {'Username': 'APP_1'},
+                         {'Days To Expiry': 10}))
+    assert engine.state() == WARNING
+    assert "'thresholds_checked'=1" in engine.perfdata()
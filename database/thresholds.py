@@ -0,0 +1,217 @@
+#!/usr/bin/python3
+# Warning/critical thresholds evaluated over the points of a run.
+# The thresholds watch the points as the collector methods add them
+# (PointBuffer observer), so the rows fetched for InfluxDB also give the
+# Icinga state, without a second check querying the database again.
+# A threshold is given as
+#   MEASUREMENT,FIELD,WARNING,CRITICAL[,TAG=GLOB...]
+# e.g.
+#   oracle_users,Days To Expiry,14:,7:,Username=APP_*
+#   oracle_tablespace_status_2,Usedbytes%Freebytes,85,95
+#   oracle_availability,value,,!ACTIVE,metric=Current Status
+#   mssql_database_details,Log space used,80,90
+#   mssql_backup_details,Backup age,1,2
+# WARNING and CRITICAL are Nagios ranges (10, 10:, ~:10, 10:20, @10:20),
+# or for text fields =GLOB (alert when matching) and !GLOB (alert when
+# not matching). An empty range is not checked. FIELD%OTHER is FIELD as a
+# percentage of FIELD + OTHER.
+import fnmatch
+import re
+import threading
+
+OK, WARNING, CRITICAL, UNKNOWN = 0, 1, 2, 3
+STATES = ('OK', 'WARNING', 'CRITICAL', 'UNKNOWN')
+# tags of every point, left out of the series labels
+BASE_TAGS = ('hostname', 'host_group')
+
+
+class Range():
+    def __init__(self, text):
+        self.text = text
+        self.pattern = None
+        if text[:1] in ('=', '!'):
+            self.pattern = re.compile(fnmatch.translate(text[1:]))
+            self.match = text[0] == '='
+            return
+        spec = text
+        self.inside = spec.startswith('@')
+        if self.inside:
+            spec = spec[1:]
+        try:
+            if ':' in spec:
+                start, end = spec.split(':', 1)
+                self.start = float('-inf') if start == '~' else \
+                    float(start or 0)
+                self.end = float(end) if end else float('inf')
+            else:
+                self.start, self.end = 0.0, float(spec)
+        except ValueError:
+            raise ValueError("invalid threshold range '%s'" % (text))
+        if self.start > self.end:
+            raise ValueError("invalid threshold range '%s'" % (text))
+
+    def numeric(self):
+        return self.pattern is None
+
+    def alert(self, value):
+        if self.pattern is not None:
+            return bool(self.pattern.match(format(value))) == self.match
+        outside = value < self.start or value > self.end
+        return not outside if self.inside else outside
+
+
+class Threshold():
+    def __init__(self, measurement, field, warning=None, critical=None,
+                 tags=None):
+        self.measurement = measurement
+        self.field = field
+        self.percent_of = None
+        if '%' in field:
+            self.field, self.percent_of = field.split('%', 1)
+        self.warning = Range(warning) if warning else None
+        self.critical = Range(critical) if critical else None
+        if self.warning is None and self.critical is None:
+            raise ValueError("threshold %s,%s: no warning or critical range" % (
+                measurement, field))
+        self.numeric = all(check.numeric() for check in
+                           (self.warning, self.critical) if check is not None)
+        self.tags = [(key, re.compile(fnmatch.translate(pattern)))
+                     for key, pattern in (tags or {}).items()]
+
+    @classmethod
+    def parse(cls, text):
+        parts = text.split(',')
+        if len(parts) < 4:
+            raise ValueError("invalid threshold '%s', expected MEASUREMENT,FIELD,WARNING,CRITICAL[,TAG=GLOB...]" % (text))
+        tags = {}
+        for part in parts[4:]:
+            key, sep, pattern = part.partition('=')
+            if not sep:
+                raise ValueError("invalid threshold tag filter '%s' in '%s'" % (
+                    part, text))
+            tags[key] = pattern
+        return cls(parts[0], parts[1], parts[2], parts[3], tags)
+
+    def matches(self, tags):
+        for key, pattern in self.tags:
+            value = tags.get(key)
+            if value is None or not pattern.match(format(value)):
+                return False
+        return True
+
+    # Value of the field in a point, None when it has none
+    def value(self, fields):
+        value = fields.get(self.field)
+        if value is None:
+            return None
+        if not self.numeric:
+            return value
+        try:
+            value = float(value)
+            if self.percent_of is not None:
+                total = value + float(fields[self.percent_of])
+                value = value * 100.0 / total if total else 0.0
+        except (KeyError, TypeError, ValueError):
+            return None
+        return value
+
+    def state(self, value):
+        if self.critical is not None and self.critical.alert(value):
+            return CRITICAL
+        if self.warning is not None and self.warning.alert(value):
+            return WARNING
+        return OK
+
+
+def parse_thresholds(values):
+    return [Threshold.parse(value) for value in values or []]
+
+
+def value_text(value):
+    if isinstance(value, float):
+        return ('%.2f' % (value)).rstrip('0').rstrip('.')
+    return format(value)
+
+
+def perf_label(label):
+    return re.sub(r"['=]", '_', label)
+
+
+class ThresholdEngine():
+    def __init__(self, thresholds, limit=5):
+        # thresholds by measurement, only those are looked at
+        self.thresholds = {}
+        for threshold in thresholds:
+            self.thresholds.setdefault(
+                threshold.measurement, []).append(threshold)
+        # non-OK series listed per state in the status text
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.results = {}
+
+    # PointBuffer observer
+    def observe(self, point):
+        thresholds = self.thresholds.get(point['measurement'])
+        if thresholds is None:
+            return
+        tags = point['tags']
+        fields = point['fields']
+        for threshold in thresholds:
+            if threshold.tags and not threshold.matches(tags):
+                continue
+            value = threshold.value(fields)
+            if value is None:
+                continue
+            label = ' '.join([format(tag_value) for key, tag_value
+                              in sorted(tags.items())
+                              if key not in BASE_TAGS] + [
+                threshold.field + (
+                    '%' + threshold.percent_of
+                    if threshold.percent_of else '')])
+            result = (threshold.state(value), value, threshold)
+            with self.lock:
+                # the latest value of a series counts
+                self.results[(point['measurement'], label)] = result
+
+    def state(self):
+        with self.lock:
+            return max([state for state, value, threshold
+                        in self.results.values()] or [OK])
+
+    def text(self):
+        with self.lock:
+            results = sorted(self.results.items())
+        parts = []
+        for state in (CRITICAL, WARNING):
+            alerts = ['%s=%s' % (label, value_text(value))
+                      for (measurement, label), (series_state, value, threshold)
+                      in results if series_state == state]
+            if not alerts:
+                continue
+            text = '%d %s: %s' % (len(alerts), STATES[state].lower(),
+                                  ', '.join(alerts[:self.limit]))
+            if len(alerts) > self.limit:
+                text += ' and %d more' % (len(alerts) - self.limit)
+            parts.append(text)
+        return '; '.join(parts)
+
+    # Counts of the checked series, and the perfdata of the alerting ones
+    # listed in the status text
+    def perfdata(self):
+        with self.lock:
+            results = sorted(self.results.items())
+        counts = [0, 0, 0, 0]
+        perf = {CRITICAL: [], WARNING: []}
+        for (measurement, label), (state, value, threshold) in results:
+            counts[state] += 1
+            if state not in perf or not threshold.numeric or \
+                    len(perf[state]) >= self.limit:
+                continue
+            perf[state].append("'%s'=%s;%s;%s" % (
+                perf_label(label), value_text(value),
+                threshold.warning.text if threshold.warning else '',
+                threshold.critical.text if threshold.critical else ''))
+        return ' '.join(["'thresholds_checked'=%d" % (len(results)),
+                         "'thresholds_warning'=%d" % (counts[WARNING]),
+                         "'thresholds_critical'=%d" % (counts[CRITICAL])] +
+                        perf[CRITICAL] + perf[WARNING])